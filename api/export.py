@@ -0,0 +1,177 @@
+import csv
+import io
+import json
+import zlib
+from abc import ABC, abstractmethod
+from datetime import timedelta
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import CharField
+from django.db.models.functions import Cast
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+
+from main.models import Bb, AdditionalImage, Comment, Rubric
+from main.storage import content_storage
+from .serializers import to_iso_datetime
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+CHUNK_SIZE = 2000  # строк, читаемых из базы и выводимых за раз
+# сжатие на ходу: уровень 1 втрое быстрее уровня 6 при выгрузке примерно на треть больше
+GZIP_LEVEL = 1
+
+
+class Export(ABC):
+    """Выгрузка всех записей модели частями по chunk_size строк. Без since выгружаются только
+    активные записи, с since - все, измененные (для комментариев - созданные) позже этого момента,
+    включая неактивные, чтобы получатель мог убрать их у себя. Записи читаются одним запросом
+    через iterator(), поэтому память не зависит от их количества"""
+    model = None
+    columns = ()  # поля выборки из базы
+    datetime_columns = ()
+    fields = ()  # поля выгрузки
+    since_field = None
+
+    def __init__(self, since=None, using=DEFAULT_DB_ALIAS, base_url='', chunk_size=CHUNK_SIZE):
+        self.since = since
+        self.using = using
+        self.base_url = base_url
+        self.chunk_size = chunk_size
+        self.tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        # SQLite хранит дату и время в UTC строкой 'ГГГГ-ММ-ДД ЧЧ:ММ:СС.ffffff', и при выводе в UTC
+        # ее достаточно переставить в ISO 8601: разбор в datetime и обратно - большая часть времени выгрузки
+        self.raw_datetimes = connections[using].vendor == 'sqlite' and self.tz is not None and \
+            self.tz.utcoffset(None) == timedelta(0)
+        self.count = 0
+
+    def get_queryset(self):
+        queryset = self.model.objects.using(self.using)
+        if self.since is not None:
+            return queryset.filter(**{self.since_field + '__gt': self.since})
+        return queryset.filter(is_active=True)
+
+    def get_values(self):
+        queryset = self.get_queryset().order_by('pk')
+        if not self.raw_datetimes:
+            return queryset.values_list(*self.columns)
+        queryset = queryset.annotate(**{'%s_text' % name: Cast(name, CharField()) for name in self.datetime_columns})
+        return queryset.values_list(*('%s_text' % name if name in self.datetime_columns else name
+                                      for name in self.columns))
+
+    def format_datetime(self, value):
+        if self.raw_datetimes:
+            return value.replace(' ', 'T') + 'Z'
+        return to_iso_datetime(value, self.tz)
+
+    @abstractmethod
+    def get_batch(self, rows):
+        """Строки части в порядке fields"""
+
+    def get_image_url(self, name):
+        return self.base_url + content_storage.base_url + filepath_to_uri(name) if name else None
+
+    def batches(self):
+        rows = self.get_values().iterator(chunk_size=self.chunk_size)
+        while True:
+            batch = list(islice(rows, self.chunk_size))
+            if not batch:
+                break
+            self.count += len(batch)
+            yield self.get_batch(batch)
+
+
+class BbExport(Export):
+    model = Bb
+    since_field = 'updated_at'
+    columns = ('id', 'rubric', 'title', 'content', 'price', 'contacts', 'image', 'is_active',
+               'created_at', 'updated_at')
+    datetime_columns = ('created_at', 'updated_at')
+    fields = ('id', 'rubric', 'rubric_name', 'super_rubric', 'super_rubric_name', 'title', 'content', 'price',
+              'contacts', 'image', 'images', 'is_active', 'created_at', 'updated_at')
+
+    def batches(self):
+        # рубрик немного: они читаются один раз, а не присоединяются к каждой строке объявлений
+        self.rubrics = {pk: (name, super_rubric) for pk, name, super_rubric in
+                        Rubric.objects.using(self.using).values_list('pk', 'name', 'super_rubric')}
+        return super().batches()
+
+    def get_images(self, first, last):
+        """Дополнительные иллюстрации объявлений части: записи идут по возрастанию ключа,
+        поэтому хватает одного запроса по диапазону"""
+        images = defaultdict(list)
+        for bb, name in AdditionalImage.objects.using(self.using).filter(bb__gte=first, bb__lte=last).order_by(
+                'pk').values_list('bb', 'image'):
+            images[bb].append(self.get_image_url(name))
+        return images
+
+    def get_batch(self, rows):
+        images = self.get_images(rows[0][0], rows[-1][0])
+        rubrics = self.rubrics
+        format_datetime = self.format_datetime
+        result = []
+        for pk, rubric, title, content, price, contacts, image, is_active, created_at, updated_at in rows:
+            rubric_name, super_rubric = rubrics.get(rubric, (None, None))
+            super_rubric_name = rubrics[super_rubric][0] if super_rubric in rubrics else None
+            result.append((pk, rubric, rubric_name, super_rubric, super_rubric_name, title, content, price,
+                           contacts, self.get_image_url(image), images.get(pk, []), is_active,
+                           format_datetime(created_at), format_datetime(updated_at)))
+        return result
+
+
+class CommentExport(Export):
+    model = Comment
+    since_field = 'created_at'
+    columns = fields = ('id', 'bb', 'author', 'content', 'is_active', 'created_at')
+    datetime_columns = ('created_at',)
+
+    def get_batch(self, rows):
+        format_datetime = self.format_datetime
+        return [row[:-1] + (format_datetime(row[-1]),) for row in rows]
+
+
+EXPORTS = {'bbs': BbExport, 'comments': CommentExport}
+
+
+def render_ndjson(fields, batch):
+    if orjson is not None:
+        return b''.join(orjson.dumps(dict(zip(fields, row)), option=orjson.OPT_APPEND_NEWLINE) for row in batch)
+    return ''.join(json.dumps(dict(zip(fields, row)), ensure_ascii=False, separators=(',', ':')) + '\n' for row in batch).encode()
+
+
+def render_csv(fields, batch):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([' '.join(value) if isinstance(value, list) else value for value in row] for row in batch)
+    return buffer.getvalue().encode()
+
+
+# формат: (функция вывода части, тип MIME, расширение файла)
+FORMATS = {
+    'ndjson': (render_ndjson, 'application/x-ndjson', 'ndjson'),
+    'csv': (render_csv, 'text/csv; charset=utf-8', 'csv'),
+}
+
+
+def stream_export(export, format='ndjson', compress=False):
+    """Генератор частей выгрузки export в формате format (bytes), при compress - сжатых gzip на ходу"""
+    render = FORMATS[format][0]
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+    if format == 'csv':
+        header = render(export.fields, [export.fields])
+        yield compressor.compress(header) if compressor else header
+    for batch in export.batches():
+        data = render(export.fields, batch)
+        if compressor:
+            data = compressor.compress(data)
+            if not data:  # gzip копит данные в своем буфере
+                continue
+        yield data
+    if compressor:
+        yield compressor.flush()
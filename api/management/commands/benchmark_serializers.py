@@ -0,0 +1,67 @@
+import timeit
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from main.models import Bb, Comment
+from api.renderers import FastJSONRenderer
+from api.serializers import BbSerializer, CommentSerializer, bb_values_serializer, comment_values_serializer
+
+
+def make_bbs(count):
+    """Объявления в памяти, без обращения к базе: измеряется только сериализация"""
+    now = timezone.now()
+    return [Bb(pk=i, rubric_id=1, author_id=1, title='Товар %d' % i, content='Описание товара номер %d. ' % i * 5,
+               price=i * 10.5, contacts='+7 900 000-00-00', created_at=now - timedelta(minutes=i))
+            for i in range(1, count + 1)]
+
+
+def make_comments(count):
+    now = timezone.now()
+    return [Comment(pk=i, bb_id=1, author='Гость %d' % i, content='Комментарий номер %d' % i,
+                    created_at=now - timedelta(minutes=i))
+            for i in range(1, count + 1)]
+
+
+def to_row(obj, serializer):
+    return {source: getattr(obj, source + '_id' if hasattr(obj, source + '_id') else source)
+            for name, source, to_representation in serializer.mappers}
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает скорость обычных сериализаторов API и быстрого пути через values()'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10, 100, 1000], help='Размеры выборок')
+        parser.add_argument('--repeat', type=int, default=5, help='Количество замеров, берется лучший')
+
+    def measure(self, func, repeat):
+        number, elapsed = timeit.Timer(func).autorange()
+        best = min(timeit.repeat(func, number=number, repeat=repeat))
+        return best / number * 1000
+
+    def handle(self, *args, **options):
+        cases = (('bbs', make_bbs, BbSerializer, bb_values_serializer),
+                 ('comments', make_comments, CommentSerializer, comment_values_serializer))
+        model_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+        self.stdout.write('%-10s %6s %14s %14s %8s' % ('данные', 'строк', 'DRF, мс', 'values(), мс', 'ускорение'))
+        for name, factory, serializer_class, values_serializer in cases:
+            for count in options['rows']:
+                objects = factory(count)
+                rows = [to_row(obj, values_serializer) for obj in objects]
+
+                def model_path():
+                    return model_renderer.render(serializer_class(objects, many=True).data)
+
+                def fast_path():
+                    return fast_renderer.render(values_serializer.serialize(rows))
+
+                if model_path() != fast_path():
+                    self.stderr.write('%s, %d строк: результаты сериализаторов различаются' % (name, count))
+                    continue
+                model_time = self.measure(model_path, options['repeat'])
+                fast_time = self.measure(fast_path, options['repeat'])
+                self.stdout.write('%-10s %6d %14.3f %14.3f %7.1fx' % (
+                    name, count, model_time, fast_time, model_time / fast_time))
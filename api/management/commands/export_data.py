@@ -0,0 +1,50 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.export import CHUNK_SIZE, EXPORTS, FORMATS, stream_export
+
+
+class Command(BaseCommand):
+    help = 'Выгрузка активных объявлений или комментариев в NDJSON или CSV (то же, что /api/export/)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help='Что выгружать')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson', help='Формат выгрузки')
+        parser.add_argument('--since', help='Только записи, измененные позже этого момента (ISO 8601), '
+                                            'включая неактивные')
+        parser.add_argument('--gzip', action='store_true', help='Сжимать выгрузку gzip')
+        parser.add_argument('--output', help='Файл выгрузки (по умолчанию - стандартный вывод)')
+        parser.add_argument('--base-url', default='', help='Начало адресов изображений, например https://example.com')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS, help='База данных, из которой выгружать')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='Строк, читаемых за раз')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            since = parse_datetime(options['since'])
+            if since is None:
+                raise CommandError('Неверный момент времени: %s' % options['since'])
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        next_since = timezone.now()
+        export = EXPORTS[options['kind']](since=since, using=options['database'], base_url=options['base_url'],
+                                          chunk_size=options['chunk_size'])
+        started = time.perf_counter()
+        output = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for part in stream_export(export, options['format'], options['gzip']):
+                output.write(part)
+        finally:
+            if options['output']:
+                output.close()
+            else:
+                output.flush()
+        elapsed = time.perf_counter() - started
+        self.stderr.write('Выгружено записей: %d за %.1f с (%.0f в секунду)' % (
+            export.count, elapsed, export.count / elapsed if elapsed else 0))
+        self.stderr.write('Для следующей выгрузки: --since %s' % next_since.isoformat())
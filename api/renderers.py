@@ -0,0 +1,37 @@
+import re
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # orjson - необязательная зависимость
+    orjson = None
+
+# места, где вывод orjson может отличаться от стандартного модуля json: числа с порядком (1e16 вместо 1e+16)
+# и малые числа без порядка (0.00001 вместо 1e-05), а также null, которым orjson заменяет NaN и бесконечность
+# (JSONRenderer при STRICT_JSON возбуждает исключение). Совпадение внутри строки лишь отправляет ответ
+# по медленному пути
+DIVERGENT_RE = re.compile(rb'\de|0\.0000|null')
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Формирование JSON с помощью orjson, если он установлен, иначе - как у обычного JSONRenderer.
+    Вывод побайтно совпадает с JSONRenderer при настройках по умолчанию (компактный JSON в UTF-8):
+    ответ, в котором orjson мог записать число или null иначе, формируется заново стандартным модулем json.
+    Ответы с отступами (параметр indent в Accept) сразу формируются стандартным модулем json"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or not self.compact or self.ensure_ascii or \
+                self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        encoder = self.encoder_class()
+        # даты, Decimal и прочие нестандартные значения преобразуются так же, как у DRF
+        try:
+            ret = orjson.dumps(data, default=encoder.default,
+                               option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS)
+        except orjson.JSONEncodeError:  # нестроковые ключи, слишком большие целые - json справится или сообщит об ошибке сам
+            return super().render(data, accepted_media_type, renderer_context)
+        if DIVERGENT_RE.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+        # как и JSONRenderer, экранируем разделители строк, недопустимые в JavaScript
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
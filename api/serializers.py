@@ -1,4 +1,11 @@
-from rest_framework import serializers
+import datetime
+from functools import partial
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 
 
 from main.models import Bb, Comment
@@ -10,6 +17,43 @@ class BbSerializer(serializers.ModelSerializer):
         fields = ('id', 'title', 'content', 'price', 'created_at')
 
 
+class BbSearchSerializer(BbSerializer):
+    title_highlight = serializers.CharField(read_only=True)
+    content_highlight = serializers.CharField(read_only=True)
+
+    class Meta(BbSerializer.Meta):
+        fields = BbSerializer.Meta.fields + ('rubric', 'title_highlight', 'content_highlight')
+
+
+class BbChangeSerializer(BbSerializer):
+    """Объявление для синхронизации по since: неактивные объявления тоже передаются,
+    чтобы клиент мог убрать их у себя"""
+    class Meta(BbSerializer.Meta):
+        fields = BbSerializer.Meta.fields + ('rubric', 'is_active', 'updated_at')
+
+
+class BbFilterSerializer(serializers.Serializer):
+    """Проверка параметров фильтрации списка объявлений"""
+    rubric = serializers.IntegerField(required=False, min_value=1)
+    super_rubric = serializers.IntegerField(required=False, min_value=1)
+    price_min = serializers.FloatField(required=False)
+    price_max = serializers.FloatField(required=False)
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    since = serializers.DateTimeField(required=False)
+
+
+class CommentFilterSerializer(serializers.Serializer):
+    after = serializers.DateTimeField(required=False)
+    after_id = serializers.IntegerField(required=False)  # ключ последнего полученного комментария с моментом after
+
+
+class ExportFilterSerializer(serializers.Serializer):
+    """Проверка параметров выгрузки"""
+    format = serializers.ChoiceField(choices=('ndjson', 'csv'), default='ndjson')
+    since = serializers.DateTimeField(required=False)
+
+
 class BbDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = Bb
@@ -22,3 +66,61 @@ class CommentSerializer(serializers.ModelSerializer):
         fields = ('bb', 'author', 'content', 'created_at')
 
 
+
+
+def to_iso_datetime(value, tz):
+    """То же, что DateTimeField.to_representation при формате ISO 8601, но с заранее найденным часовым поясом"""
+    if tz is not None:
+        value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+    elif timezone.is_aware(value):
+        value = timezone.make_naive(value, datetime.timezone.utc)
+    value = value.isoformat()
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+class ValuesSerializer:
+    """Быстрая сериализация только для чтения: строки берутся из queryset.values() и преобразуются
+    заранее подготовленными функциями полей. Набор полей, их порядок и представление значений
+    берутся из обычного сериализатора, поэтому результат совпадает с его выводом, но без создания
+    экземпляров моделей и обхода полей DRF для каждой записи"""
+
+    def __init__(self, serializer_class):
+        self.mappers = []
+        for name, field in serializer_class().fields.items():
+            if isinstance(field, serializers.PrimaryKeyRelatedField):
+                to_representation = None  # values() и так возвращает ключ связанной записи
+            elif isinstance(field, (serializers.FileField, serializers.RelatedField, serializers.BaseSerializer)):
+                raise ImproperlyConfigured('Поле %s.%s не поддерживается ValuesSerializer' % (
+                    serializer_class.__name__, name))
+            elif isinstance(field, serializers.DateTimeField) and not hasattr(field, 'timezone') and \
+                    getattr(field, 'format', api_settings.DATETIME_FORMAT).lower() == ISO_8601:
+                to_representation = to_iso_datetime  # часовой пояс определяется один раз на всю выборку
+            else:
+                to_representation = field.to_representation
+            self.mappers.append((name, field.source, to_representation))
+        self.sources = tuple(source for name, source, to_representation in self.mappers)
+
+    def values(self, queryset, *extra):
+        """Выборка нужных полей; extra - дополнительные поля, например ключ для курсора"""
+        return queryset.values(*self.sources, *extra)
+
+    def get_mappers(self):
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        return [(name, source, partial(to_iso_datetime, tz=tz) if to_representation is to_iso_datetime
+                 else to_representation) for name, source, to_representation in self.mappers]
+
+    def serialize(self, rows):
+        mappers = self.get_mappers()
+        result = []
+        for row in rows:
+            data = {}
+            for name, source, to_representation in mappers:
+                value = row[source]
+                data[name] = value if value is None or to_representation is None else to_representation(value)
+            result.append(data)
+        return result
+
+
+bb_values_serializer = ValuesSerializer(BbSerializer)
+bb_change_values_serializer = ValuesSerializer(BbChangeSerializer)
+comment_values_serializer = ValuesSerializer(CommentSerializer)
@@ -1,3 +1,126 @@
+import re
+from datetime import datetime, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from main.details import COMMENTS_PER_PAGE
+from main.models import AdvUser, SubRubric, Bb, Comment
+from .renderers import FastJSONRenderer
+
+
+class BbsApiTests(TestCase):
+    """Список объявлений: постраничный вывод по курсору и условные запросы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = AdvUser.objects.create_user('author', 'author@example.com')
+        cls.rubric = SubRubric.objects.create(name='Рубрика')
+        cls.bbs = [Bb.objects.create(rubric=cls.rubric, author=cls.author, title='Объявление %d' % i,
+                                     content='-', contacts='-', price=i) for i in range(12)]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_pages(self):
+        response = self.client.get('/api/bbs/')
+        self.assertEqual(len(response.json()), 10)
+        next_url = re.match(r'<([^>]+)>; rel="next"', response['Link']).group(1)
+        response = self.client.get(next_url)
+        self.assertEqual([bb['title'] for bb in response.json()], ['Объявление 1', 'Объявление 0'])
+        self.assertIn('rel="prev"', response['Link'])
+
+    def test_invalid_cursor(self):
+        for url in ('/api/bbs/', '/api/bbs/%s/comments/' % self.bbs[0].pk):
+            response = self.client.get(url, {'cursor': 'неверный'})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('cursor', response.json())
+
+    def test_conditional_get(self):
+        response = self.client.get('/api/bbs/')
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/api/bbs/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        # изменение в обход модели (другой процесс, update) кэш не сбрасывает, но ETag меняет сразу
+        Bb.objects.filter(pk=self.bbs[0].pk).update(title='Изменено', updated_at=timezone.now() + timedelta(seconds=1))
+        response = self.client.get('/api/bbs/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        Bb.objects.filter(pk=self.bbs[1].pk).update(is_active=False)  # количество тоже входит в ETag
+        self.assertEqual(self.client.get('/api/bbs/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class CommentsApiTests(TestCase):
+    """Комментарии к объявлению идут от старых к новым и постранично, и при подгрузке новых"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = AdvUser.objects.create_user('author', 'author@example.com')
+        cls.bb = Bb.objects.create(rubric=SubRubric.objects.create(name='Рубрика'), author=author,
+                                   title='Объявление', content='-', contacts='-')
+        cls.started = timezone.now() - timedelta(days=1)
+        for i in range(COMMENTS_PER_PAGE + 5):
+            comment = Comment.objects.create(bb=cls.bb, author='Гость %d' % i, content='-')
+            Comment.objects.filter(pk=comment.pk).update(created_at=cls.started + timedelta(minutes=i))
+        cls.url = '/api/bbs/%s/comments/' % cls.bb.pk
+
+    def get_authors(self, response):
+        return [comment['author'] for comment in response.json()]
+
+    def test_pages(self):
+        response = self.client.get(self.url)
+        self.assertEqual(self.get_authors(response), ['Гость %d' % i for i in range(COMMENTS_PER_PAGE)])
+        next_url = re.match(r'<([^>]+)>; rel="next"', response['Link']).group(1)
+        response = self.client.get(next_url)
+        self.assertEqual(self.get_authors(response),
+                         ['Гость %d' % i for i in range(COMMENTS_PER_PAGE, COMMENTS_PER_PAGE + 5)])
+        self.assertNotIn('rel="next"', response['Link'])
+
+    def test_after(self):
+        response = self.client.get(self.url, {'after': (self.started + timedelta(minutes=21, seconds=30)).isoformat()})
+        self.assertEqual(self.get_authors(response), ['Гость 22', 'Гость 23', 'Гость 24'])
+        self.assertFalse(response.has_header('Link'))
+
+    def test_after_same_moment(self):
+        # комментарии с одинаковым моментом создания не пропадают на границе ответов
+        moment = self.started + timedelta(hours=1)
+        for i in range(5):
+            comment = Comment.objects.create(bb=self.bb, author='Одновременно %d' % i, content='-')
+            Comment.objects.filter(pk=comment.pk).update(created_at=moment)
+        authors = []
+        params = {'after': (self.started + timedelta(minutes=30)).isoformat()}
+        with mock.patch('api.views.COMMENTS_AFTER_LIMIT', 2):
+            response = self.client.get(self.url, params)
+            authors += self.get_authors(response)
+            while response.has_header('Link'):
+                next_url = re.match(r'<([^>]+)>; rel="next"', response['Link']).group(1)
+                response = self.client.get(next_url)
+                authors += self.get_authors(response)
+        self.assertEqual(authors, ['Одновременно %d' % i for i in range(5)])
+
+
+class FastJSONRendererTests(TestCase):
+    """FastJSONRenderer выводит то же, что JSONRenderer, байт в байт"""
+
+    def assertSameOutput(self, data):
+        self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+    def test_payloads(self):
+        created_at = timezone.make_aware(datetime(2024, 5, 1, 12, 30, 15, 123456), timezone.utc)
+        self.assertSameOutput([{'id': i, 'title': 'Объявление «%d»\u2028' % i, 'content': 'строка\n"в кавычках"',
+                                'price': i * 1000.5, 'created_at': created_at, 'image': ''} for i in range(20)])
+        self.assertSameOutput({'price': Decimal('10.50'), 'date': created_at.date(), 'flags': [True, False]})
+        self.assertSameOutput({'image': None, 'count': 2 ** 70})  # null и целые больше 64 бит
+
+    def test_floats(self):
+        for value in (0.1, 1 / 3, 1e15, 1e16, 1.5e16, 1e300, 1e-4, 1e-5, 2.5e-5, 1e-7, -0.0):
+            with self.subTest(value=value):
+                self.assertSameOutput({'price': value})
 
-# Create your tests here.
+    def test_nan(self):
+        for value in (float('nan'), float('inf')):
+            with self.subTest(value=value), self.assertRaises(ValueError):  # как JSONRenderer при STRICT_JSON
+                FastJSONRenderer().render({'price': value})
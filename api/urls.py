@@ -1,10 +1,12 @@
 from django.urls import path
 
-from .views import bbs, BbDetailView, comments
+from .views import bbs, bbs_search, BbDetailView, comments, export
 
 urlpatterns =[
     path('bbs/', bbs),
+    path('bbs/search/', bbs_search),
     path('bbs/<int:pk>/', BbDetailView.as_view()),
     path('bbs/<int:pk>/comments/', comments),
+    path('export/<str:kind>/', export),
 
 ]
\ No newline at end of file
@@ -1,38 +1,233 @@
+import hashlib
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.db import router
+from django.db.models import Count, Max, Q
+from django.http import Http404, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
 
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.status import HTTP_201_CREATED, HTTP_400_BAD_REQUEST
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.generics import RetrieveAPIView
+from rest_framework.utils.urls import replace_query_param
 
+from main.delivery import get_accepted_encodings
+from main.details import get_bb_detail, COMMENTS_PER_PAGE
 from main.models import Bb, Comment
-from .serializers import BbSerializer, BbDetailSerializer, CommentSerializer
+from main.pagination import CursorPaginator
+from main.querychecks import query_budget
+from main.routers import read_from_replica
+from main.search import get_search_backend
+from main.sqlite import write_transaction
+from .export import EXPORTS, FORMATS, stream_export
+from .serializers import BbFilterSerializer, CommentFilterSerializer, BbSearchSerializer, BbDetailSerializer, \
+    CommentSerializer, ExportFilterSerializer, bb_values_serializer, bb_change_values_serializer, \
+    comment_values_serializer
+
+COMMENTS_AFTER_LIMIT = 100  # максимум новых комментариев в одном ответе на запрос с after
+
+
+def set_link_header(request, response, page):
+    """Ссылки на соседние страницы передаются в заголовке Link, тело ответа остается списком"""
+    links = []
+    if page.has_next():
+        links.append('<%s>; rel="next"' % replace_query_param(request.build_absolute_uri(), 'cursor', page.next_cursor))
+    if page.has_previous():
+        links.append('<%s>; rel="prev"' % replace_query_param(request.build_absolute_uri(), 'cursor', page.previous_cursor))
+    if links:
+        response['Link'] = ', '.join(links)
+
+
+def filter_bbs(params):
+    """Объявления, отобранные по проверенным параметрам запроса.
+    С параметром since возвращаются все объявления, измененные позже указанного момента, включая неактивные"""
+    if 'since' in params:
+        bbs = Bb.objects.filter(updated_at__gt=params['since'])
+    else:
+        bbs = Bb.objects.filter(is_active=True)
+    if 'rubric' in params:
+        bbs = bbs.filter(rubric=params['rubric'])
+    if 'super_rubric' in params:
+        bbs = bbs.filter(rubric__super_rubric=params['super_rubric'])
+    if 'price_min' in params:
+        bbs = bbs.filter(price__gte=params['price_min'])
+    if 'price_max' in params:
+        bbs = bbs.filter(price__lte=params['price_max'])
+    if 'date_from' in params:
+        bbs = bbs.filter(created_at__gte=timezone.make_aware(datetime.combine(params['date_from'], time.min)))
+    if 'date_to' in params:
+        bbs = bbs.filter(created_at__lte=timezone.make_aware(datetime.combine(params['date_to'], time.max)))
+    return bbs
+
+
+def get_cursor_page(request, paginator):
+    """Страница по параметру cursor. Неверный курсор - ошибка 400, как и другие неверные параметры"""
+    cursor = request.query_params.get('cursor')
+    if cursor and paginator.decode_cursor(cursor) is None:
+        raise ValidationError({'cursor': ['Неверный курсор.']})
+    return paginator.get_page(cursor)
+
+
+def get_bbs_state(bbs):
+    """Время последнего изменения и количество объявлений выборки, полученные одним агрегатным запросом.
+    Состояние не кэшируется: запись из другого процесса или в обход сигналов сразу меняет ETag"""
+    return bbs.order_by().aggregate(updated_at=Max('updated_at'), count=Count('pk'))
 
+
+@query_budget(6)
+@read_from_replica
 @api_view(['GET'])  #проверка на тип запроса
 def bbs(request):
+    """Список объявлений с постраничным выводом по курсору.
+    Параметры: rubric, super_rubric, price_min, price_max, date_from, date_to - фильтры,
+    since - только объявления, измененные позже этого момента (для синхронизации клиента).
+    Ответ снабжается ETag и Last-Modified, неизменный список отдается кодом 304 без сериализации"""
     if request.method == 'GET':
-        bbs = Bb.objects.filter(is_active=True)[:10]
-        serializer = BbSerializer(bbs, many=True)
-        return Response(serializer.data)
+        filters = BbFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        bbs = filter_bbs(filters.validated_data)
+        state = get_bbs_state(bbs)
+        # удаление объявления не меняет максимальное время изменения, зато меняет количество
+        etag = '"%s"' % hashlib.md5(('%s:%s:%s' % (request.get_full_path(), state['updated_at'],
+                                                    state['count'])).encode()).hexdigest()
+        last_modified = int(state['updated_at'].timestamp()) if state['updated_at'] else None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            response['ETag'] = etag
+            return response
+        if 'since' in filters.validated_data:
+            serializer = bb_change_values_serializer
+            paginator = CursorPaginator(serializer.values(bbs), 10, field='updated_at')
+        else:
+            serializer = bb_values_serializer
+            paginator = CursorPaginator(serializer.values(bbs), 10)
+        page = get_cursor_page(request, paginator)
+        response = Response(serializer.serialize(page.object_list))
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified)
+        set_link_header(request, response, page)
+        if request.query_params.get('count'):
+            response['X-Total-Count'] = state['count']
+        return response
+
 
+@api_view(['GET'])
+def bbs_search(request):
+    """Поиск объявлений во всех рубриках, параметр q - ключевые слова, rubric - необязательная рубрика"""
+    keyword = request.query_params.get('q', '')
+    if not keyword:
+        return Response([])
+    bbs = Bb.objects.filter(is_active=True)
+    if request.query_params.get('rubric', '').isdigit():
+        bbs = bbs.filter(rubric=request.query_params['rubric'])
+    search_backend = get_search_backend()
+    bbs = search_backend.highlight(search_backend.search(bbs, keyword)[:10], keyword)
+    serializer = BbSearchSerializer(bbs, many=True)
+    return Response(serializer.data)
 
+
+@method_decorator(read_from_replica, name='dispatch')
 class BbDetailView(RetrieveAPIView):
     queryset = Bb.objects.filter(is_active=True)
     serializer_class = BbDetailSerializer
 
+    def get_object(self):
+        return get_bb_detail(self.kwargs['pk'])  # тот же закэшированный объект, что и на странице объявления
+
 
+@query_budget(8)
 @api_view(['GET', 'POST'])
 @permission_classes((IsAuthenticatedOrReadOnly,))  # действия доступны только активированным пользователям, остальным только чтение
 def comments(request, pk):
+    """Комментарии к объявлению, всегда от старых к новым, как и до постраничного вывода.
+    Без параметров - первая страница, следующие - по ссылке из заголовка Link (параметр cursor).
+    С параметром after - только комментарии, появившиеся позже этого момента (для подгрузки новых),
+    продолжение - по ссылке из Link (параметры after и after_id)"""
     if request.method == 'POST':  #если получен пост запрос - добавление нового комментария
         serializer = CommentSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
+            write_transaction(serializer.save)()
             return Response(serializer.data, status=HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=HTTP_400_BAD_REQUEST)
     else:  # если нет, то просто просмотр
-        comments = Comment.objects.filter(is_active=True, bb=pk)
-        serializer = CommentSerializer(comments, many=True)
-        return Response(serializer.data)
+        filters = CommentFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        comments = comment_values_serializer.values(Comment.objects.filter(is_active=True, bb=pk), 'id')
+        if 'after' in filters.validated_data:
+            # только комментарии, появившиеся после указанного момента, от старых к новым.
+            # Позиция - пара (created_at, id): комментарии с одинаковым моментом создания не теряются на границе
+            after = filters.validated_data['after']
+            position = Q(created_at__gt=after)
+            if 'after_id' in filters.validated_data:
+                position |= Q(created_at=after, id__gt=filters.validated_data['after_id'])
+            comments = comments.filter(position).order_by('created_at', 'id')
+            rows = list(comments[:COMMENTS_AFTER_LIMIT + 1])
+            response = Response(comment_values_serializer.serialize(rows[:COMMENTS_AFTER_LIMIT]))
+            if len(rows) > COMMENTS_AFTER_LIMIT:
+                last = rows[COMMENTS_AFTER_LIMIT - 1]
+                url = replace_query_param(request.build_absolute_uri(), 'after', last['created_at'].isoformat())
+                response['Link'] = '<%s>; rel="next"' % replace_query_param(url, 'after_id', last['id'])
+            return response
+        page = get_cursor_page(request, CursorPaginator(comments, COMMENTS_PER_PAGE, descending=False))
+        response = Response(comment_values_serializer.serialize(page.object_list))
+        set_link_header(request, response, page)
+        return response
+
+
+def is_export_allowed(request):
+    """Выгрузка доступна персоналу сайта и партнерам с ключом из BBOARD_EXPORT_TOKENS
+    в заголовке Authorization: Bearer <ключ>"""
+    if request.user.is_staff:
+        return True
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return scheme.lower() == 'bearer' and bool(token) and \
+        any(constant_time_compare(token, allowed) for allowed in getattr(settings, 'BBOARD_EXPORT_TOKENS', ()))
+
+
+@read_from_replica
+@require_safe
+def export(request, kind):
+    """Потоковая выгрузка всех активных объявлений (kind - bbs) или комментариев (comments).
+    Параметры: format - ndjson (по умолчанию) или csv, since - только записи, измененные позже
+    этого момента, включая неактивные. Заголовок X-Next-Since - значение since для следующей выгрузки.
+    Клиенту, принимающему gzip, ответ сжимается на ходу"""
+    if kind not in EXPORTS:
+        raise Http404('Неизвестная выгрузка')
+    if not is_export_allowed(request):
+        return JsonResponse({'detail': 'Нет доступа к выгрузке'}, status=403)
+    filters = ExportFilterSerializer(data=request.GET)
+    if not filters.is_valid():
+        return JsonResponse(filters.errors, status=400)
+    export_class = EXPORTS[kind]
+    using = router.db_for_read(export_class.model)
+    next_since = timezone.now()
+    if using in getattr(settings, 'BBOARD_DATABASE_REPLICAS', ()):
+        # записи, еще не дошедшие до реплики, попадут в следующую выгрузку; повторы получатель
+        # обновляет по id
+        next_since -= timedelta(seconds=getattr(settings, 'BBOARD_REPLICA_MAX_LAG', 2))
+    export = export_class(since=filters.validated_data.get('since'), using=using,
+                          base_url=request.build_absolute_uri('/')[:-1])
+    format = filters.validated_data['format']
+    compress = 'gzip' in get_accepted_encodings(request)
+    content_type, extension = FORMATS[format][1:]
+    response = StreamingHttpResponse(stream_export(export, format, compress), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="%s-%s.%s"' % (
+        kind, next_since.strftime('%Y%m%dT%H%M%S'), extension)
+    response['X-Next-Since'] = next_since.isoformat()
+    response['Cache-Control'] = 'no-store'
+    if compress:
+        response['Content-Encoding'] = 'gzip'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -9,8 +9,8 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
-
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bboard.settings')
 
+from main.asgi import get_asgi_application  # noqa: E402 - обработчик читает настройки, импорт после DJANGO_SETTINGS_MODULE
+
 application = get_asgi_application()
@@ -49,6 +49,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.middlewares.ServerTimingMiddleware',  # первым, чтобы замеры охватывали весь запрос
+    'main.middlewares.QueryChecksMiddleware',
+    'main.middlewares.ReplicaRoutingMiddleware',  # до SessionMiddleware: сохранение сессии - запись в базу
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -64,7 +67,7 @@ ROOT_URLCONF = 'bboard.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'main.timing.DjangoTemplates',  # обычный шаблонизатор Django с замером времени
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -89,6 +92,33 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'bboard.data'),
+        'CONN_MAX_AGE': 600,  # соединения с параметрами из BBOARD_SQLITE_PRAGMAS не открываются на каждый запрос
+    }
+}
+
+# реплики только для чтения: на них ходят списки объявлений (main.routers.read_from_replica).
+# Для проверки на одном компьютере репликой служит копия базы, обновляемая командой sync_replica:
+# DATABASES['replica'] = dict(DATABASES['default'], NAME=os.path.join(BASE_DIR, 'bboard-replica.data'),
+#                             TEST={'MIRROR': 'default'})
+# BBOARD_DATABASE_REPLICAS = ('replica',)
+BBOARD_DATABASE_REPLICAS = ()
+BBOARD_REPLICA_MAX_LAG = 2  # реплика, отставшая больше чем на столько секунд, не используется
+BBOARD_REPLICA_LAG_CHECK_INTERVAL = 5  # как часто замерять отставание реплик, секунд
+BBOARD_REPLICA_PIN_TIME = 10  # сколько секунд после записи пользователь читает только основную базу
+
+DATABASE_ROUTERS = ['main.routers.PrimaryReplicaRouter']
+
+# кэш должен быть общим для всех процессов сайта: веб-процессов, обработчика очереди (run_jobs) и команд
+# управления. На нем построены версии групп кэша (main.utilities.bump_cache_version), счетчики рубрик
+# (main.facets) и замеры отставания реплик: с отдельным кэшем в каждом процессе (LocMemCache) сброс,
+# выполненный фоновой задачей или командой, веб-процессы не увидят (проверка main.W001).
+# По умолчанию - файловый кэш, общий для процессов одного сервера; для нескольких серверов -
+# Memcached: BBOARD_CACHE_BACKEND=django.core.cache.backends.memcached.PyLibMCCache, BBOARD_CACHE_LOCATION=адрес:порт
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('BBOARD_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('BBOARD_CACHE_LOCATION', os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {'MAX_ENTRIES': 100000},  # при 300 по умолчанию вытеснялись бы и ключи версий
     }
 }
 
@@ -135,10 +165,15 @@ STATICFILES_DIRS = [
     os.path.join(BASE_DIR, 'static', 'main'),
     os.path.join(BASE_DIR, 'static'),
 ]
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')  # сюда collectstatic собирает файлы с хэшем в имени и сжатые копии
+STATICFILES_STORAGE = 'main.staticfiles.CompressedManifestStaticFilesStorage'
 
 AUTH_USER_MODEL = 'main.AdvUser'
 
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+EMAIL_BACKEND = 'main.outbox.OutboxEmailBackend'  # письма сохраняются в таблицу исходящих и отправляются командой send_outbox
+BBOARD_OUTBOX_EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'  # бэкенд, через который send_outbox отправляет письма
+BBOARD_OUTBOX_MAX_ATTEMPTS = 5
+BBOARD_COMMENT_DIGEST_INTERVAL = 60 * 60  # не чаще одной сводки новых комментариев в час на пользователя
 EMAIL_HOST = 'smtp.gmail.com'
 EMAIL_PORT = 587
 EMAIL_USE_TLS = True
@@ -147,6 +182,13 @@ EMAIL_USE_TLS = True
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# статические и загруженные файлы отдает main.delivery; False - если их целиком отдает фронтовой сервер
+BBOARD_SERVE_FILES = True
+# None - файлы отдает Django; 'nginx' - заголовок X-Accel-Redirect (нужен internal location
+# BBOARD_MEDIA_ACCEL_PREFIX с alias на MEDIA_ROOT); 'sendfile' - заголовок X-Sendfile
+BBOARD_MEDIA_ACCEL = None
+BBOARD_MEDIA_ACCEL_PREFIX = '/protected-media/'
+
 
 THUMBNAIL_ALIASES = {
         '': {
@@ -154,9 +196,72 @@ THUMBNAIL_ALIASES = {
                 'size':(96,96),
                 'crop': 'scale',
             },
+            'default_2x': {  # вариант для экранов с двойной плотностью пикселей (srcset)
+                'size': (192, 192),
+                'crop': 'scale',
+            },
     },
 }
 THUMBNAIL_BASEDIR = 'thumbnails'
 
+# обработка загружаемых изображений (main.images)
+BBOARD_IMAGE_MAX_SIZE = (1920, 1920)  # большие изображения уменьшаются до этих размеров
+BBOARD_IMAGE_QUALITY = 85  # качество JPEG при пересжатии
+BBOARD_IMAGE_WORKERS = 4  # потоков для одновременной обработки изображений одной формы
+# файл, использованный не раньше чем за столько секунд до постановки в очередь на удаление, удаляется позже:
+# одинаковые загрузки хранятся одним файлом (main.storage), и запись с новой ссылкой на него могла еще не сохраниться
+BBOARD_MEDIA_PURGE_GRACE = 60
+
+BBOARD_JOB_MAX_ATTEMPTS = 5  # попыток выполнения фоновой задачи до пометки ее как неудачной
+BBOARD_JOB_RETRY_DELAY = 30  # задержка перед первой повторной попыткой, секунд (далее растет вдвое)
+
+BBOARD_PAGE_CACHE_TIMEOUT = 60 * 5  # время хранения страниц для анонимных посетителей, секунд
+BBOARD_DETAIL_CACHE_TIMEOUT = 60 * 10  # время хранения загруженных объявлений для страниц просмотра, секунд
+
+# границы ценовых диапазонов фильтра объявлений рубрики (main.facets), по возрастанию
+BBOARD_PRICE_BUCKETS = (1000, 10000, 100000, 1000000)
+# время хранения счетчиков объявлений рубрики, секунд; между пересчетами они обновляются при изменении объявлений
+BBOARD_FACETS_TIMEOUT = 60 * 60
+
+# потоков, в которых main.asgi.ASGIHandler выполняет представления при работе через ASGI (bboard.asgi);
+# каждому потоку нужно свое соединение с базой данных
+BBOARD_ASGI_THREADS = 16
+
+BBOARD_SERVER_TIMING = True  # отправлять заголовок Server-Timing с замерами запроса
+BBOARD_SLOW_REQUEST_TIME = 1.0  # запросы дольше стольких секунд записываются в журнал main.middlewares
+BBOARD_SLOW_REQUEST_QUERIES = 50  # ... как и запросы, выполнившие столько SQL-запросов или больше
+
+# проверки SQL-запросов (main.querychecks): в работе ('log') проблемы N+1 и превышение бюджета запросов
+# записываются в журнал для выборки из запросов, в тестах (bboard.settings_test) - 'raise', исключения.
+# Переменная окружения BBOARD_QUERY_CHECKS задает режим явно, пустая строка отключает проверки
+BBOARD_QUERY_CHECKS = os.environ.get('BBOARD_QUERY_CHECKS', 'log') or None
+BBOARD_QUERY_CHECKS_SAMPLE_RATE = 0.01  # доля проверяемых запросов в режиме 'log'
+BBOARD_NPLUSONE_THRESHOLD = 5  # столько одинаковых запросов из одной строки кода считаются проблемой N+1
+
+# параметры каждого соединения с SQLite (main.sqlite); отдельной базе можно задать свои ключом PRAGMAS
+BBOARD_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',  # чтение не ждет записи
+    'synchronous': 'NORMAL',  # в режиме WAL не теряет целостность, только последние транзакции при отключении питания
+    'busy_timeout': 5000,  # ожидание блокировки, миллисекунд
+    'cache_size': -20000,  # кэш страниц, КиБ
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+BBOARD_WRITE_ATTEMPTS = 5  # попыток транзакции write_transaction при блокировке базы
+BBOARD_WRITE_RETRY_DELAY = 0.05  # задержка перед первым повтором, секунд (далее растет вдвое)
+
+# ключи партнеров для выгрузки /api/export/ (заголовок Authorization: Bearer <ключ>);
+# без ключа выгрузка доступна только персоналу сайта
+BBOARD_EXPORT_TOKENS = ()
+
+BBOARD_SEARCH_BACKEND = 'main.search.SQLiteFTSBackend'  # для СУБД без FTS5 - 'main.search.SimpleSearchBackend'
+
 CORS_ORIGIN_ALLOW_ALL = True
-CORS_URLS_REGEX = r'^/api/.*$'
\ No newline at end of file
+CORS_URLS_REGEX = r'^/api/.*$'
+REST_FRAMEWORK = {
+    # FastJSONRenderer использует orjson, если он установлен, и ведет себя как JSONRenderer, если нет
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+}
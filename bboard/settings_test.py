@@ -0,0 +1,11 @@
+"""Настройки для тестов: python manage.py test (выбираются по умолчанию) или
+DJANGO_SETTINGS_MODULE=bboard.settings_test для других средств запуска"""
+
+from .settings import *  # noqa: F401,F403
+
+# проблемы N+1 и превышение бюджета запросов - исключения
+BBOARD_QUERY_CHECKS = 'raise'
+
+# у каждого запуска тестов свой пустой кэш; общий кэш (см. CACHES в settings) тестам не нужен
+CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'bboard-test'}}
+BBOARD_PROCESS_LOCAL_CACHE = True
@@ -1,8 +1,8 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
-from django.contrib.staticfiles.views import serve
-from django.views.decorators.cache import never_cache
+
+from main.delivery import serve_static, serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -11,5 +11,8 @@ urlpatterns = [
     path('api/', include('api.urls')),
 ]
 
-if settings.DEBUG:
-    urlpatterns.append(path('static/<path:path>', never_cache(serve)))
\ No newline at end of file
+if settings.BBOARD_SERVE_FILES:
+    urlpatterns += [
+        path(settings.STATIC_URL.lstrip('/') + '<path:path>', serve_static),
+        path(settings.MEDIA_URL.lstrip('/') + '<path:path>', serve_media),
+    ]
\ No newline at end of file
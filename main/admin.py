@@ -1,9 +1,12 @@
 from django.contrib import admin
 import datetime
+from django.utils import timezone
 
-from .models import AdvUser, SuperRubric, SubRubric, Bb, AdditionalImage, Comment
+from .models import AdvUser, SuperRubric, SubRubric, Bb, AdditionalImage, Comment, Job, OutboxEmail, ImportCheckpoint
 from .utilities import send_activation_notification
 from .forms import SubRubricForm
+from .deletion import delete_bbs, delete_users
+from .images import normalize_uploads
 
 
 def send_activation_notifications(modeladmin, request, queryset):
@@ -53,6 +56,9 @@ class AdvUserAdmin(admin.ModelAdmin):
     readonly_fields = ('last_login', 'date_joined')   #поля,  доступные только для чтения. Их нельзя изменить
     actions = (send_activation_notifications,)
 
+    def delete_queryset(self, request, queryset):
+        delete_users(queryset)  # объявления удаляются массово, файлы - фоновой задачей
+
 
 class SubRubricInline(admin.TabularInline):  #Объекты подрубрики
     model = SubRubric
@@ -80,9 +86,21 @@ class AdditionalImageInline(admin.TabularInline):
 
 class BbAdmin(admin.ModelAdmin):
     list_display = ('rubric', 'title', 'content', 'author', 'created_at')
+    list_select_related = ('rubric__super_rubric', 'author')  # рубрика выводится вместе с надрубрикой
     fields = (('rubric', 'author'), 'title', 'content', 'price', 'contacts', 'image', 'is_active')
     inlines = (AdditionalImageInline,)
 
+    def delete_queryset(self, request, queryset):
+        delete_bbs(queryset)  # тот же путь, что и при удалении пользователя
+
+    def save_model(self, request, obj, form, change):
+        normalize_uploads([form])  # изображения обрабатываются так же, как при загрузке с сайта
+        super().save_model(request, obj, form, change)
+
+    def save_formset(self, request, form, formset, change):
+        normalize_uploads(formset.forms)
+        super().save_formset(request, form, formset, change)
+
 admin.site.register(Bb, BbAdmin)
 
 
@@ -93,3 +111,37 @@ class CommentAdmin(admin.ModelAdmin):
     readonly_fields = ('created_at',)
 
 admin.site.register(Comment, CommentAdmin)
+
+
+class JobAdmin(admin.ModelAdmin):
+    """Очередь фоновых задач. Здесь можно найти задачи, исчерпавшие попытки, и их ошибки"""
+    list_display = ('name', 'payload', 'attempts', 'run_after', 'is_failed')
+    list_filter = ('name', 'is_failed')
+    readonly_fields = ('created_at',)
+
+admin.site.register(Job, JobAdmin)
+
+
+def retry_emails(modeladmin, request, queryset):
+    """Повторная отправка недоставленных писем"""
+    queryset.update(is_failed=False, attempts=0, send_after=timezone.now())
+    modeladmin.message_user(request, 'Письма поставлены на повторную отправку')
+retry_emails.short_description = 'Отправить повторно'
+
+
+class OutboxEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'attempts', 'send_after', 'is_failed')
+    list_filter = ('is_failed',)
+    search_fields = ('recipients',)
+    readonly_fields = ('created_at',)
+    actions = (retry_emails,)
+
+admin.site.register(OutboxEmail, OutboxEmailAdmin)
+
+
+class ImportCheckpointAdmin(admin.ModelAdmin):
+    """Ход импорта командой import_bbs. Удаление контрольной точки - то же, что import_bbs --restart"""
+    list_display = ('name', 'position', 'imported', 'rejected', 'updated_at')
+    readonly_fields = ('updated_at',)
+
+admin.site.register(ImportCheckpoint, ImportCheckpointAdmin)
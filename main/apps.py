@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class MainConfig(AppConfig):
     name = 'main'
-    verbose_name = 'Доска объявлений'
\ No newline at end of file
+    verbose_name = 'Доска объявлений'
+
+    def ready(self):
+        from .search import install_search_index
+        from . import checks, thumbnails, images, notifications, deletion, sqlite, facets  # регистрация проверок, фоновых задач и обработчиков сигналов
+        post_migrate.connect(install_search_index, sender=self)  # триггеры поискового индекса могут пропасть при пересоздании таблицы
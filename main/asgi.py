@@ -0,0 +1,58 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler as DjangoASGIHandler
+from django.db import close_old_connections
+
+STREAM_END = object()
+
+
+class ASGIHandler(DjangoASGIHandler):
+    """Обработчик ASGI, который выполняет представления одновременно в пуле из BBOARD_ASGI_THREADS потоков.
+    Стандартный обработчик Django 3.0 вызывает синхронные представления через sync_to_async, и с
+    asgiref 3.3 и новее все запросы процесса выполняются по очереди в одном потоке. Прием тела запроса
+    и отправка готового ответа медленному клиенту идут в цикле событий и поток пула не занимают.
+    Части потоковых ответов (FileResponse, выгрузки) также формируются в пуле, а не в цикле событий"""
+
+    def __init__(self, threads=None):
+        super().__init__()
+        self.executor = ThreadPoolExecutor(threads or getattr(settings, 'BBOARD_ASGI_THREADS', 16),
+                                           thread_name_prefix='asgi')
+
+    def run_in_thread(self, func):
+        return sync_to_async(func, thread_sensitive=False, executor=self.executor)
+
+    def get_response_in_thread(self, request):
+        # сигнал request_started закрывает устаревшие соединения только в главном потоке
+        close_old_connections()
+        return super().get_response(request)
+
+    async def get_response(self, request):
+        return await self.run_in_thread(self.get_response_in_thread)(request)
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        response_headers = [(header.encode('ascii'), value.encode('latin1')) for header, value in response.items()]
+        for cookie in response.cookies.values():
+            response_headers.append((b'Set-Cookie', cookie.output(header='').encode('ascii').strip()))
+        await send({'type': 'http.response.start', 'status': response.status_code, 'headers': response_headers})
+        parts = iter(response)
+        next_part = self.run_in_thread(lambda: next(parts, STREAM_END))
+        try:
+            while True:
+                part = await next_part()
+                if part is STREAM_END:
+                    break
+                for chunk, last in self.chunk_bytes(part):
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body'})
+        finally:
+            await self.run_in_thread(response.close)()
+
+
+def get_asgi_application():
+    import django
+    django.setup(set_prefix=False)
+    return ASGIHandler()
@@ -0,0 +1,352 @@
+import asyncio
+import io
+import math
+import os
+import random
+import re
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connection, connections, transaction
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import URLPattern, URLResolver, get_resolver
+from django.urls.resolvers import RoutePattern
+from django.utils import timezone
+
+from .asgi import ASGIHandler
+from .details import COMMENTS_PER_PAGE
+from .models import Bb, Comment
+from .sqlite import copy_database, write_transaction
+
+PARAM_RE = re.compile(r'<(?:\w+:)?(\w+)>')
+# GET-запросы к этим маршрутам меняют данные или состояние клиента (profile_bb_delete удаляет объявление сразу)
+SKIPPED_ROUTES = ('accounts/logout/', 'accounts/profile/delete/<int:pk>')
+DEFAULT_HOST = 'testserver'  # как у тестового клиента Django
+BASELINE_PRAGMAS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}  # значения SQLite по умолчанию
+
+
+def collect_routes(urlconf, prefix='/'):
+    """Маршруты приложения без параметров-регулярных выражений: ('/путь/<int:pk>/', ...)"""
+    routes = []
+
+    def walk(patterns, base):
+        for pattern in patterns:
+            if not isinstance(pattern.pattern, RoutePattern):
+                continue  # static() и подобные маршруты на регулярных выражениях не замеряются
+            route = base + str(pattern.pattern)
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns, route)
+            elif isinstance(pattern, URLPattern) and route[len(prefix):] not in SKIPPED_ROUTES:
+                routes.append(route)
+
+    walk(get_resolver(urlconf).url_patterns, prefix)
+    return routes
+
+
+def get_samples():
+    """Записи, подставляемые в параметры маршрутов: активное объявление с наибольшим числом комментариев"""
+    comment = Comment.objects.filter(is_active=True, bb__is_active=True).values('bb').annotate(
+        count=Count('pk')).order_by('-count').first()
+    if comment is not None:
+        bb = Bb.objects.get(pk=comment['bb'])
+    else:
+        bb = Bb.objects.filter(is_active=True).first()
+    if bb is None:
+        return None
+    return {'bb': bb.pk, 'rubric': bb.rubric_id, 'author': bb.author}
+
+
+def build_url(route, samples):
+    """URL для маршрута или None, если значения для какого-то из параметров нет"""
+    def value(match):
+        name = match.group(1)
+        if name == 'pk':
+            # единственный маршрут, где pk - ключ рубрики, а не объявления
+            return str(samples['rubric'] if route == '/<int:pk>/' else samples['bb'])
+        if name == 'rubric_pk':
+            return str(samples['rubric'])
+        if name == 'page':
+            return 'about'
+        raise KeyError(name)
+
+    try:
+        return PARAM_RE.sub(value, route)
+    except KeyError:
+        return None
+
+
+@contextmanager
+def allowed_host(host):
+    """Разрешение заголовка Host замера на время замера, как делает для testserver запуск тестов Django.
+    Запросы выполняются в этом же процессе, и без этого при DEBUG=False все ответы были бы 400"""
+    hosts = list(settings.ALLOWED_HOSTS)
+    if host in hosts or '*' in hosts:
+        yield
+        return
+    with override_settings(ALLOWED_HOSTS=hosts + [host]):
+        yield
+
+
+def percentile(values, fraction):
+    """Перцентиль по отсортированному списку методом ближайшего ранга"""
+    if not values:
+        return None
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+class Benchmark:
+    """Нагрузочный замер: каждый URL запрашивается requests раз из пула workers потоков.
+    Запросы выполняются тестовым клиентом Django в этом же процессе, поэтому вместе со временем
+    ответа известно и количество SQL-запросов. Страницы, требующие входа, запрашиваются от имени
+    автора объявления-образца"""
+
+    def __init__(self, workers=8, requests=50, host=DEFAULT_HOST, progress=None):
+        self.workers = workers
+        self.requests = requests
+        self.host = host
+        self.progress = progress or (lambda message: None)
+        self.local = threading.local()
+
+    def get_client(self, login):
+        clients = getattr(self.local, 'clients', None)
+        if clients is None:
+            clients = self.local.clients = {False: Client(HTTP_HOST=self.host), True: Client(HTTP_HOST=self.host)}
+            clients[True].force_login(self.user)
+        return clients[login]
+
+    def fetch(self, url, login):
+        client = self.get_client(login)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.get(url)
+            elapsed = time.perf_counter() - started
+        return elapsed, len(queries), response.status_code
+
+    def needs_login(self, url):
+        response = Client(HTTP_HOST=self.host).get(url)
+        return response.status_code == 302 and '/accounts/login/' in response.get('Location', '')
+
+    def measure(self, executor, url):
+        login = self.needs_login(url)
+        self.fetch(url, login)  # прогрев: кэши и ленивые импорты не должны попадать в замер
+        started = time.perf_counter()
+        samples = list(executor.map(lambda i: self.fetch(url, login), range(self.requests)))
+        wall = time.perf_counter() - started
+        latencies = sorted(elapsed for elapsed, queries, status in samples)
+        queries = [queries for elapsed, queries, status in samples]
+        statuses = sorted({status for elapsed, queries, status in samples})
+        return {'url': url, 'login': login, 'status': statuses, 'requests': len(samples),
+                'rps': len(samples) / wall if wall else None,
+                'mean_ms': sum(latencies) / len(latencies) * 1000,
+                'p50_ms': percentile(latencies, 0.5) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000,
+                'queries': sum(queries) / len(queries), 'max_queries': max(queries)}
+
+    def run(self, routes, only=None):
+        samples = get_samples()
+        if samples is None:
+            raise ValueError('В базе нет активных объявлений, сначала выполните generate_data')
+        self.user = samples['author']
+        results = []
+        with allowed_host(self.host), ThreadPoolExecutor(self.workers) as executor:
+            for route in routes:
+                url = build_url(route, samples)
+                if url is None or (only and not any(part in url for part in only)):
+                    continue
+                result = self.measure(executor, url)
+                result['route'] = route
+                self.progress(result)
+                results.append(result)
+        return results
+
+
+@contextmanager
+def database_copy(pragmas, alias='benchmark'):
+    """Временная копия основной базы SQLite, доступная под псевдонимом alias, с заданными параметрами
+    соединений (None - параметры из настроек). Замер на копии не меняет рабочие данные"""
+    source = connections[DEFAULT_DB_ALIAS]
+    if source.vendor != 'sqlite':
+        raise ValueError('Замер блокировок выполняется только для SQLite')
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'bboard.data')
+    copy_database(source, path)
+    connections.databases[alias] = dict(source.settings_dict, NAME=path, PRAGMAS=pragmas, CONN_MAX_AGE=0)
+    try:
+        connections[alias].ensure_connection()  # journal_mode меняется, пока к копии нет других соединений
+        connections[alias].close()
+        yield alias
+    finally:
+        connections[alias].close()
+        del connections[alias]  # иначе следующая копия откроется по пути этой
+        del connections.databases[alias]
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class WriteContention:
+    """Замер чтения во время записи: readers потоков читают главную страницу и комментарии,
+    writers потоков добавляют комментарии и изменяют объявления, всё в течение duration секунд.
+    При retry запись идет через write_transaction, иначе - в обычной транзакции"""
+
+    def __init__(self, readers=8, writers=2, duration=10, retry=True):
+        self.readers = readers
+        self.writers = writers
+        self.duration = duration
+        self.retry = retry
+
+    def read(self, alias, bb_ids):
+        list(Bb.objects.using(alias).filter(is_active=True).select_related('rubric')[:10])
+        list(Comment.objects.using(alias).filter(bb=random.choice(bb_ids), is_active=True)[:COMMENTS_PER_PAGE])
+
+    def write(self, alias, bb_ids):
+        pk = random.choice(bb_ids)
+        # bulk_create и update не отправляют сигналов: фоновые задачи в рабочей базе не появляются
+        Comment.objects.using(alias).bulk_create([Comment(bb_id=pk, author='benchmark', content='-')])
+        Bb.objects.using(alias).filter(pk=pk).update(updated_at=timezone.now())
+
+    def loop(self, alias, operation, bb_ids, deadline):
+        latencies = []
+        errors = 0
+        try:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    operation(alias, bb_ids)
+                except OperationalError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+        finally:
+            connections[alias].close()  # соединения потоков пула не закрываются сами
+        return latencies, errors
+
+    def summarize(self, results, elapsed):
+        latencies = sorted(latency for part, errors in results for latency in part)
+        return {'count': len(latencies), 'per_second': len(latencies) / elapsed,
+                'errors': sum(errors for part, errors in results),
+                'p50_ms': (percentile(latencies, 0.5) or 0) * 1000, 'p95_ms': (percentile(latencies, 0.95) or 0) * 1000,
+                'p99_ms': (percentile(latencies, 0.99) or 0) * 1000}
+
+    def run(self, alias):
+        bb_ids = list(Bb.objects.using(alias).filter(is_active=True).values_list('pk', flat=True)[:1000])
+        if not bb_ids:
+            raise ValueError('В базе нет активных объявлений, сначала выполните generate_data')
+        if self.retry:
+            write = write_transaction(self.write, using=alias)
+        else:
+            write = transaction.atomic(using=alias)(self.write)
+        with ThreadPoolExecutor(self.readers + self.writers) as executor:
+            started = time.perf_counter()
+            deadline = started + self.duration
+            reads = [executor.submit(self.loop, alias, self.read, bb_ids, deadline) for i in range(self.readers)]
+            writes = [executor.submit(self.loop, alias, write, bb_ids, deadline) for i in range(self.writers)]
+            reads = [future.result() for future in reads]
+            writes = [future.result() for future in writes]
+            elapsed = time.perf_counter() - started
+        return {'reads': self.summarize(reads, elapsed), 'writes': self.summarize(writes, elapsed)}
+
+
+class SlowClients:
+    """Сравнение WSGI и ASGI под нагрузкой clients одновременных медленных клиентов: каждый клиент
+    передает запрос за upload секунд и принимает каждую часть ответа за download секунд.
+    При WSGI клиента все это время обслуживает один из workers потоков (как у gunicorn --threads),
+    при ASGI представление выполняется в пуле из стольких же потоков (main.asgi.ASGIHandler),
+    а прием и отправка идут в цикле событий. Сервер не запускается: клиенты вызывают приложения
+    WSGI и ASGI в этом же процессе"""
+
+    def __init__(self, clients=200, workers=8, requests=1000, upload=0.05, download=0.05, host=DEFAULT_HOST):
+        self.clients = clients
+        self.workers = workers
+        self.requests = requests
+        self.upload = upload
+        self.download = download
+        self.host = host
+
+    def get_environ(self, url):
+        path, _, query = url.partition('?')
+        return {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '', 'PATH_INFO': path, 'QUERY_STRING': query,
+                'SERVER_NAME': self.host, 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+                'HTTP_HOST': self.host, 'wsgi.input': io.BytesIO(), 'wsgi.url_scheme': 'http',
+                'wsgi.errors': io.StringIO(), 'wsgi.multithread': True, 'wsgi.multiprocess': False}
+
+    def get_scope(self, url):
+        path, _, query = url.partition('?')
+        return {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET',
+                'scheme': 'http', 'path': path, 'raw_path': path.encode(), 'query_string': query.encode(),
+                'root_path': '', 'headers': [(b'host', self.host.encode())],
+                'client': ('127.0.0.1', 50000), 'server': (self.host, 80)}
+
+    def wsgi_request(self, application, url):
+        time.sleep(self.upload)
+        statuses = []
+        response = application(self.get_environ(url), lambda status, headers: statuses.append(status))
+        try:
+            for part in response:
+                time.sleep(self.download)
+        finally:
+            response.close()
+        return int(statuses[0].split()[0])
+
+    async def asgi_request(self, application, url):
+        messages = []
+
+        async def receive():
+            await asyncio.sleep(self.upload)
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+            if message['type'] == 'http.response.body':
+                await asyncio.sleep(self.download)
+
+        await application(self.get_scope(url), receive, send)
+        return messages[0]['status']
+
+    async def run_clients(self, request):
+        """Запуск requests запросов не более чем от clients клиентов одновременно; request - сопрограмма"""
+        semaphore = asyncio.Semaphore(self.clients)
+        latencies = []
+        statuses = set()
+
+        async def client():
+            async with semaphore:
+                started = time.perf_counter()
+                statuses.add(await request())
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for i in range(self.requests)))
+        wall = time.perf_counter() - started
+        latencies.sort()
+        return {'status': sorted(statuses), 'requests': len(latencies), 'rps': len(latencies) / wall,
+                'p50_ms': percentile(latencies, 0.5) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000,
+                'p99_ms': percentile(latencies, 0.99) * 1000}
+
+    async def measure_wsgi(self, url):
+        application = WSGIHandler()
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(self.workers) as executor:
+            request = partial(loop.run_in_executor, executor, self.wsgi_request, application, url)
+            await request()  # прогрев
+            return await self.run_clients(request)
+
+    async def measure_asgi(self, url):
+        application = ASGIHandler(threads=self.workers)
+        try:
+            request = partial(self.asgi_request, application, url)
+            await request()
+            return await self.run_clients(request)
+        finally:
+            application.executor.shutdown()
+
+    def run(self, url):
+        with allowed_host(self.host):
+            return {'wsgi': asyncio.run(self.measure_wsgi(url)), 'asgi': asyncio.run(self.measure_asgi(url))}
@@ -0,0 +1,19 @@
+from django.conf import settings
+from django.core.checks import Warning, register
+
+PROCESS_LOCAL_CACHES = ('django.core.cache.backends.locmem.LocMemCache',
+                        'django.core.cache.backends.dummy.DummyCache')
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """Версии групп кэша, счетчики рубрик и замеры отставания реплик меняются и фоновыми задачами,
+    и командами управления, поэтому кэш должен быть общим для всех процессов сайта"""
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend in PROCESS_LOCAL_CACHES and not getattr(settings, 'BBOARD_PROCESS_LOCAL_CACHE', False):
+        return [Warning('Кэш %s не общий для процессов сайта: сброс версий кэша из run_jobs и команд '
+                        'управления не дойдет до веб-процессов' % backend,
+                        hint='Укажите в CACHES файловый кэш, Memcached или DatabaseCache '
+                             '(BBOARD_PROCESS_LOCAL_CACHE = True - только для тестов)',
+                        id='main.W001')]
+    return []
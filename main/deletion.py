@@ -0,0 +1,142 @@
+import os
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import pre_save
+from django.utils import timezone
+from easy_thumbnails.files import get_thumbnailer
+
+from .facets import reset_facets
+from .images import get_variant_names
+from .models import Bb, AdditionalImage, Comment, CommentEvent
+from .storage import get_used_at
+from .tasks import task, enqueue_many
+from .thumbnails import get_image_storage
+from .utilities import bump_cache_versions, get_bb_cache_name, BBS_CACHE_NAME
+
+PURGE_CHUNK_SIZE = 100  # количество файлов в одной задаче удаления
+
+
+def get_reference_counts(names):
+    """Сколько объявлений и дополнительных иллюстраций ссылается на каждый из файлов names.
+    Одинаковые загрузки хранятся одним файлом (main.storage), поэтому файл удаляется,
+    только когда ссылок на него не остается"""
+    counts = Counter()
+    for model in (Bb, AdditionalImage):
+        rows = model.objects.filter(image__in=names).values('image').annotate(count=Count('pk')).order_by()
+        for row in rows:
+            counts[row['image']] += row['count']
+    return counts
+
+
+def is_recently_used(name, scheduled_at):
+    """Файл загружали (или снова загрузили такой же) незадолго до постановки в очередь на удаление
+    или после нее: ссылающаяся на него запись могла еще не попасть в базу"""
+    grace = getattr(settings, 'BBOARD_MEDIA_PURGE_GRACE', 60)
+    used_at = get_used_at(name)
+    if used_at is not None and used_at > scheduled_at - grace:
+        return True
+    try:
+        return os.path.getmtime(get_image_storage().path(name)) > scheduled_at - grace
+    except FileNotFoundError:
+        return False
+
+
+@task('purge_files')
+def purge_files(names, scheduled_at=None):
+    """Удаление файлов изображений вместе с их миниатюрами и вариантами. Файлы, на которые
+    еще есть ссылки, остаются на месте; недавно использованные откладываются до повторной проверки"""
+    referenced = get_reference_counts(names)
+    postponed = []
+    for name in set(names):
+        if referenced[name]:
+            continue
+        if scheduled_at is not None and is_recently_used(name, scheduled_at):
+            postponed.append(name)
+            continue
+        storage = get_image_storage()
+        thumbnailer = get_thumbnailer(storage, name)
+        source = thumbnailer.get_source_cache()
+        if source:
+            for thumbnail in source.thumbnails.all():
+                thumbnailer.thumbnail_storage.delete(thumbnail.name)
+            source.delete()
+        for variant in get_variant_names(name):
+            storage.delete(variant)
+        storage.delete(name)
+    if postponed:
+        grace = getattr(settings, 'BBOARD_MEDIA_PURGE_GRACE', 60)
+        enqueue_many('purge_files', [{'names': postponed, 'scheduled_at': time.time()}],
+                     run_after=timezone.now() + timedelta(seconds=grace))
+
+
+def schedule_purge(names):
+    """Постановка файлов в очередь на удаление после фиксации транзакции.
+    Если транзакция откатится, файлы останутся на месте"""
+    names = [name for name in names if name]
+    if not names:
+        return
+    scheduled_at = time.time()
+    chunks = [{'names': names[i:i + PURGE_CHUNK_SIZE], 'scheduled_at': scheduled_at}
+              for i in range(0, len(names), PURGE_CHUNK_SIZE)]
+    transaction.on_commit(lambda: enqueue_many('purge_files', chunks))
+
+
+def raw_delete(queryset):
+    """Удаление строк набора одним запросом DELETE, без загрузки объектов, каскадов и сигналов.
+    Публичный QuerySet.delete() сначала собирает связанные объекты (Collector), а для моделей с обработчиками
+    сигналов загружает каждую строку. Одиночный DELETE Django выполняет закрытым методом
+    QuerySet._raw_delete (им же Collector удаляет наборы без каскадов); все обращения к нему собраны здесь,
+    и если в другой версии Django его не окажется, используется обычный delete()"""
+    delete = getattr(queryset, '_raw_delete', None)
+    if delete is None:
+        return queryset.delete()[0]
+    return delete(queryset.db)
+
+
+def delete_bbs(queryset):
+    """Удаление объявлений вместе с дополнительными иллюстрациями и комментариями.
+    Выполняется несколькими запросами DELETE с подзапросом, без загрузки объектов в память
+    и без сигналов для каждой строки. Файлы удаляются позже фоновой задачей.
+    Возвращает количество удаленных объявлений"""
+    with transaction.atomic():
+        bbs = Bb.objects.filter(pk__in=queryset.values('pk'))
+        rows = list(bbs.values_list('pk', 'rubric'))
+        cache_names = [get_bb_cache_name(pk) for pk, rubric in rows]
+        rubrics = {rubric for pk, rubric in rows}
+        names = list(bbs.exclude(image='').values_list('image', flat=True))
+        names += AdditionalImage.objects.filter(bb__in=bbs.values('pk')).values_list('image', flat=True)
+        # порядок удаления соответствует внешним ключам: сначала зависимые таблицы
+        raw_delete(CommentEvent.objects.filter(comment__bb__in=bbs.values('pk')))
+        raw_delete(Comment.objects.filter(bb__in=bbs.values('pk')))
+        raw_delete(AdditionalImage.objects.filter(bb__in=bbs.values('pk')))
+        deleted = raw_delete(bbs)
+        schedule_purge(names)
+        # сигналы не отправлялись, поэтому закэшированные страницы сбрасываются здесь
+        transaction.on_commit(lambda: bump_cache_versions([BBS_CACHE_NAME] + cache_names))
+        transaction.on_commit(lambda: reset_facets(rubrics))  # счетчики рубрик будут пересчитаны
+    return deleted
+
+
+def delete_users(queryset):
+    """Удаление пользователей со всеми их объявлениями"""
+    with transaction.atomic():
+        delete_bbs(Bb.objects.filter(author__in=queryset.values('pk')))
+        return queryset.delete()
+
+
+def image_replaced_dispatcher(sender, instance, raw, **kwargs):
+    """При замене или очистке изображения старый файл ставится в очередь на удаление"""
+    stored = getattr(instance, '_stored_values', None)  # прочитаны main.models.stored_values_dispatcher
+    if raw or stored is None:
+        return
+    old = stored['image']
+    if old and old != instance.image.name:
+        schedule_purge([old])
+
+pre_save.connect(image_replaced_dispatcher, sender=Bb)
+pre_save.connect(image_replaced_dispatcher, sender=AdditionalImage)
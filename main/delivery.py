@@ -0,0 +1,164 @@
+import mimetypes
+import os
+import posixpath
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+HASHED_STATIC_RE = re.compile(r'\.[0-9a-f]{12}\.\w+$')  # имя после ManifestStaticFilesStorage
+CONTENT_MEDIA_RE = re.compile(r'(?:^|/)(?:[0-9a-f]{2}/){2}[0-9a-f]{64}\.')  # файл main.storage, его варианты и миниатюры
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # сжатые копии статических файлов в порядке предпочтения
+IMMUTABLE = 'public, max-age=31536000, immutable'
+BLOCK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def get_full_path(root, path):
+    """Путь к файлу внутри root или None; выход за пределы root считается отсутствием файла"""
+    if not root:
+        return None
+    try:
+        full_path = safe_join(root, posixpath.normpath(path).lstrip('/'))
+    except (SuspiciousFileOperation, ValueError):
+        return None
+    return full_path if os.path.isfile(full_path) else None
+
+
+def get_accepted_encodings(request):
+    return {part.split(';')[0].strip().lower() for part in request.META.get('HTTP_ACCEPT_ENCODING', '').split(',')}
+
+
+def get_range(request, size, etag, last_modified):
+    """Запрошенный диапазон байтов (начало, конец включительно) или None - отдать файл целиком.
+    Поддерживается один диапазон; с несколькими, как и с устаревшим If-Range, отдается весь файл"""
+    header = request.META.get('HTTP_RANGE')
+    if not header:
+        return None
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range != etag and parse_http_date_safe(if_range) != last_modified:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    start, end = match.groups()
+    if not start:  # bytes=-500 - последние 500 байтов
+        if not int(end):
+            raise RangeNotSatisfiable
+        return max(0, size - int(end)), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise RangeNotSatisfiable
+    return start, end
+
+
+def read_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def get_accel_response(full_path, url_path):
+    """Ответ без тела, файл из которого отдаст сам фронтовой сервер (BBOARD_MEDIA_ACCEL):
+    'nginx' - заголовок X-Accel-Redirect на внутренний адрес BBOARD_MEDIA_ACCEL_PREFIX,
+    'sendfile' - заголовок X-Sendfile с путем к файлу (Apache mod_xsendfile, lighttpd).
+    Диапазоны байтов в этом случае тоже обрабатывает сервер"""
+    mode = getattr(settings, 'BBOARD_MEDIA_ACCEL', None)
+    if not mode:
+        return None
+    response = HttpResponse()
+    if mode == 'nginx':
+        response['X-Accel-Redirect'] = getattr(settings, 'BBOARD_MEDIA_ACCEL_PREFIX', '/protected-media/') + \
+            quote(url_path)
+    else:
+        response['X-Sendfile'] = full_path
+    return response
+
+
+def serve_file(request, full_path, url_path, immutable=False, compressed=False, accel=False):
+    """Отдача файла с проверкой If-None-Match/If-Modified-Since (ответ 304), диапазонами байтов (206)
+    и, для статических файлов, готовыми сжатыми копиями .br и .gz. Неизменяемые файлы
+    (имя зависит от содержимого) кэшируются браузером бессрочно, остальные - с проверкой при каждом обращении"""
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    content_encoding = None
+    if compressed and 'HTTP_RANGE' not in request.META:
+        accepted = get_accepted_encodings(request)
+        for name, suffix in ENCODINGS:
+            if name in accepted and os.path.isfile(full_path + suffix):
+                full_path += suffix
+                content_encoding = name
+                break
+    stat = os.stat(full_path)
+    last_modified = int(stat.st_mtime)
+    etag = '"%x-%x%s"' % (last_modified, stat.st_size, '-' + content_encoding if content_encoding else '')
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None and accel:
+        response = get_accel_response(full_path, url_path)
+    if response is None:
+        try:
+            byte_range = get_range(request, stat.st_size, etag, last_modified)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % stat.st_size
+            return response
+        if byte_range is None:
+            response = FileResponse(open(full_path, 'rb'), content_type=content_type)
+            del response['Content-Disposition']  # файл открывается в браузере, а не сохраняется
+        else:
+            start, end = byte_range
+            response = StreamingHttpResponse(read_range(open(full_path, 'rb'), start, end - start + 1),
+                                             status=206, content_type=content_type)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, stat.st_size)
+        response['Accept-Ranges'] = 'bytes'
+        if content_encoding:
+            response['Content-Encoding'] = content_encoding
+    if response.status_code in (200, 206, 304):
+        if response.status_code != 304:
+            response['Content-Type'] = content_type
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = IMMUTABLE if immutable else 'no-cache'
+        if compressed:
+            response['Vary'] = 'Accept-Encoding'
+    return response
+
+
+@require_safe
+def serve_static(request, path):
+    """Статические файлы: собранные collectstatic в STATIC_ROOT, а при разработке (DEBUG) -
+    прямо из каталогов приложений и STATICFILES_DIRS"""
+    full_path = get_full_path(settings.STATIC_ROOT, path)
+    if full_path is None and settings.DEBUG:
+        full_path = finders.find(posixpath.normpath(path).lstrip('/'))
+    if full_path is None:
+        raise Http404('Файл не найден')
+    return serve_file(request, full_path, path, immutable=bool(HASHED_STATIC_RE.search(path)), compressed=True)
+
+
+@require_safe
+def serve_media(request, path):
+    """Загруженные файлы из MEDIA_ROOT; при заданном BBOARD_MEDIA_ACCEL содержимое отдает фронтовой сервер"""
+    full_path = get_full_path(settings.MEDIA_ROOT, path)
+    if full_path is None:
+        raise Http404('Файл не найден')
+    return serve_file(request, full_path, path, immutable=bool(CONTENT_MEDIA_RE.search(path)), accel=True)
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404
+
+from .models import Bb, Comment
+from .pagination import CursorPaginator
+from .utilities import get_cache_version, get_bb_cache_name
+
+COMMENTS_PER_PAGE = 20  # количество комментариев, выводимых на странице объявления и подгружаемых за раз
+
+
+def get_comments_page(bb_pk, cursor=None):
+    """Страница активных комментариев объявления, от новых к старым.
+    Выбирается одним чтением диапазона индекса (bb, is_active, created_at)"""
+    comments = Comment.objects.filter(bb=bb_pk, is_active=True)
+    return CursorPaginator(comments, COMMENTS_PER_PAGE).get_page(cursor)
+
+
+def load_bb_detail(pk, active_only=True):
+    """Объявление со всем, что нужно для его страницы, ровно тремя запросами:
+    объявление с рубрикой, надрубрикой и автором, дополнительные иллюстрации и первая страница
+    активных комментариев (comments и comments_cursor - курсор для подгрузки остальных)"""
+    bbs = Bb.objects.select_related('rubric__super_rubric', 'author').prefetch_related('additionalimage_set')
+    if active_only:
+        bbs = bbs.filter(is_active=True)
+    bbs = list(bbs.filter(pk=pk).order_by())  # запись одна, сортировка не нужна (first() добавил бы ORDER BY)
+    bb = bbs[0] if bbs else None
+    if bb is not None:
+        page = get_comments_page(pk)
+        # в кэш попадают только записи и курсор: при сериализации страница выполнила бы запрос заново
+        bb.comments, bb.comments_cursor = page.object_list, page.next_cursor
+    return bb
+
+
+def get_bb_detail(pk, active_only=True):
+    """Объявление для страницы просмотра из кэша. Версия в ключе увеличивается при изменении
+    объявления, его иллюстраций или комментариев. Если объявления нет, возбуждается Http404"""
+    key = 'bb:detail:%s:%s:%s' % (get_cache_version(get_bb_cache_name(pk)), pk, int(active_only))
+    bb = cache.get(key)
+    if bb is None:
+        bb = load_bb_detail(pk, active_only)
+        if bb is None:
+            raise Http404('Объявление не найдено')
+        cache.set(key, bb, getattr(settings, 'BBOARD_DETAIL_CACHE_TIMEOUT', 60 * 10))
+    return bb
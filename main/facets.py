@@ -0,0 +1,164 @@
+from bisect import bisect_right
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Func, Q
+from django.db.models.signals import post_save
+from django.utils import timezone
+
+from .models import Bb
+from .pagination import CursorPaginator
+
+# порядок вывода объявлений рубрики: (поле, по убыванию?); под каждый есть индекс (rubric, is_active, поле)
+SORTS = {
+    'new': ('created_at', True),
+    'price': ('price', False),
+    '-price': ('price', True),
+}
+
+
+def get_price_bounds():
+    return tuple(getattr(settings, 'BBOARD_PRICE_BUCKETS', (1000, 10000, 100000, 1000000)))
+
+
+def get_price_range(bucket):
+    """Границы ценового диапазона с номером bucket: (от включительно, до не включительно), None - без границы"""
+    bounds = get_price_bounds()
+    return bounds[bucket - 1] if bucket > 0 else None, bounds[bucket] if bucket < len(bounds) else None
+
+
+def format_price(value):
+    return '{:,.0f}'.format(value).replace(',', '\xa0')
+
+
+def get_price_choices():
+    """Варианты фильтра по цене: [(номер диапазона, подпись), ...]"""
+    choices = []
+    for bucket in range(len(get_price_bounds()) + 1):
+        low, high = get_price_range(bucket)
+        if low is None:
+            label = 'до %s' % format_price(high)
+        elif high is None:
+            label = 'от %s' % format_price(low)
+        else:
+            label = '%s – %s' % (format_price(low), format_price(high))
+        choices.append((bucket, label))
+    return choices
+
+
+def get_price_condition(bucket, field='price'):
+    low, high = get_price_range(bucket)
+    condition = Q()
+    if low is not None:
+        condition &= Q(**{field + '__gte': low})
+    if high is not None:
+        condition &= Q(**{field + '__lt': high})
+    return condition
+
+
+def get_facet_names():
+    return ['total', 'image'] + ['price_%d' % bucket for bucket in range(len(get_price_bounds()) + 1)]
+
+
+def get_key(rubric, name):
+    return 'facets:%s:%s' % (rubric, name)
+
+
+def compute_facets(rubric):
+    """Счетчики рубрики одним проходом по ее активным объявлениям: всего, с изображением, в каждом ценовом диапазоне"""
+    aggregates = {'total': Count('pk'), 'image': Count('pk', filter=~Q(image=''))}
+    for bucket in range(len(get_price_bounds()) + 1):
+        aggregates['price_%d' % bucket] = Count('pk', filter=get_price_condition(bucket))
+    return Bb.objects.filter(rubric=rubric, is_active=True).order_by().aggregate(**aggregates)
+
+
+def get_facets(rubric):
+    """Счетчики рубрики из кэша. Изменение объявления, влияющее на счетчики, сбрасывает счетчики его рубрики
+    (см. bb_saved_dispatcher), и они вычисляются заново при следующем обращении"""
+    names = get_facet_names()
+    keys = [get_key(rubric, name) for name in names]
+    cached = cache.get_many(keys)
+    if len(cached) == len(keys):
+        return {name: cached[key] for name, key in zip(names, keys)}
+    facets = compute_facets(rubric)
+    # счетчики живут ограниченное время, поэтому возможное расхождение с базой (изменения в обход сигналов) временно
+    cache.set_many({get_key(rubric, name): value for name, value in facets.items()},
+                   getattr(settings, 'BBOARD_FACETS_TIMEOUT', 60 * 60))
+    return facets
+
+
+def reset_facets(rubrics):
+    """Сброс счетчиков рубрик после массовых изменений, которые не отправляют сигналов (bulk_create, update)"""
+    cache.delete_many([get_key(rubric, name) for rubric in set(rubrics) for name in get_facet_names()])
+
+
+def get_contribution(state):
+    """Счетчики, в которые входит объявление в состоянии state (rubric, is_active, price, image)"""
+    if state is None or not state['is_active']:
+        return set()
+    names = {'total', 'price_%d' % bisect_right(get_price_bounds(), state['price'])}
+    if state['image']:
+        names.add('image')
+    return {get_key(state['rubric'], name) for name in names}
+
+
+def get_state(bb):
+    return {'rubric': bb.rubric_id, 'is_active': bb.is_active, 'price': bb.price, 'image': bool(bb.image)}
+
+
+def bb_saved_dispatcher(sender, instance, raw=False, **kwargs):
+    """Сброс счетчиков рубрик, если сохранение объявления их изменило. Счетчики не изменяются на месте
+    через cache.incr: в общем файловом кэше incr - чтение и запись, и одновременные сохранения
+    в разных процессах теряли бы изменения"""
+    if raw:
+        return
+    old = getattr(instance, '_stored_values', None)  # прочитаны main.models.stored_values_dispatcher
+    if old is not None:
+        old = dict(old, image=bool(old['image']))
+    new = get_state(instance)
+    if get_contribution(old) != get_contribution(new):
+        rubrics = {new['rubric']} | ({old['rubric']} if old else set())
+        # до фиксации параллельный пересчет увидел бы старые данные
+        transaction.on_commit(lambda: reset_facets(rubrics))
+
+
+post_save.connect(bb_saved_dispatcher, sender=Bb)
+
+
+class Unindexed(Func):
+    """Значение поля, которое SQLite не ищет по индексу (унарный плюс). В других СУБД - само поле"""
+    template = '%(expressions)s'
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, template='+%(expressions)s', **extra_context)
+
+
+def filter_bbs(bbs, price=None, photo=None, days=None, sort='new'):
+    """Объявления с фильтрами: ценовой диапазон с номером price, photo - с изображением (True) или без (False),
+    days - опубликованные за столько последних дней; sort - порядок вывода из SORTS.
+    По диапазону другого поля SQLite предпочел бы искать в его индексе и сортировать найденное во временном
+    B-дереве, поэтому такое поле скрывается от индекса: строки читаются из индекса поля сортировки
+    и просматриваются только до конца страницы"""
+    sort_field = SORTS.get(sort, SORTS['new'])[0]
+    if price is not None:
+        field = 'price'
+        if sort_field != field:
+            field = 'price_value'
+            bbs = bbs.annotate(price_value=Unindexed('price'))
+        bbs = bbs.filter(get_price_condition(price, field))
+    if photo is not None:
+        bbs = bbs.exclude(image='') if photo else bbs.filter(image='')
+    if days:
+        field = 'created_at'
+        if sort_field != field:
+            field = 'created_value'
+            bbs = bbs.annotate(created_value=Unindexed('created_at'))
+        bbs = bbs.filter(**{field + '__gte': timezone.now() - timedelta(days=days)})
+    return bbs
+
+
+def get_paginator(bbs, sort, per_page):
+    field, descending = SORTS.get(sort, SORTS['new'])
+    return CursorPaginator(bbs, per_page, field=field, descending=descending)
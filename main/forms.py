@@ -5,6 +5,8 @@ from django.core.exceptions import ValidationError
 from .models import user_registrated, SuperRubric, SubRubric, Bb, AdditionalImage, Comment
 from django.forms import inlineformset_factory
 from captcha.fields import CaptchaField
+from .rubrics import RubricChoiceIterator
+from .facets import get_price_choices
 
 
 
@@ -72,8 +74,38 @@ class SearchForm(forms.Form):
     keyword = forms.CharField(required=False, max_length=20, label='')
 
 
+class BbFilterForm(SearchForm):
+    """Поиск, фильтры и порядок вывода объявлений рубрики (main.facets). Форма заполняется из строки запроса,
+    неверные значения фильтров не применяются"""
+    price = forms.TypedChoiceField(required=False, coerce=int, empty_value=None, label='Цена')
+    photo = forms.TypedChoiceField(required=False, choices=(('', 'Все'), ('1', 'С фото'), ('0', 'Без фото')),
+                                   coerce=lambda value: value == '1', empty_value=None, label='Фото')
+    days = forms.TypedChoiceField(required=False, coerce=int, empty_value=None, label='Опубликованы',
+                                  choices=(('', 'За все время'), ('1', 'За сутки'), ('7', 'За неделю'),
+                                           ('30', 'За месяц')))
+    sort = forms.ChoiceField(required=False, label='Порядок',
+                             choices=(('new', 'Сначала новые'), ('price', 'Сначала дешевые'),
+                                      ('-price', 'Сначала дорогие')))
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['price'].choices = [('', 'Любая')] + get_price_choices()  # границы задаются в настройках
+
+
+class RubricChoiceField(forms.ModelChoiceField):
+    """Поле выбора подрубрики, список вариантов которого строится по закэшированному дереву рубрик"""
+    iterator = RubricChoiceIterator
+
+    def _get_choices(self):
+        return self.iterator(self)
+
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
+
+
 class BbForm(forms.ModelForm):
     """Форма для создания нового объявления"""
+    rubric = RubricChoiceField(queryset=SubRubric.objects.all(), label='Рубрика')
+
     class Meta:
         model = Bb
         fields = '__all__'
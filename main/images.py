@@ -0,0 +1,143 @@
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from os.path import splitext
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import UploadedFile
+from django.db.models.signals import post_save
+from PIL import Image, ImageOps, features
+
+from .models import Bb, AdditionalImage
+from .tasks import task, enqueue, enqueue_many
+from .thumbnails import get_image_storage
+from .utilities import bump_cache_version, get_bb_cache_name
+
+logger = logging.getLogger(__name__)
+
+# варианты для <picture> в порядке предпочтения: формат Pillow, тип MIME, параметры сохранения
+VARIANT_FORMATS = {
+    'avif': ('AVIF', 'image/avif', {'quality': 60}),
+    'webp': ('WEBP', 'image/webp', {'quality': 80, 'method': 4}),
+}
+QUEUED_TIMEOUT = 60 * 10  # повторно ставить в очередь варианты изображения не чаще, чем раз в 10 минут
+MISSING_VARIANTS_TIMEOUT = 60  # как долго помнить, что вариантов еще нет
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def normalize_image(file):
+    """Загруженное изображение, приведенное к виду для хранения: повернутое по EXIF, уменьшенное
+    до BBOARD_IMAGE_MAX_SIZE и пересжатое в JPEG (или PNG, если есть прозрачность).
+    EXIF, в том числе координаты съемки, в новый файл не переносится, цветовой профиль - переносится"""
+    file.seek(0)
+    with Image.open(file) as source:
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail(getattr(settings, 'BBOARD_IMAGE_MAX_SIZE', (1920, 1920)), Image.LANCZOS)
+        buffer = io.BytesIO()
+        options = {'optimize': True, 'icc_profile': source.info.get('icc_profile')}
+        if has_alpha(image):
+            image.save(buffer, 'PNG', **options)
+            extension = '.png'
+        else:
+            image.convert('RGB').save(buffer, 'JPEG', quality=getattr(settings, 'BBOARD_IMAGE_QUALITY', 85),
+                                      progressive=True, **options)
+            extension = '.jpg'
+    return ContentFile(buffer.getvalue(), name=splitext(file.name)[0] + extension)
+
+
+def normalize_uploads(forms, field='image'):
+    """Обработка изображений, только что загруженных через формы (форму объявления, формы набора AIFormSet).
+    Изображения обрабатываются одновременно в пуле из BBOARD_IMAGE_WORKERS потоков: Pillow отпускает GIL
+    на время масштабирования и сжатия. Вызывается до транзакции записи, чтобы не держать блокировку базы"""
+    forms = [form for form in forms
+             if isinstance(getattr(form, 'cleaned_data', {}).get(field), UploadedFile)]
+    if not forms:
+        return
+    files = [form.cleaned_data[field] for form in forms]
+    if len(files) == 1:
+        results = [normalize_image(files[0])]
+    else:
+        with ThreadPoolExecutor(min(len(files), getattr(settings, 'BBOARD_IMAGE_WORKERS', 4))) as executor:
+            results = list(executor.map(normalize_image, files))
+    for form, result in zip(forms, results):
+        form.cleaned_data[field] = result
+        setattr(form.instance, field, result)  # модельная форма уже перенесла загруженный файл в запись
+
+
+def get_supported_formats():
+    """Форматы из VARIANT_FORMATS, которые умеет записывать установленный Pillow (AVIF есть не в каждой сборке)"""
+    return {extension: variant for extension, variant in VARIANT_FORMATS.items() if features.check(extension)}
+
+
+def get_variant_name(name, extension):
+    return '%s.%s' % (name, extension)
+
+
+def get_variant_names(name):
+    return [get_variant_name(name, extension) for extension in VARIANT_FORMATS]
+
+
+@task('image_variants')
+def generate_variants(image, bb=None):
+    """Создание вариантов изображения image в форматах VARIANT_FORMATS, которые поддерживает Pillow. Вариант,
+    который получился не меньше исходного файла, не сохраняется - браузер получит исходный"""
+    storage = get_image_storage()
+    if not storage.exists(image):  # изображение успели удалить
+        return
+    size = storage.size(image)
+    with storage.open(image) as file, Image.open(file) as source:
+        source.load()
+        if source.mode not in ('RGB', 'RGBA'):  # CMYK, палитру и т. п. AVIF и WebP не принимают
+            source = source.convert('RGBA' if has_alpha(source) else 'RGB')
+        for extension, (image_format, mime_type, options) in get_supported_formats().items():
+            name = get_variant_name(image, extension)
+            if storage.exists(name):
+                continue
+            buffer = io.BytesIO()
+            try:
+                source.save(buffer, image_format, **options)
+            except (OSError, KeyError, ValueError):  # ошибка одного формата не мешает остальным
+                logger.warning('Не удалось создать вариант %s изображения %s', extension, image, exc_info=True)
+                continue
+            if buffer.tell() < size:
+                storage.save_derived(name, ContentFile(buffer.getvalue()))
+    cache.delete('image_variants:' + image)
+    if bb is not None:
+        bump_cache_version(get_bb_cache_name(bb))  # страница объявления могла закэшироваться без вариантов
+
+
+def enqueue_variants(name, bb=None):
+    if name and cache.add('image_variants:queued:' + name, True, QUEUED_TIMEOUT):
+        enqueue('image_variants', image=name, bb=bb)
+
+
+def enqueue_all_variants(rows):
+    """Постановка в очередь создания вариантов для множества изображений: rows - пары (имя файла, ключ объявления)"""
+    return enqueue_many('image_variants', ({'image': name, 'bb': bb} for name, bb in rows if name))
+
+
+def get_variants(name):
+    """Готовые варианты изображения: [(тип MIME, имя файла), ...] в порядке предпочтения"""
+    key = 'image_variants:' + name
+    variants = cache.get(key)
+    if variants is None:
+        storage = get_image_storage()
+        variants = [(mime_type, get_variant_name(name, extension))
+                    for extension, (image_format, mime_type, options) in VARIANT_FORMATS.items()
+                    if storage.exists(get_variant_name(name, extension))]
+        # пока фоновая задача не отработала, наличие вариантов проверяется снова через минуту
+        cache.set(key, variants, None if len(variants) == len(VARIANT_FORMATS) else MISSING_VARIANTS_TIMEOUT)
+    return variants
+
+
+def image_saved_dispatcher(sender, instance, **kwargs):
+    if instance.image:
+        enqueue_variants(instance.image.name, instance.pk if sender is Bb else instance.bb_id)
+
+post_save.connect(image_saved_dispatcher, sender=Bb)
+post_save.connect(image_saved_dispatcher, sender=AdditionalImage)
@@ -0,0 +1,270 @@
+import csv
+import gzip
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .facets import reset_facets
+from .images import enqueue_all_variants, normalize_image
+from .models import AdvUser, SubRubric, Bb, AdditionalImage, ImportCheckpoint
+from .sqlite import write_transaction
+from .storage import content_storage
+from .synthetic import explicit_dates
+from .thumbnails import enqueue_all_thumbnails
+from .utilities import bump_cache_version, BBS_CACHE_NAME
+
+TRUE_VALUES = ('1', 'true', 'yes', 'да')
+FALSE_VALUES = ('0', 'false', 'no', 'нет')
+
+
+class RecordError(ValueError):
+    """Запись файла импорта, из которой нельзя создать объявление"""
+
+
+def open_source(path):
+    """Файл импорта в текстовом режиме; сжатый gzip (.gz) распаковывается на ходу"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, encoding='utf-8', newline='')
+
+
+def get_format(path):
+    return 'csv' if (path[:-3] if path.endswith('.gz') else path).endswith('.csv') else 'ndjson'
+
+
+def read_records(file, format):
+    """Записи файла по одной: словари для CSV, строки для NDJSON (разбираются при проверке,
+    чтобы испорченная строка отклонялась, а не прерывала импорт)"""
+    if format == 'csv':
+        yield from csv.DictReader(file)
+    else:
+        yield from (line for line in file if line.strip())
+
+
+def parse_bool(value, default=True):
+    if isinstance(value, bool):
+        return value
+    if value is None or value == '':
+        return default
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise RecordError('неверное логическое значение %r' % value)
+
+
+class BbImporter:
+    """Импорт объявлений из NDJSON или CSV с полями выгрузки /api/export/bbs/ (лишние поля не мешают):
+    title, content, price, contacts, rubric (ключ или название рубрики) или rubric_name,
+    author (имя пользователя) или author_email, is_active, created_at,
+    image и images - пути к файлам изображений относительно image_root (в CSV images - через пробел).
+
+    Файл читается пачками по batch_size записей. Рубрики и пользователи находятся по словарям,
+    загруженным один раз. Изображения пачки приводятся к виду для хранения (main.images.normalize_image)
+    и сохраняются в content_storage одновременно в workers потоках, затем объявления, иллюстрации
+    и контрольная точка (ImportCheckpoint) записываются одной транзакцией. Записи с ошибками
+    пропускаются и передаются в reject. При dry_run записи только проверяются"""
+
+    def __init__(self, name, batch_size=1000, image_root='', workers=None, normalize=True, dry_run=False,
+                 progress=None, reject=None):
+        self.name = name
+        self.batch_size = batch_size
+        self.image_root = image_root
+        self.workers = workers or getattr(settings, 'BBOARD_IMAGE_WORKERS', 4)
+        self.normalize = normalize
+        self.dry_run = dry_run
+        self.progress = progress or (lambda message: None)
+        self.reject = reject or (lambda number, error: None)
+        self.stored = {}  # путь к файлу -> имя в хранилище, одно изображение бывает у многих объявлений
+        self.enqueued = set()  # изображения, для которых уже поставлены в очередь миниатюры и варианты
+
+    def load_lookups(self):
+        self.rubrics = {}
+        for pk, name in SubRubric.objects.order_by().values_list('pk', 'name'):
+            self.rubrics[str(pk)] = self.rubrics[name.lower()] = pk
+        self.usernames = {}
+        self.emails = {}
+        for pk, username, email in AdvUser.objects.order_by().values_list('pk', 'username', 'email'):
+            self.usernames[username] = pk
+            if email:
+                self.emails.setdefault(email.lower(), pk)
+
+    def get_rubric(self, record):
+        # ключи рубрик в другой базе не совпадают с нашими, поэтому название важнее
+        value = str(record.get('rubric_name') or record.get('rubric') or '').strip()
+        if not value:
+            raise RecordError('не указана рубрика')
+        pk = self.rubrics.get(value.lower())
+        if pk is None:
+            raise RecordError('нет рубрики %r' % value)
+        return pk
+
+    def get_author(self, record):
+        if record.get('author'):
+            pk = self.usernames.get(str(record['author']).strip())
+        elif record.get('author_email'):
+            pk = self.emails.get(str(record['author_email']).strip().lower())
+        else:
+            raise RecordError('не указан автор')
+        if pk is None:
+            raise RecordError('нет пользователя %r' % (record.get('author') or record.get('author_email')))
+        return pk
+
+    def get_datetime(self, record, field, default):
+        value = record.get(field)
+        if not value:
+            return default
+        try:
+            result = parse_datetime(str(value))
+        except ValueError:
+            result = None
+        if result is None:
+            raise RecordError('неверное значение %s: %r' % (field, value))
+        return timezone.make_aware(result) if settings.USE_TZ and timezone.is_naive(result) else result
+
+    def get_image_path(self, name):
+        if '://' in name:
+            raise RecordError('изображение %r задано адресом, нужен путь к файлу' % name)
+        path = os.path.join(self.image_root, name.lstrip('/'))
+        if not os.path.isfile(path):
+            raise RecordError('нет файла изображения %s' % path)
+        return path
+
+    def clean(self, record, now):
+        """Объявление (еще не сохраненное) и пути к его изображениям: (объявление, основное, дополнительные)"""
+        if isinstance(record, str):
+            try:
+                record = json.loads(record)
+            except ValueError as error:
+                raise RecordError('неверный JSON: %s' % error)
+            if not isinstance(record, dict):
+                raise RecordError('запись должна быть объектом JSON')
+        title = str(record.get('title') or '').strip()
+        content = str(record.get('content') or '').strip()
+        if not title or not content:
+            raise RecordError('не указано название или описание')
+        try:
+            price = float(record.get('price') or 0)
+        except (TypeError, ValueError):
+            raise RecordError('неверная цена %r' % record.get('price'))
+        created_at = self.get_datetime(record, 'created_at', now)
+        images = record.get('images') or []
+        if isinstance(images, str):
+            images = images.split()
+        bb = Bb(rubric_id=self.get_rubric(record), author_id=self.get_author(record), title=title, content=content,
+                price=price, contacts=str(record.get('contacts') or ''),
+                is_active=parse_bool(record.get('is_active')), created_at=created_at,
+                updated_at=now)  # иначе клиенты синхронизации по since не получат импортированные объявления
+        image = self.get_image_path(record['image']) if record.get('image') else None
+        return bb, image, [self.get_image_path(name) for name in images]
+
+    def store_image(self, path):
+        """Сохранение файла в хранилище; возвращает (путь, имя в хранилище или исключение)"""
+        try:
+            with open(path, 'rb') as file:
+                content = File(file, name=os.path.basename(path))
+                if self.normalize:
+                    content = normalize_image(content)
+                return path, content_storage.save(content.name, content)
+        except (OSError, ValueError) as error:  # ошибки Pillow - подклассы этих исключений
+            return path, error
+
+    def store_images(self, executor, cleaned):
+        """Сохранение изображений пачки; записи с нечитаемыми изображениями отклоняются"""
+        paths = {path for number, (bb, image, images) in cleaned for path in [image] + images
+                 if path and path not in self.stored}
+        errors = {}
+        for path, result in executor.map(self.store_image, paths):
+            if isinstance(result, Exception):
+                errors[path] = result
+            else:
+                self.stored[path] = result
+        result = []
+        for number, (bb, image, images) in cleaned:
+            failed = next((path for path in [image] + images if path in errors), None)
+            if failed:
+                self.reject(number, RecordError('изображение %s не сохранено: %s' % (failed, errors[failed])))
+                continue
+            bb.image = self.stored[image] if image else ''
+            result.append((bb, [self.stored[path] for path in images]))
+        return result
+
+    def write_batch(self, rows, checkpoint, position, rejected):
+        """Запись пачки одной транзакцией. SQLite не возвращает ключи из bulk_create, они читаются следом:
+        транзакция записи в SQLite одна на всю базу, и чужих записей между ними быть не может"""
+        bbs = [bb for bb, images in rows]
+        for bb in bbs:
+            bb.pk = None  # ключи, прочитанные в прерванной блокировкой попытке, недействительны
+        last = Bb.objects.aggregate(last=Max('pk'))['last'] or 0
+        Bb.objects.bulk_create(bbs)
+        if bbs and bbs[0].pk is None:
+            for bb, pk in zip(bbs, Bb.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)):
+                bb.pk = pk
+        AdditionalImage.objects.bulk_create([AdditionalImage(bb_id=bb.pk, image=name)
+                                             for bb, images in rows for name in images])
+        ImportCheckpoint.objects.filter(pk=checkpoint.pk).update(
+            position=position, imported=F('imported') + len(bbs), rejected=F('rejected') + rejected,
+            updated_at=timezone.now())
+        # сигналы при bulk_create не отправляются: миниатюры и варианты ставятся в очередь той же транзакцией,
+        # кэши сбрасываются после ее фиксации
+        image_bbs = {}
+        for bb, images in rows:
+            for name in [bb.image.name] + images:
+                if name and name not in self.enqueued:
+                    image_bbs.setdefault(name, bb.pk)
+        enqueue_all_thumbnails(image_bbs)
+        enqueue_all_variants(image_bbs.items())
+        transaction.on_commit(lambda: self.enqueued.update(image_bbs))
+        transaction.on_commit(lambda: bump_cache_version(BBS_CACHE_NAME))  # дерево рубрик импорт не меняет
+        rubrics = {bb.rubric_id for bb in bbs}
+        transaction.on_commit(lambda: reset_facets(rubrics))
+
+    def run(self, path, format=None, restart=False):
+        """Импорт файла path с места, сохраненного в контрольной точке; возвращает итоги"""
+        if self.dry_run:
+            checkpoint = ImportCheckpoint.objects.filter(name=self.name).first() or ImportCheckpoint(name=self.name)
+        else:
+            if restart:
+                ImportCheckpoint.objects.filter(name=self.name).delete()
+            checkpoint = ImportCheckpoint.objects.get_or_create(name=self.name)[0]
+        self.load_lookups()
+        totals = {'skipped': checkpoint.position, 'imported': 0, 'rejected': 0}
+        write = write_transaction(self.write_batch)
+        with open_source(path) as file, explicit_dates(Bb), ThreadPoolExecutor(self.workers) as executor:
+            records = read_records(file, format or get_format(path))
+            position = checkpoint.position
+            for record in islice(records, position):  # уже обработанные записи
+                pass
+            while True:
+                batch = list(islice(records, self.batch_size))
+                if not batch:
+                    break
+                now = timezone.now()
+                cleaned = []
+                for number, record in enumerate(batch, position + 1):
+                    try:
+                        cleaned.append((number, self.clean(record, now)))
+                    except RecordError as error:
+                        self.reject(number, error)
+                position += len(batch)
+                if self.dry_run:
+                    imported = len(cleaned)
+                else:
+                    rows = self.store_images(executor, cleaned)
+                    write(rows, checkpoint, position, len(batch) - len(rows))
+                    imported = len(rows)
+                totals['imported'] += imported
+                totals['rejected'] += len(batch) - imported
+                self.progress('Обработано записей: %d, %s: %d, отклонено: %d' % (
+                    position, 'проверено' if self.dry_run else 'импортировано', totals['imported'],
+                    totals['rejected']))
+        return totals
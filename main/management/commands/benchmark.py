@@ -0,0 +1,49 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main.benchmark import Benchmark, collect_routes, DEFAULT_HOST
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный замер всех страниц сайта и API: пропускная способность, задержки, SQL-запросы'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Количество одновременных клиентов')
+        parser.add_argument('--requests', type=int, default=50, help='Запросов к каждому URL')
+        parser.add_argument('--host', default=DEFAULT_HOST,
+                            help='Значение заголовка Host (на время замера добавляется в ALLOWED_HOSTS)')
+        parser.add_argument('--only', nargs='+', help='Замерять только URL, содержащие одну из этих строк')
+        parser.add_argument('--output', help='Файл для результатов в формате JSON '
+                                             '(по умолчанию benchmark-<дата и время>.json)')
+        parser.add_argument('--compare', help='Файл с результатами прошлого замера для сравнения')
+
+    def write_result(self, result, previous):
+        line = '%-45s %6.1f/с  p50 %7.1f  p95 %7.1f  p99 %7.1f мс  SQL %5.1f' % (
+            result['url'], result['rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'], result['queries'])
+        old = previous.get(result['route'])
+        if old:
+            line += '  (p50 %+.0f%%, SQL %+.1f)' % ((result['p50_ms'] / old['p50_ms'] - 1) * 100,
+                                                  result['queries'] - old['queries'])
+        self.stdout.write(line)
+
+    def handle(self, *args, **options):
+        previous = {}
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as file:
+                previous = {result['route']: result for result in json.load(file)['results']}
+        benchmark = Benchmark(workers=options['workers'], requests=options['requests'], host=options['host'],
+                              progress=lambda result: self.write_result(result, previous))
+        routes = collect_routes('main.urls') + collect_routes('api.urls', '/api/')
+        started_at = timezone.now()
+        try:
+            results = benchmark.run(routes, only=options['only'])
+        except ValueError as error:
+            raise CommandError(error)
+        output = options['output'] or 'benchmark-%s.json' % started_at.strftime('%Y%m%d-%H%M%S')
+        with open(output, 'w', encoding='utf-8') as file:
+            json.dump({'started_at': started_at.isoformat(), 'workers': options['workers'],
+                       'requests': options['requests'], 'results': results}, file, ensure_ascii=False, indent=2)
+        self.stdout.write(self.style.SUCCESS('Результаты сохранены в %s' % os.path.abspath(output)))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from main.benchmark import SlowClients, DEFAULT_HOST
+
+
+class Command(BaseCommand):
+    help = 'Замер WSGI против ASGI с медленными клиентами: пропускная способность и задержки одного URL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='?', default='/api/bbs/', help='Адрес замеряемой страницы')
+        parser.add_argument('--clients', type=int, default=200, help='Одновременных клиентов')
+        parser.add_argument('--workers', type=int, default=8, help='Потоков обработки запросов')
+        parser.add_argument('--requests', type=int, default=1000, help='Всего запросов')
+        parser.add_argument('--upload', type=float, default=0.05, help='Время передачи запроса клиентом, секунд')
+        parser.add_argument('--download', type=float, default=0.05,
+                            help='Время приема клиентом каждой части ответа, секунд')
+        parser.add_argument('--host', default=DEFAULT_HOST,
+                            help='Значение заголовка Host (на время замера добавляется в ALLOWED_HOSTS)')
+
+    def handle(self, *args, **options):
+        benchmark = SlowClients(clients=options['clients'], workers=options['workers'], requests=options['requests'],
+                                upload=options['upload'], download=options['download'], host=options['host'])
+        for name, result in benchmark.run(options['url']).items():
+            self.stdout.write('%-5s %8.1f/с  p50 %7.1f  p95 %7.1f  p99 %7.1f мс  статус %s' % (
+                name, result['rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                ', '.join(map(str, result['status']))))
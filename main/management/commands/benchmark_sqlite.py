@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from main.benchmark import BASELINE_PRAGMAS, WriteContention, database_copy
+
+
+class Command(BaseCommand):
+    help = 'Замер чтения во время записи на копии базы: параметры SQLite по умолчанию против BBOARD_SQLITE_PRAGMAS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8, help='Потоков чтения')
+        parser.add_argument('--writers', type=int, default=2, help='Потоков записи')
+        parser.add_argument('--duration', type=float, default=10, help='Длительность каждого замера, секунд')
+
+    def write_result(self, name, result):
+        for kind in ('reads', 'writes'):
+            part = result[kind]
+            self.stdout.write('%-9s %-6s %8.1f/с  p50 %7.1f  p95 %7.1f  p99 %7.1f мс  ошибок %d' % (
+                name, kind, part['per_second'], part['p50_ms'], part['p95_ms'], part['p99_ms'], part['errors']))
+
+    def handle(self, *args, **options):
+        modes = (('default', BASELINE_PRAGMAS, False), ('tuned', None, True))
+        for name, pragmas, retry in modes:
+            benchmark = WriteContention(readers=options['readers'], writers=options['writers'],
+                                        duration=options['duration'], retry=retry)
+            try:
+                with database_copy(pragmas) as alias:
+                    result = benchmark.run(alias)
+            except ValueError as error:
+                raise CommandError(error)
+            self.write_result(name, result)
@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from main.synthetic import DataGenerator
+
+
+class Command(BaseCommand):
+    help = 'Заполняет базу синтетическими пользователями, рубриками, объявлениями, иллюстрациями и комментариями'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Начальное значение генератора случайных чисел')
+        parser.add_argument('--until', type=date.fromisoformat,
+                            help='Дата последнего объявления (ГГГГ-ММ-ДД), по умолчанию сегодня')
+        parser.add_argument('--days', type=int, default=365, help='За сколько дней до --until появляются объявления')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--super-rubrics', type=int, default=8)
+        parser.add_argument('--sub-rubrics', type=int, default=8, help='Рубрик в каждой надрубрике')
+        parser.add_argument('--bbs', type=int, default=100000)
+        parser.add_argument('--images', type=int, default=20000, help='Дополнительных иллюстраций')
+        parser.add_argument('--comments', type=int, default=300000)
+        parser.add_argument('--image-files', type=int, default=20,
+                            help='Сколько разных файлов изображений создать (0 - объявления без изображений)')
+        parser.add_argument('--image-share', type=float, default=0.3, help='Доля объявлений с основным изображением')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Записей в одном bulk_create')
+
+    def handle(self, *args, **options):
+        generator = DataGenerator(seed=options['seed'], until=options['until'], days=options['days'],
+                                  batch_size=options['batch_size'],
+                                  progress=lambda message: self.stdout.write(message))
+        totals = generator.generate(users=options['users'], super_rubrics=options['super_rubrics'],
+                                    sub_rubrics=options['sub_rubrics'], bbs=options['bbs'], images=options['images'],
+                                    comments=options['comments'], image_files=options['image_files'],
+                                    image_share=options['image_share'])
+        self.stdout.write(self.style.SUCCESS('Создано пользователей: %(users)d, рубрик: %(rubrics)d, '
+                                             'объявлений: %(bbs)d' % totals))
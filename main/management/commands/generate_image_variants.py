@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from main.images import enqueue_all_variants
+from main.models import Bb, AdditionalImage
+from main.tasks import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Ставит в очередь создание вариантов AVIF и WebP для всех уже загруженных изображений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--now', action='store_true', help='Сразу выполнить очередь в этом процессе')
+        parser.add_argument('--workers', type=int, default=1, help='Количество процессов при --now')
+
+    def handle(self, *args, **options):
+        rows = Bb.objects.exclude(image='').values_list('image', 'pk').iterator()
+        total = enqueue_all_variants(rows)
+        rows = AdditionalImage.objects.exclude(image='').values_list('image', 'bb').iterator()
+        total += enqueue_all_variants(rows)
+        self.stdout.write('Поставлено в очередь изображений: %d' % total)
+        if options['now']:
+            run_worker(workers=options['workers'], once=True)
+            self.stdout.write(self.style.SUCCESS('Варианты созданы'))
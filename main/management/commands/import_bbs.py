@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from main.imports import BbImporter
+
+
+class Command(BaseCommand):
+    help = 'Импорт объявлений из NDJSON или CSV (в том числе сжатых gzip) с продолжением после прерывания'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Файл импорта: .ndjson, .csv, .ndjson.gz или .csv.gz')
+        parser.add_argument('--format', choices=('ndjson', 'csv'), help='Формат, если его не видно по расширению')
+        parser.add_argument('--image-root', default='', help='Каталог, относительно которого заданы пути изображений')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Записей в одной транзакции')
+        parser.add_argument('--workers', type=int, help='Потоков для сохранения изображений '
+                                                        '(по умолчанию BBOARD_IMAGE_WORKERS)')
+        parser.add_argument('--keep-originals', action='store_true',
+                            help='Сохранять изображения как есть, без уменьшения и пересжатия')
+        parser.add_argument('--checkpoint', help='Имя контрольной точки (по умолчанию - имя файла)')
+        parser.add_argument('--restart', action='store_true', help='Начать импорт файла сначала')
+        parser.add_argument('--dry-run', action='store_true', help='Только проверить записи, ничего не сохраняя')
+
+    def reject(self, number, error):
+        self.stderr.write('Запись %d отклонена: %s' % (number, error))
+
+    def handle(self, *args, **options):
+        importer = BbImporter(options['checkpoint'] or os.path.basename(options['path']),
+                              batch_size=options['batch_size'], image_root=options['image_root'],
+                              workers=options['workers'], normalize=not options['keep_originals'],
+                              dry_run=options['dry_run'], progress=lambda message: self.stdout.write(message),
+                              reject=self.reject)
+        totals = importer.run(options['path'], format=options['format'], restart=options['restart'])
+        self.stdout.write(self.style.SUCCESS('%s: %d, отклонено: %d, пропущено обработанных ранее: %d' % (
+            'Проверено' if options['dry_run'] else 'Импортировано', totals['imported'], totals['rejected'],
+            totals['skipped'])))
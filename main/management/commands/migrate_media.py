@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from main.storage import migrate_media
+
+
+class Command(BaseCommand):
+    help = 'Переносит загруженные изображения в хранилище с именами по содержимому (без остановки сайта)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help='Количество файлов, записи которых переключаются в одной транзакции')
+        parser.add_argument('--keep-old', action='store_true', help='Не удалять файлы со старыми именами')
+
+    def handle(self, *args, **options):
+        def progress(total):
+            self.stdout.write('Перенесено файлов: %d' % total)
+
+        moved, missing = migrate_media(batch_size=options['batch_size'], keep_old=options['keep_old'],
+                                       progress=progress)
+        if missing:
+            self.stdout.write(self.style.WARNING('Не найдено файлов: %d' % missing))
+        self.stdout.write(self.style.SUCCESS('Изображения перенесены: %d' % moved))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from main.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = 'Перестраивает поисковый индекс объявлений с нуля'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Количество объявлений, индексируемых в одной транзакции')
+
+    def handle(self, *args, **options):
+        def progress(total):
+            self.stdout.write('Проиндексировано объявлений: %d' % total)
+
+        total = get_search_backend().rebuild(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен, объявлений: %d' % total))
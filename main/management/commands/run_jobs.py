@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from main.tasks import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из очереди (миниатюры и т.п.)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100, help='Количество задач в одной пачке')
+        parser.add_argument('--workers', type=int, default=1, help='Количество процессов для выполнения задач')
+        parser.add_argument('--sleep', type=float, default=5, help='Пауза в секундах, когда очередь пуста')
+        parser.add_argument('--once', action='store_true', help='Выполнить все готовые задачи и завершиться')
+
+    def handle(self, *args, **options):
+        run_worker(limit=options['limit'], workers=options['workers'], sleep=options['sleep'], once=options['once'])
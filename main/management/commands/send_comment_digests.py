@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from main.notifications import send_comment_digests
+
+
+class Command(BaseCommand):
+    help = 'Рассылает авторам объявлений сводки новых комментариев. Запускается периодически (например, из cron)'
+
+    def handle(self, *args, **options):
+        sent = send_comment_digests()
+        self.stdout.write(self.style.SUCCESS('Отправлено сводок: %d' % sent))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from main.outbox import run_outbox_worker
+
+
+class Command(BaseCommand):
+    help = 'Отправляет письма из таблицы исходящих'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=100, help='Количество писем, отправляемых через одно соединение')
+        parser.add_argument('--backend', help='Почтовый бэкенд вместо BBOARD_OUTBOX_EMAIL_BACKEND')
+        parser.add_argument('--sleep', type=float, default=5, help='Пауза в секундах, когда писем нет')
+        parser.add_argument('--once', action='store_true', help='Отправить все готовые письма и завершиться')
+
+    def handle(self, *args, **options):
+        run_outbox_worker(limit=options['limit'], backend=options['backend'], sleep=options['sleep'],
+                          once=options['once'])
@@ -0,0 +1,35 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from main.sqlite import copy_database
+
+
+class Command(BaseCommand):
+    help = 'Копирование основной базы SQLite в реплики BBOARD_DATABASE_REPLICAS - замена репликации ' \
+           'для проверки маршрутизации на одном компьютере'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Повторять копирование через столько секунд')
+
+    def handle(self, *args, **options):
+        primary = connections[DEFAULT_DB_ALIAS]
+        replicas = getattr(settings, 'BBOARD_DATABASE_REPLICAS', ())
+        if primary.vendor != 'sqlite':
+            raise CommandError('Команда копирует только базы SQLite, для других СУБД настройте репликацию')
+        if not replicas:
+            raise CommandError('Реплики не заданы в BBOARD_DATABASE_REPLICAS')
+        while True:
+            for alias in replicas:
+                path = connections.databases[alias]['NAME']
+                if os.path.abspath(path) == os.path.abspath(primary.settings_dict['NAME']):
+                    raise CommandError('Реплика %s указывает на файл основной базы' % alias)
+                connections[alias].close()
+                copy_database(primary, path)
+                self.stdout.write('%s: %s' % (alias, path))
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -1,10 +1,100 @@
-from .models import SubRubric
+import json
+import logging
+from contextlib import ExitStack
 
+from django.conf import settings
+from django.db import connections
+
+from .querychecks import NPlusOneDetector, get_request_mode, wrap_queries
+from .routers import RoutingState, current_routing
+from .rubrics import get_rubric_tree
+from .timing import RequestTimings, current_timings, timed
+
+logger = logging.getLogger(__name__)
+
+
+class ServerTimingMiddleware:
+    """Замеры каждого запроса: количество и время SQL-запросов, время шаблонов, обработчика контекста
+    и миниатюр. Результаты отправляются в заголовке Server-Timing, а медленные запросы
+    (дольше BBOARD_SLOW_REQUEST_TIME секунд или больше BBOARD_SLOW_REQUEST_QUERIES SQL-запросов)
+    записываются в журнал в формате JSON вместе с самыми частыми повторяющимися SQL-запросами.
+    Должен стоять первым в MIDDLEWARE, чтобы учитывались запросы остальных посредников"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.send_header = getattr(settings, 'BBOARD_SERVER_TIMING', True)
+        self.slow_time = getattr(settings, 'BBOARD_SLOW_REQUEST_TIME', 1.0)
+        self.slow_queries = getattr(settings, 'BBOARD_SLOW_REQUEST_QUERIES', 50)
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.execute))
+                response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        timings.finish()
+        if self.send_header:
+            response['Server-Timing'] = timings.header()
+        if timings.total >= self.slow_time or timings.queries >= self.slow_queries:
+            data = dict(timings.as_dict(), method=request.method, path=request.get_full_path(),
+                        status=response.status_code)
+            logger.warning('Медленный запрос: %s', json.dumps(data, ensure_ascii=False))
+        return response
+
+
+class QueryChecksMiddleware:
+    """Поиск проблем N+1: одинаковых SQL-запросов из одной строки кода в пределах запроса.
+    В режиме 'raise' (BBOARD_QUERY_CHECKS, используется в тестах) проверяется каждый запрос
+    и найденная проблема становится исключением, в режиме 'log' проверяется только доля
+    запросов BBOARD_QUERY_CHECKS_SAMPLE_RATE, а находки записываются в журнал"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'BBOARD_NPLUSONE_THRESHOLD', 5)
+
+    def __call__(self, request):
+        mode = get_request_mode(request)
+        if not mode:
+            return self.get_response(request)
+        detector = NPlusOneDetector(mode, self.threshold, label='%s %s' % (request.method, request.path))
+        with wrap_queries(detector):
+            return self.get_response(request)
+
+
+class ReplicaRoutingMiddleware:
+    """Состояние маршрутизации запросов к базам данных (main.routers). После записи в основную базу
+    клиент получает cookie, и следующие BBOARD_REPLICA_PIN_TIME секунд все его запросы читают
+    основную базу - так он сразу видит собственные изменения. Должен стоять раньше SessionMiddleware:
+    сохранение сессии - тоже запись"""
+
+    cookie_name = 'bboard_primary'
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.pin_time = getattr(settings, 'BBOARD_REPLICA_PIN_TIME', 10)
+
+    def __call__(self, request):
+        state = RoutingState(pinned=self.cookie_name in request.COOKIES)
+        token = current_routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        if state.wrote:
+            response.set_cookie(self.cookie_name, '1', max_age=self.pin_time, httponly=True, samesite='Lax')
+        return response
+
+
+@timed('ctx')
 def bboard_context_processor(request):
     """Функция, позволяющая возвращать пользователя на то же место,
     где он находялся при открытии объявления."""
     context = {}
-    context['rubrics'] = SubRubric.objects.all()
+    context['rubrics'] = get_rubric_tree()  # дерево рубрик для боковой панели берется из кэша
     context['keyword'] = ''
     context['all'] = ''
     if 'keyword' in request.GET:  # если ключевое слово присутствует в запросе
@@ -19,6 +109,13 @@ def bboard_context_processor(request):
                 context['all'] += '&page=' + page # формирование нового урл
             else:
                 context['all'] = '?page=' + page
+    if 'cursor' in request.GET:  # страница, полученная по курсору
+        cursor = request.GET['cursor']
+        if cursor:
+            if context['all']:
+                context['all'] += '&cursor=' + cursor
+            else:
+                context['all'] = '?cursor=' + cursor
     return context
 
 
@@ -0,0 +1,24 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from main.search import get_search_backend
+    get_search_backend().install(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    from main.search import get_search_backend
+    backend = get_search_backend()
+    if hasattr(backend, 'uninstall'):
+        backend.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_auto_20200831_0950'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
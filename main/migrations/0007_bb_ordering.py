@@ -0,0 +1,17 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:03
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_bb_search_index'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='bb',
+            options={'ordering': ('-created_at', '-id'), 'verbose_name': 'Объявление', 'verbose_name_plural': 'Объявления'},
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_outboxemail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advuser',
+            name='comments_digest_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Сводка комментариев отправлена'),
+        ),
+        migrations.CreateModel(
+            name='CommentEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('comment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.Comment', verbose_name='Комментарий')),
+            ],
+            options={
+                'verbose_name': 'Новый комментарий для сводки',
+                'verbose_name_plural': 'Новые комментарии для сводок',
+            },
+        ),
+    ]
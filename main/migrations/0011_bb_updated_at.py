@@ -0,0 +1,26 @@
+# Generated by Django 3.0.14 on 2026-10-18 14:02
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def fill_updated_at(apps, schema_editor):
+    Bb = apps.get_model('main', 'Bb')
+    Bb.objects.update(updated_at=models.F('created_at'))  # до миграции объявления не изменялись
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_comment_digests'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bb',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Изменено'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_updated_at, migrations.RunPython.noop),
+    ]
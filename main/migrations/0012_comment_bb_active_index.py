@@ -0,0 +1,17 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_bb_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['bb', 'is_active', 'created_at'], name='main_comment_bb_active_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_comment_bb_active_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='bb',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Выводить в списке?'),
+        ),
+        migrations.AlterField(
+            model_name='comment',
+            name='is_active',
+            field=models.BooleanField(default=True, verbose_name='Выводить на экран?'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(fields=['is_active', 'created_at'], name='main_bb_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(fields=['rubric', 'is_active', 'created_at'], name='main_bb_rubric_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(fields=['author', 'created_at'], name='main_bb_author_idx'),
+        ),
+    ]
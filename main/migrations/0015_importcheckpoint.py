@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0014_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Импорт')),
+                ('position', models.PositiveIntegerField(default=0, verbose_name='Обработано записей')),
+                ('imported', models.PositiveIntegerField(default=0, verbose_name='Импортировано объявлений')),
+                ('rejected', models.PositiveIntegerField(default=0, verbose_name='Отклонено записей')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Изменено')),
+            ],
+            options={
+                'verbose_name': 'Контрольная точка импорта',
+                'verbose_name_plural': 'Контрольные точки импорта',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0015_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bb',
+            index=models.Index(fields=['rubric', 'is_active', 'price'], name='main_bb_rubric_price_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+def reinstall_search_index(apps, schema_editor):
+    """Индекс и триггеры пересоздаются: в индексе "ё" теперь заменяется на "е"
+    (триггеры создаются с IF NOT EXISTS, и старые без удаления остались бы на месте)"""
+    from main.search import get_search_backend
+    backend = get_search_backend()
+    if hasattr(backend, 'uninstall'):
+        backend.uninstall(schema_editor.connection)
+    backend.install(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0016_bb_price_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(reinstall_search_index, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import AbstractUser
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import  Signal
-from .utilities import send_activation_notification, get_timestamp_path
+from django.utils import timezone
+from django_cleanup import cleanup
+from .storage import content_storage
+from .utilities import send_activation_notification, get_timestamp_path, bump_cache_version, bump_cache_versions, \
+    get_bb_cache_name, RUBRICS_CACHE_NAME, BBS_CACHE_NAME
 
 user_registrated = Signal(providing_args=['instance'])  #сигнал, отправляемый при регистрации пользователя.
 
@@ -16,14 +21,17 @@ class AdvUser(AbstractUser):
                                        db_index=True, verbose_name='Прошел активацию?')
     send_messages = models.BooleanField(default=True, # показывает, согласился ли пользователь на отправку сообщений о новых комментариях
                                         verbose_name='Присылать сообщения о новых комментариях?')
+    comments_digest_at = models.DateTimeField(null=True, blank=True, editable=False,  # когда пользователю последний раз отправлялась сводка новых комментариев
+                                              verbose_name='Сводка комментариев отправлена')
     class Meta(AbstractUser.Meta):
         pass
 
     def delete(self, *args, **kwargs):
         """Удаление всех объявлений пользователя при удалении самого пользователя"""
-        for bb in self.bb_set.all():
-            bb.delete()
-        super().delete(*args, **kwargs)
+        from .deletion import delete_bbs
+        with transaction.atomic():
+            delete_bbs(self.bb_set.all())  # несколькими запросами, файлы удалятся фоновой задачей
+            return super().delete(*args, **kwargs)
 
 
 class Rubric(models.Model):
@@ -51,7 +59,8 @@ class SuperRubric(Rubric):
 
 class SubRubricManager(models.Manager):
     def get_queryset(self):
-        return super().get_queryset().filter(super_rubric__isnull=False)
+        # надрубрика нужна в __str__, без select_related каждая подрубрика в списке давала бы отдельный запрос
+        return super().get_queryset().filter(super_rubric__isnull=False).select_related('super_rubric')
 
 
 class SubRubric(Rubric):
@@ -67,33 +76,56 @@ class SubRubric(Rubric):
         verbose_name_plural = 'Подрубрики'
 
 
+@cleanup.ignore  # файлы удаляются не django_cleanup, а фоновой задачей (см. main.deletion)
 class Bb(models.Model):
     rubric = models.ForeignKey(SubRubric, on_delete=models.PROTECT, verbose_name='Рубрика')  #Запрещено каскадное удаление,
     title = models.TextField(verbose_name='Товар')
     content = models.TextField(verbose_name='Описание')
     price = models.FloatField(default=0, verbose_name='Цена')
     contacts = models.TextField(verbose_name='Контакты')
-    image = models.ImageField(blank=True, upload_to=get_timestamp_path, verbose_name="Изображение")
+    # файлы хранятся под именами по содержимому; индекс нужен для подсчета ссылок на файл (main.deletion)
+    image = models.ImageField(blank=True, upload_to=get_timestamp_path, storage=content_storage, db_index=True,
+                              verbose_name="Изображение")
     author = models.ForeignKey(AdvUser, on_delete=models.CASCADE, verbose_name='Автор')
-    is_active = models.BooleanField(default=True, db_index=True, verbose_name='Выводить в списке?')
+    is_active = models.BooleanField(default=True, verbose_name='Выводить в списке?')
     created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Опубликовано')
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name='Изменено')
 
     def delete(self, *args, **kwargs):
-        """Функция удаления всех изображений, связанных с объявлением"""
-        for ai in self.additionalimage_set.all():
-            ai.delete()
-        super().delete(*args, **kwargs)
+        """Функция удаления объявления вместе со всеми изображениями и комментариями"""
+        from .deletion import delete_bbs
+        deleted = delete_bbs(Bb.objects.filter(pk=self.pk))
+        self.pk = None
+        return deleted, {self._meta.label: deleted}
 
     class Meta:
         verbose_name = 'Объявление'
         verbose_name_plural = 'Объявления'
-        ordering = ('-created_at',)
+        ordering = ('-created_at', '-id')  # id делает порядок однозначным и совпадает с ключом CursorPaginator
+        # индексы под основные выборки: главная страница и API, рубрика, профиль автора.
+        # Условия на равенство идут первыми, дата - последней, поэтому строки читаются
+        # из индекса уже в нужном порядке; id SQLite хранит в каждом индексе сам
+        indexes = [
+            models.Index(fields=['is_active', 'created_at'], name='main_bb_active_idx'),
+            models.Index(fields=['rubric', 'is_active', 'created_at'], name='main_bb_rubric_active_idx'),
+            models.Index(fields=['rubric', 'is_active', 'price'], name='main_bb_rubric_price_idx'),  # сортировка по цене
+            models.Index(fields=['author', 'created_at'], name='main_bb_author_idx'),
+        ]
 
 
+@cleanup.ignore
 class AdditionalImage(models.Model):
     bb = models.ForeignKey(Bb, on_delete=models.CASCADE, verbose_name='Объявление')
 
-    image = models.ImageField(upload_to=get_timestamp_path, verbose_name='Изображение')
+    image = models.ImageField(upload_to=get_timestamp_path, storage=content_storage, db_index=True,
+                              verbose_name='Изображение')
+
+    def delete(self, *args, **kwargs):
+        """Удаление иллюстрации. Файл удаляется позже фоновой задачей"""
+        from .deletion import schedule_purge
+        with transaction.atomic():
+            schedule_purge([self.image.name])
+            return super().delete(*args, **kwargs)
 
     class Meta:
         verbose_name_plural = 'Дополнительные иллюстрации'
@@ -104,14 +136,127 @@ class Comment(models.Model):
     bb = models.ForeignKey(Bb, on_delete=models.CASCADE, verbose_name='Объявление')  # Каскадное удаление данных( то есть удаляются все связанные объекты)
     author = models.CharField(max_length=30, verbose_name='Автор')
     content = models.TextField(verbose_name='Содержание')
-    is_active = models.BooleanField(default=True, db_index=True, verbose_name='Выводить на экран?')
+    is_active = models.BooleanField(default=True, verbose_name='Выводить на экран?')
     created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Опубликован')
 
     class Meta:
         verbose_name_plural = 'Комментарии'
         verbose_name = 'Комментарий'
         ordering = ['created_at']
+        # страница комментариев объявления - один проход по диапазону этого индекса
+        # (первичный ключ, второй элемент курсора, SQLite хранит в каждом индексе)
+        indexes = [models.Index(fields=['bb', 'is_active', 'created_at'], name='main_comment_bb_active_idx')]
 
     def __str__(self):
         return 'Комментарий от {}'.format(self.author)
 
+
+class CommentEvent(models.Model):
+    """Отметка о новом комментарии, еще не попавшем в сводку для автора объявления.
+    Создается одним INSERT при добавлении комментария, все остальное делает send_comment_digests"""
+    comment = models.ForeignKey(Comment, on_delete=models.CASCADE, verbose_name='Комментарий')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+
+    class Meta:
+        verbose_name_plural = 'Новые комментарии для сводок'
+        verbose_name = 'Новый комментарий для сводки'
+
+
+class Job(models.Model):
+    """Фоновая задача (генерация миниатюр и т.п.), выполняемая командой run_jobs"""
+    name = models.CharField(max_length=50, verbose_name='Задача')
+    payload = models.TextField(default='{}', verbose_name='Параметры')  # параметры задачи в формате JSON
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    run_after = models.DateTimeField(default=timezone.now, verbose_name='Выполнить после')
+    is_failed = models.BooleanField(default=False, verbose_name='Завершилась ошибкой?')  # попытки исчерпаны
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создана')
+
+    class Meta:
+        verbose_name_plural = 'Фоновые задачи'
+        verbose_name = 'Фоновая задача'
+        ordering = ('run_after',)
+        indexes = (models.Index(fields=('is_failed', 'run_after')),)  # выборка задач, готовых к выполнению
+
+    def __str__(self):
+        return '%s (%s)' % (self.name, self.payload)
+
+
+class OutboxEmail(models.Model):
+    """Письмо, ожидающее отправки. Письма сохраняются почтовым бэкендом OutboxEmailBackend
+    и отправляются командой send_outbox"""
+    subject = models.CharField(max_length=255, verbose_name='Тема')
+    recipients = models.TextField(verbose_name='Получатели')
+    message = models.TextField(verbose_name='Письмо')  # содержимое письма в формате JSON
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name='Попыток')
+    send_after = models.DateTimeField(default=timezone.now, verbose_name='Отправить после')
+    is_failed = models.BooleanField(default=False, verbose_name='Не доставлено?')  # попытки исчерпаны
+    last_error = models.TextField(blank=True, verbose_name='Последняя ошибка')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Создано')
+
+    class Meta:
+        verbose_name_plural = 'Исходящие письма'
+        verbose_name = 'Исходящее письмо'
+        ordering = ('send_after',)
+        indexes = (models.Index(fields=('is_failed', 'send_after')),)
+
+    def __str__(self):
+        return '%s: %s' % (self.recipients, self.subject)
+
+
+class ImportCheckpoint(models.Model):
+    """Сколько записей файла уже обработала команда import_bbs. Обновляется в одной транзакции
+    с каждой пачкой объявлений, поэтому прерванный импорт продолжается ровно с первой необработанной записи"""
+    name = models.CharField(max_length=255, unique=True, verbose_name='Импорт')
+    position = models.PositiveIntegerField(default=0, verbose_name='Обработано записей')
+    imported = models.PositiveIntegerField(default=0, verbose_name='Импортировано объявлений')
+    rejected = models.PositiveIntegerField(default=0, verbose_name='Отклонено записей')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Изменено')
+
+    class Meta:
+        verbose_name_plural = 'Контрольные точки импорта'
+        verbose_name = 'Контрольная точка импорта'
+
+    def __str__(self):
+        return '%s: %d' % (self.name, self.position)
+
+
+def rubrics_changed_dispatcher(sender, **kwargs):
+    bump_cache_version(RUBRICS_CACHE_NAME)  # сбрасываем закэшированное дерево рубрик
+
+for rubric_model in (Rubric, SuperRubric, SubRubric):  # сигналы отправляются с классом прокси-модели в качестве sender
+    post_save.connect(rubrics_changed_dispatcher, sender=rubric_model)
+    post_delete.connect(rubrics_changed_dispatcher, sender=rubric_model)
+
+
+# поля, прежние значения которых нужны обработчикам pre_save (main.facets, main.deletion)
+STORED_FIELDS = {Bb: ('rubric', 'is_active', 'price', 'image'), AdditionalImage: ('image',)}
+
+
+def stored_values_dispatcher(sender, instance, raw=False, **kwargs):
+    """Прежние значения полей сохраняемой записи (instance._stored_values, None для новой записи)
+    читаются одним запросом на все обработчики. Подключен при загрузке моделей, раньше остальных
+    обработчиков pre_save, и поэтому вызывается первым"""
+    instance._stored_values = None
+    if not raw and not instance._state.adding and instance.pk is not None:
+        instance._stored_values = sender.objects.filter(pk=instance.pk).values(*STORED_FIELDS[sender]).first()
+
+for stored_model in STORED_FIELDS:
+    pre_save.connect(stored_values_dispatcher, sender=stored_model)
+
+
+def bb_changed_dispatcher(sender, instance, **kwargs):
+    # версии увеличиваются после фиксации транзакции, иначе параллельный запрос может закэшировать старые данные
+    transaction.on_commit(lambda: bump_cache_versions((BBS_CACHE_NAME, get_bb_cache_name(instance.pk))))
+
+post_save.connect(bb_changed_dispatcher, sender=Bb)
+post_delete.connect(bb_changed_dispatcher, sender=Bb)
+
+
+def bb_part_changed_dispatcher(sender, instance, **kwargs):
+    """Изменение комментария или иллюстрации затрагивает только страницу своего объявления"""
+    transaction.on_commit(lambda: bump_cache_version(get_bb_cache_name(instance.bb_id)))
+
+for bb_part_model in (Comment, AdditionalImage):
+    post_save.connect(bb_part_changed_dispatcher, sender=bb_part_model)
+    post_delete.connect(bb_part_changed_dispatcher, sender=bb_part_model)
@@ -0,0 +1,88 @@
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import AdvUser, Comment, CommentEvent
+from .utilities import get_host
+
+CHUNK_SIZE = 500  # количество авторов объявлений, обрабатываемых за один проход
+COMMENTS_PER_BB = 10  # сколько комментариев к одному объявлению перечислять в сводке
+
+
+def comment_saved_dispatcher(sender, instance, created, **kwargs):
+    if created:
+        CommentEvent.objects.create(comment=instance)  # сводку соберет send_comment_digests
+
+post_save.connect(comment_saved_dispatcher, sender=Comment)
+
+
+def get_digest_bbs(rows):
+    """Группировка комментариев одного автора объявлений по объявлениям"""
+    bbs = []
+    for bb_id, comments in groupby(rows, key=lambda row: row['bb_id']):
+        comments = list(comments)
+        first = comments[0]
+        bbs.append({'pk': bb_id, 'title': first['bb_title'], 'rubric_id': first['rubric_id'],
+                    'comments': [{'author': row['comment_author'], 'content': row['content'],
+                                  'created_at': row['comment_created_at']} for row in comments[:COMMENTS_PER_BB]],
+                    'more': max(len(comments) - COMMENTS_PER_BB, 0)})
+    return bbs
+
+
+def render_digest(user, rows):
+    context = {'user': user, 'host': get_host(), 'bbs': get_digest_bbs(rows), 'total': len(rows)}
+    subject = render_to_string('email/comments_digest_subject.txt', context).strip()
+    body = render_to_string('email/comments_digest_body.txt', context)
+    return EmailMessage(subject, body, to=[user['email']])
+
+
+def send_chunk(recipient_ids, now, throttled_after):
+    """Сводки для части авторов объявлений. Все комментарии берутся одним запросом,
+    а отметки о пользователях и удаление событий выполняются массово"""
+    events = CommentEvent.objects.filter(created_at__lte=now, comment__bb__author__in=recipient_ids).order_by(
+        'comment__bb__author', 'comment__bb', 'comment__created_at').values(
+        'pk', user_id=F('comment__bb__author'), username=F('comment__bb__author__username'),
+        email=F('comment__bb__author__email'), send_messages=F('comment__bb__author__send_messages'),
+        digest_at=F('comment__bb__author__comments_digest_at'), bb_id=F('comment__bb'),
+        bb_title=F('comment__bb__title'), rubric_id=F('comment__bb__rubric'), comment_author=F('comment__author'),
+        content=F('comment__content'), is_active=F('comment__is_active'), comment_created_at=F('comment__created_at'))
+    messages, notified, processed = [], [], []
+    for user_id, rows in groupby(events, key=lambda row: row['user_id']):
+        rows = list(rows)
+        user = rows[0]
+        if user['send_messages'] and user['digest_at'] and user['digest_at'] > throttled_after:
+            continue  # сводка недавно отправлялась, события дождутся следующего запуска
+        processed.extend(row['pk'] for row in rows)
+        if not user['send_messages'] or not user['email']:
+            continue
+        rows = [row for row in rows if row['is_active'] and row['comment_author'] != user['username']]
+        if rows:
+            messages.append(render_digest(user, rows))
+            notified.append(user_id)
+    with transaction.atomic():  # письма попадают в таблицу исходящих вместе с удалением событий
+        get_connection().send_messages(messages)
+        AdvUser.objects.filter(pk__in=notified).update(comments_digest_at=now)
+        for start in range(0, len(processed), CHUNK_SIZE):
+            CommentEvent.objects.filter(pk__in=processed[start:start + CHUNK_SIZE]).delete()
+    return len(messages)
+
+
+def send_comment_digests():
+    """Рассылка сводок новых комментариев авторам объявлений.
+    Каждый автор получает не больше одной сводки за BBOARD_COMMENT_DIGEST_INTERVAL секунд,
+    а при отключенном send_messages его события просто удаляются. Возвращает количество сводок"""
+    now = timezone.now()
+    throttled_after = now - timedelta(seconds=getattr(settings, 'BBOARD_COMMENT_DIGEST_INTERVAL', 60 * 60))
+    recipient_ids = list(CommentEvent.objects.filter(created_at__lte=now).order_by().values_list(
+        'comment__bb__author', flat=True).distinct())
+    sent = 0
+    for start in range(0, len(recipient_ids), CHUNK_SIZE):
+        sent += send_chunk(recipient_ids[start:start + CHUNK_SIZE], now, throttled_after)
+    return sent
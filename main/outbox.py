@@ -0,0 +1,114 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+from .tasks import get_backoff, LEASE_TIME
+
+logger = logging.getLogger(__name__)
+
+
+def serialize_message(message):
+    """Содержимое письма в виде JSON. Вложения не поддерживаются - сайт их не отправляет"""
+    return json.dumps({
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': list(message.to),
+        'cc': list(message.cc),
+        'bcc': list(message.bcc),
+        'reply_to': list(message.reply_to),
+        'headers': message.extra_headers,
+        'alternatives': list(getattr(message, 'alternatives', [])),
+    })
+
+
+def deserialize_message(data, connection=None):
+    data = json.loads(data)
+    alternatives = data.pop('alternatives')
+    message = EmailMultiAlternatives(connection=connection, **data)
+    for content, mimetype in alternatives:
+        message.attach_alternative(content, mimetype)
+    return message
+
+
+class OutboxEmailBackend(BaseEmailBackend):
+    """Почтовый бэкенд, который не отправляет письма, а сохраняет их в таблицу исходящих.
+    Благодаря ему регистрация и сброс пароля не ждут ответа SMTP-сервера"""
+
+    def send_messages(self, email_messages):
+        emails = [OutboxEmail(subject=message.subject[:255],
+                              recipients=', '.join(message.recipients()),
+                              message=serialize_message(message))
+                  for message in email_messages if message.recipients()]
+        OutboxEmail.objects.bulk_create(emails)
+        return len(emails)
+
+
+def claim_emails(limit):
+    """Резервирование писем, готовых к отправке (см. main.tasks.claim_jobs)"""
+    now = timezone.now()
+    claimed = []
+    for email in OutboxEmail.objects.filter(is_failed=False, send_after__lte=now)[:limit]:
+        updated = OutboxEmail.objects.filter(pk=email.pk, send_after=email.send_after).update(
+            send_after=now + LEASE_TIME, attempts=F('attempts') + 1)
+        if updated:
+            email.attempts += 1
+            claimed.append(email)
+    return claimed
+
+
+def fail_email(email, error):
+    """Планирование повторной отправки или перевод письма в недоставленные"""
+    max_attempts = getattr(settings, 'BBOARD_OUTBOX_MAX_ATTEMPTS', 5)
+    email.last_error = error
+    if email.attempts >= max_attempts:
+        email.is_failed = True
+        logger.error('Письмо %s не доставлено: %s', email.pk, error)
+    else:
+        email.send_after = timezone.now() + get_backoff(email.attempts)
+    email.save(update_fields=('last_error', 'is_failed', 'send_after'))
+
+
+def send_outbox(limit=100, backend=None):
+    """Отправка одной пачки писем через одно соединение с почтовым сервером.
+    Возвращает количество обработанных писем"""
+    emails = claim_emails(limit)
+    if not emails:
+        return 0
+    connection = get_connection(backend or settings.BBOARD_OUTBOX_EMAIL_BACKEND, fail_silently=False)
+    try:
+        connection.open()
+    except Exception as error:  # сервер недоступен - переносим всю пачку
+        for email in emails:
+            fail_email(email, repr(error))
+        return len(emails)
+    sent = []
+    try:
+        for email in emails:
+            try:
+                deserialize_message(email.message, connection).send()
+            except Exception as error:
+                fail_email(email, repr(error))
+            else:
+                sent.append(email.pk)
+    finally:
+        connection.close()
+        OutboxEmail.objects.filter(pk__in=sent).delete()
+    return len(emails)
+
+
+def run_outbox_worker(limit=100, backend=None, sleep=5, once=False):
+    """Цикл отправки писем: отправляет пачками, пока письма есть, затем ждет новых"""
+    while True:
+        processed = send_outbox(limit=limit, backend=backend)
+        if once and processed < limit:
+            return
+        if not processed:
+            time.sleep(sleep)
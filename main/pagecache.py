@@ -0,0 +1,96 @@
+import hashlib
+import re
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from .utilities import get_cache_versions, RUBRICS_CACHE_NAME
+
+HOLE_RE = re.compile(r'<!--hole:(\w+)-->.*?<!--endhole:\1-->', re.S)
+CSRF_RE = re.compile(r'name="csrfmiddlewaretoken" value="[^"]*"')
+
+HOLES = {}  # "дырки" в закэшированной странице: имя -> функция, формирующая HTML для текущего запроса
+
+
+def hole(name):
+    """Декоратор, регистрирующий функцию, которая заполняет дырку name для конкретного запроса.
+    Функция получает запрос и именованные параметры контроллера"""
+    def decorator(func):
+        HOLES[name] = func
+        return func
+    return decorator
+
+
+@hole('messages')
+def render_messages(request, **kwargs):
+    return render_to_string('main/messages.html', {'messages': get_messages(request)})
+
+
+def punch_holes(content):
+    """Удаление персонального содержимого из дырок перед сохранением страницы в кэш"""
+    return HOLE_RE.sub(lambda match: '<!--hole:%s--><!--endhole:%s-->' % (match.group(1), match.group(1)), content)
+
+
+def fill_holes(content, request, view_kwargs):
+    return HOLE_RE.sub(lambda match: '<!--hole:%s-->%s<!--endhole:%s-->' % (
+        match.group(1), HOLES[match.group(1)](request, **view_kwargs), match.group(1)), content)
+
+
+def get_page_key(request, groups):
+    """Ключ страницы: путь с параметрами и версии всех групп данных, от которых она зависит"""
+    versions = get_cache_versions(groups)
+    path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+    return 'page:%s:%s' % ('.'.join(str(version) for version in versions), path)
+
+
+def is_cacheable_request(request):
+    return request.method in ('GET', 'HEAD') and not request.user.is_authenticated
+
+
+def cache_anonymous_page(*groups):
+    """Полностраничный кэш для анонимных посетителей.
+    groups - группы данных (см. main.utilities), от которых зависит страница; элементом может быть функция,
+    получающая параметры контроллера. Дерево рубрик в боковой панели есть на всех страницах, поэтому
+    группа рубрик добавляется всегда. Персональные части страницы (токен CSRF, капча, сообщения) размечаются
+    тегом {% hole %} и формируются заново для каждого запроса. Ответ снабжается ETag и Last-Modified,
+    поэтому повторный запрос неизменной страницы получает ответ 304."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not is_cacheable_request(request):
+                return view(request, *args, **kwargs)
+            names = [RUBRICS_CACHE_NAME] + [group(**kwargs) if callable(group) else group for group in groups]
+            key = get_page_key(request, names)
+            page = cache.get(key)
+            if page is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming or response.has_header('Cache-Control'):
+                    return response
+                content = punch_holes(response.content.decode(response.charset))
+                if CSRF_RE.search(content):  # токен CSRF вне дырки - такую страницу кэшировать нельзя
+                    return response
+                page = {'content': content, 'content_type': response['Content-Type'],
+                        'etag': '"%s"' % hashlib.md5(content.encode()).hexdigest(),
+                        'last_modified': int(timezone.now().timestamp())}
+                cache.set(key, page, getattr(settings, 'BBOARD_PAGE_CACHE_TIMEOUT', 60 * 5))
+            else:
+                response = None
+            conditional = get_conditional_response(request, etag=page['etag'], last_modified=page['last_modified'])
+            if conditional is None and response is None:
+                response = HttpResponse(fill_holes(page['content'], request, kwargs),
+                                        content_type=page['content_type'])
+            elif conditional is not None:
+                response = conditional
+            response['ETag'] = page['etag']
+            response['Last-Modified'] = http_date(page['last_modified'])
+            patch_cache_control(response, no_cache=True)  # браузер может хранить страницу, но должен ее проверять
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,123 @@
+import base64
+import binascii
+import hashlib
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import DateTimeField, Q
+from django.utils import timezone
+
+EPOCH = datetime(1970, 1, 1)
+COUNT_CACHE_TIMEOUT = 60 * 5  # приблизительное количество объявлений обновляется раз в 5 минут
+
+
+class CursorPage:
+    """Страница, полученная по курсору. Повторяет интерфейс django.core.paginator.Page,
+    насколько это возможно без подсчета общего количества записей"""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Постраничный вывод по ключу (created_at, id) вместо OFFSET.
+    Каждая страница получается одним запросом по диапазону индекса, COUNT(*) не выполняется.
+    Курсор - непрозрачная строка со значением поля и ключом крайней записи и направлением перехода.
+    Вместо created_at можно указать другое поле с датой, например updated_at, или числовое поле,
+    например price; descending=False - вывод по возрастанию поля."""
+
+    def __init__(self, queryset, per_page, field='created_at', descending=True):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+        self.descending = descending
+        self.is_datetime = isinstance(queryset.model._meta.get_field(field), DateTimeField)
+
+    def encode_cursor(self, obj, backwards=False):
+        """Курсор, указывающий на запись obj. Запись может быть и словарем из queryset.values()"""
+        if isinstance(obj, dict):
+            value, pk = obj[self.field], obj['id']
+        else:
+            value, pk = getattr(obj, self.field), obj.pk
+        if self.is_datetime:
+            if timezone.is_aware(value):
+                value = timezone.make_naive(value, timezone.utc)
+            delta = value - EPOCH
+            value = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+        raw = '%s%r.%d' % ('p' if backwards else 'n', value, pk)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Разбор курсора: (значение поля, pk, backwards). Для неверного курсора возвращается None"""
+        if not cursor:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+            direction, (value, pk) = raw[0], raw[1:].rsplit('.', 1)
+            if self.is_datetime:
+                value = EPOCH + timedelta(microseconds=int(value))
+            else:
+                value = float(value)
+            pk = int(pk)
+        except (ValueError, TypeError, OverflowError, binascii.Error, UnicodeDecodeError):
+            return None
+        if direction not in ('n', 'p') or value != value:  # NaN не сравнивается ни с чем
+            return None
+        if self.is_datetime and settings.USE_TZ:
+            value = timezone.make_aware(value, timezone.utc)
+        return value, pk, direction == 'p'
+
+    def get_ordering(self, backwards=False):
+        prefix = '-' if self.descending != backwards else ''
+        return prefix + self.field, prefix + 'pk'
+
+    def get_page(self, cursor=None):
+        """Страница, следующая за курсором (или предшествующая ему, если курсор ведет назад)"""
+        position = self.decode_cursor(cursor)
+        if position is None:
+            queryset = self.queryset.order_by(*self.get_ordering())
+            backwards = False
+        else:
+            value, pk, backwards = position
+            field = self.field
+            lookup = 'lt' if self.descending != backwards else 'gt'  # записи за курсором в порядке обхода
+            queryset = self.queryset.filter(Q(**{'%s__%s' % (field, lookup): value}) |
+                                            Q(**{field: value, 'pk__' + lookup: pk}))
+            queryset = queryset.order_by(*self.get_ordering(backwards))
+        rows = list(queryset[:self.per_page + 1])  # лишняя запись показывает, есть ли еще страницы
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            if not rows:  # перешли назад за начало списка
+                return self.get_page()
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, position is not None
+        return CursorPage(rows, self,
+                          next_cursor=self.encode_cursor(rows[-1]) if has_next and rows else None,
+                          previous_cursor=self.encode_cursor(rows[0], backwards=True) if has_previous and rows else None)
+
+    def approximate_count(self):
+        """Приблизительное количество записей. Считается только по запросу и кэшируется на несколько минут"""
+        key = 'pagination:count:' + hashlib.md5(str(self.queryset.query).encode()).hexdigest()
+        return cache.get_or_set(key, self.queryset.count, COUNT_CACHE_TIMEOUT)
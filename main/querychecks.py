@@ -0,0 +1,132 @@
+import logging
+import os
+import random
+import re
+import sys
+import traceback
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+IN_LIST_RE = re.compile(r'IN \((?:%s, )*%s\)')  # prefetch_related и __in дают списки разной длины
+OWN_FILES = (__file__, os.path.join(os.path.dirname(__file__), 'timing.py'))  # обертки SQL - не место вызова
+
+
+class NPlusOneError(Exception):
+    """Один и тот же запрос повторяется из одного места кода - признак проблемы N+1"""
+
+
+class QueryBudgetExceeded(Exception):
+    """Контроллер выполнил больше SQL-запросов, чем объявлено в query_budget"""
+
+
+def get_mode():
+    """'raise' - исключение (в тестах), 'log' - запись в журнал, None - проверки отключены"""
+    return getattr(settings, 'BBOARD_QUERY_CHECKS', None)
+
+
+def get_request_mode(request):
+    """Режим проверок для одного запроса. В режиме 'log' проверяется только доля запросов
+    BBOARD_QUERY_CHECKS_SAMPLE_RATE; выбор делается один раз на запрос, и для попавших в выборку
+    выполняются все проверки (N+1 и бюджет), для остальных - ни одной"""
+    if not hasattr(request, 'query_checks_mode'):
+        mode = get_mode()
+        if mode == 'log' and random.random() >= getattr(settings, 'BBOARD_QUERY_CHECKS_SAMPLE_RATE', 0.01):
+            mode = None
+        request.query_checks_mode = mode
+    return request.query_checks_mode
+
+
+@contextmanager
+def wrap_queries(wrapper):
+    """Установка обертки выполнения SQL на все соединения с базами данных"""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(wrapper))
+        yield wrapper
+
+
+def get_shape(sql):
+    return IN_LIST_RE.sub('IN (...)', sql)
+
+
+def get_call_site():
+    """Кадр стека с ближайшей строкой кода проекта (не Django, не сторонних библиотек)"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        # виртуальное окружение может лежать внутри каталога проекта
+        if filename.startswith(str(settings.BASE_DIR)) and 'site-packages' not in filename and \
+                filename not in OWN_FILES:
+            return frame
+        frame = frame.f_back
+    return None
+
+
+class NPlusOneDetector:
+    """Обертка выполнения SQL, которая считает запросы одинаковой формы (текст с заполнителями),
+    выполненные из одной строки кода проекта. Когда счетчик доходит до threshold, это считается
+    проблемой N+1: в режиме 'raise' возбуждается NPlusOneError со стеком вызовов,
+    в режиме 'log' в журнал пишется предупреждение (один раз для каждого места)"""
+
+    def __init__(self, mode, threshold, label=''):
+        self.mode = mode
+        self.threshold = threshold
+        self.label = label
+        self.seen = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        frame = get_call_site()
+        if frame is not None:
+            key = (get_shape(sql), frame.f_code.co_filename, frame.f_lineno)
+            self.seen[key] += 1
+            if self.seen[key] == self.threshold:
+                self.report(sql, frame)
+        return execute(sql, params, many, context)
+
+    def report(self, sql, frame):
+        message = '%s: запрос повторен %d раз из %s:%d\n%s\nСтек вызовов:\n%s' % (
+            self.label, self.threshold, frame.f_code.co_filename, frame.f_lineno, sql,
+            ''.join(traceback.format_stack(frame)))
+        if self.mode == 'raise':
+            raise NPlusOneError(message)
+        logger.warning('Возможная проблема N+1 в %s', message)
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def query_budget(limit):
+    """Декоратор контроллера с предельным количеством SQL-запросов. Превышение в режиме 'raise'
+    возбуждает QueryBudgetExceeded, в режиме 'log' записывается в журнал (проверяется та же
+    доля запросов, что и в QueryChecksMiddleware).
+    Учитываются запросы самого контроллера и формирования шаблонов в render()"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            mode = get_request_mode(request)
+            if not mode:
+                return view(request, *args, **kwargs)
+            with wrap_queries(QueryCounter()) as counter:
+                response = view(request, *args, **kwargs)
+            if counter.count > limit:
+                message = '%s %s: %d SQL-запросов при бюджете %d' % (request.method, request.get_full_path(),
+                                                                     counter.count, limit)
+                if mode == 'raise':
+                    raise QueryBudgetExceeded(message)
+                logger.warning('Превышен бюджет запросов: %s', message)
+            return response
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
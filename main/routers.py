@@ -0,0 +1,108 @@
+import random
+import time
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError
+from django.db.models import Max
+
+current_routing = ContextVar('current_routing', default=None)  # состояние маршрутизации обрабатываемого запроса
+
+LAG_KEY = 'replicas:lag:%s'  # последний замер отставания реплики
+
+
+class RoutingState:
+    """Маршрутизация одного запроса: replica - контроллер разрешил читать с реплик,
+    pinned - чтение только с основной базы (пользователь недавно что-то записал)"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.replica = False
+        self.wrote = False
+
+
+def get_replicas():
+    return getattr(settings, 'BBOARD_DATABASE_REPLICAS', ())
+
+
+def measure_lag(alias):
+    """Отставание реплики в секундах: насколько последнее изменение объявлений в ней старше,
+    чем в основной базе. None - реплика недоступна"""
+    from .models import Bb
+
+    try:
+        primary = Bb.objects.using(DEFAULT_DB_ALIAS).aggregate(updated_at=Max('updated_at'))['updated_at']
+        replica = Bb.objects.using(alias).aggregate(updated_at=Max('updated_at'))['updated_at']
+    except DatabaseError:
+        return None
+    if primary is None or (replica is not None and replica >= primary):
+        return 0
+    if replica is None:
+        return float('inf')
+    return (primary - replica).total_seconds()
+
+
+def get_replica_lag(alias):
+    """Отставание реплики по замеру не старше BBOARD_REPLICA_LAG_CHECK_INTERVAL секунд.
+    Замер общий для всех процессов (хранится в кэше), поэтому базы опрашиваются редко"""
+    check = cache.get(LAG_KEY % alias)
+    now = time.time()
+    if check is None or now - check['at'] > getattr(settings, 'BBOARD_REPLICA_LAG_CHECK_INTERVAL', 5):
+        check = {'at': now, 'lag': measure_lag(alias)}
+        cache.set(LAG_KEY % alias, check, None)
+    return check['lag']
+
+
+def choose_replica():
+    """Случайная реплика из тех, что по последнему замеру отстают не больше чем на BBOARD_REPLICA_MAX_LAG секунд,
+    или основная база, если таких нет. Свои записи пользователь видит благодаря закреплению за основной базой
+    (RoutingState.pinned), остальные посетители могут получить данные, устаревшие на это время"""
+    max_lag = getattr(settings, 'BBOARD_REPLICA_MAX_LAG', 2)
+    replicas = []
+    for alias in get_replicas():
+        lag = get_replica_lag(alias)
+        if lag is not None and lag <= max_lag:
+            replicas.append(alias)
+    return random.choice(replicas) if replicas else DEFAULT_DB_ALIAS
+
+
+class PrimaryReplicaRouter:
+    """Запись всегда идет в основную базу, чтение - тоже, кроме контроллеров с read_from_replica.
+    Реплики содержат те же данные, что и основная база, и не мигрируются"""
+
+    def db_for_read(self, model, **hints):
+        state = current_routing.get()
+        if state is None or not state.replica or state.pinned or not get_replicas():
+            return None
+        return choose_replica()
+
+    def db_for_write(self, model, **hints):
+        state = current_routing.get()
+        if state is not None:
+            state.pinned = state.wrote = True  # до конца запроса пользователь видит свою запись
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in get_replicas():
+            return False
+        return None
+
+
+def read_from_replica(view):
+    """Декоратор контроллера, которому можно читать с реплик (только GET и HEAD)"""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        state = current_routing.get()
+        if state is None or request.method not in ('GET', 'HEAD'):
+            return view(request, *args, **kwargs)
+        state.replica = True
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            state.replica = False
+    return wrapper
@@ -0,0 +1,58 @@
+from django.core.cache import cache
+from django.urls import reverse
+
+from .models import SuperRubric, SubRubric
+from .utilities import get_cache_version, RUBRICS_CACHE_NAME
+
+RUBRICS_CACHE_TIMEOUT = 60 * 60 * 24  # дерево меняется редко, и при изменении все равно сбрасывается версией
+
+
+def build_rubric_tree():
+    """Построение дерева рубрик: надрубрики с упорядоченными подрубриками.
+    Выполняется двумя запросами независимо от количества рубрик"""
+    tree = []
+    branches = {}
+    for super_rubric in SuperRubric.objects.all():
+        branch = {'pk': super_rubric.pk, 'name': super_rubric.name, 'rubrics': []}
+        branches[super_rubric.pk] = branch
+        tree.append(branch)
+    # сортировка подрубрик совпадает с SubRubric.Meta.ordering, но без JOIN на надрубрики
+    for rubric in SubRubric.objects.order_by('order', 'name').values('pk', 'name', 'super_rubric_id'):
+        branch = branches.get(rubric['super_rubric_id'])
+        if branch is not None:
+            branch['rubrics'].append({'pk': rubric['pk'], 'name': rubric['name'],
+                                      'url': reverse('main:by_rubric', kwargs={'pk': rubric['pk']})})
+    return [branch for branch in tree if branch['rubrics']]
+
+
+def get_rubric_tree():
+    """Дерево рубрик из кэша. Ключ содержит версию, которая увеличивается
+    при любом изменении рубрик, поэтому при теплом кэше запросов к БД нет"""
+    key = 'rubrics:tree:%s' % get_cache_version(RUBRICS_CACHE_NAME)
+    tree = cache.get(key)
+    if tree is None:
+        tree = build_rubric_tree()
+        cache.set(key, tree, RUBRICS_CACHE_TIMEOUT)
+    return tree
+
+
+class RubricChoiceIterator:
+    """Ленивый список вариантов для выбора подрубрики. Подписи совпадают с SubRubric.__str__,
+    но берутся из закэшированного дерева, а не запрашивают надрубрику для каждой строки"""
+
+    def __init__(self, field):
+        self.field = field
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for branch in get_rubric_tree():
+            for rubric in branch['rubrics']:
+                yield (rubric['pk'], '%s - %s' % (branch['name'], rubric['name']))
+
+    def __len__(self):
+        return sum(len(branch['rubrics']) for branch in get_rubric_tree()) + \
+               (1 if self.field.empty_label is not None else 0)
+
+    def __bool__(self):
+        return self.field.empty_label is not None or any(branch['rubrics'] for branch in get_rubric_tree())
@@ -0,0 +1,272 @@
+import re
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils.html import escape
+from django.utils.module_loading import import_string
+from django.utils.safestring import mark_safe
+
+FTS_TABLE = 'main_bb_fts'
+HIGHLIGHT_START = '\x02'  # служебные символы, которыми FTS5 отмечает найденные слова.
+HIGHLIGHT_END = '\x03'    # После экранирования текста они заменяются на теги <mark>
+SNIPPET_TOKENS = 32  # количество слов во фрагменте описания
+
+WORD_RE = re.compile(r'\w+')
+# "ё" пишут не всегда, поэтому и в индексе, и в запросе она заменяется на "е"
+INDEXED_TITLE = "replace(replace({row}.title, 'ё', 'е'), 'Ё', 'Е')"
+INDEXED_CONTENT = "replace(replace({row}.content, 'ё', 'е'), 'Ё', 'Е')"
+
+
+# Упрощенная реализация стеммера Snowball для русского языка.
+# Используется, чтобы по запросу "машины" находились "машина", "машину" и т.д.
+VOWELS = 'аеиоуыэюяё'
+PERFECTIVE_GERUND = (('в', 'вши', 'вшись'), ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'))
+ADJECTIVE = ('ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+             'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею')
+PARTICIPLE = (('ем', 'нн', 'вш', 'ющ', 'щ'), ('ивш', 'ывш', 'ующ'))
+REFLEXIVE = ('ся', 'сь')
+VERB = (('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+        ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+         'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'))
+NOUN = ('а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й',
+        'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я')
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+
+def _region(word, start=0):
+    """Начало области после первой пары "гласная-согласная" (R1/R2 в терминах Snowball)"""
+    for i in range(start + 1, len(word)):
+        if word[i] not in VOWELS and word[i - 1] in VOWELS:
+            return i + 1
+    return len(word)
+
+
+def _strip(word, start, endings, after_a=False):
+    """Удаление самого длинного окончания из списка, если оно целиком лежит в области start.
+    Для окончаний первой группы требуется, чтобы перед ними стояла "а" или "я"."""
+    for ending in sorted(endings, key=len, reverse=True):
+        pos = len(word) - len(ending)
+        if pos >= start and word.endswith(ending):
+            if after_a and (pos - 1 < start or word[pos - 1] not in 'ая'):
+                continue
+            return word[:pos]
+    return None
+
+
+def _strip_grouped(word, start, groups):
+    first, second = groups
+    for stem in (_strip(word, start, second), _strip(word, start, first, after_a=True)):
+        if stem is not None:
+            return stem
+    return None
+
+
+def stem(word):
+    """Основа русского слова ("ё" заменяется на "е"). Слова на других языках возвращаются без изменений"""
+    word = word.lower().replace('ё', 'е')
+    rv = next((i + 1 for i, char in enumerate(word) if char in VOWELS), len(word))
+    if rv == len(word) or not any('а' <= char <= 'я' or char == 'ё' for char in word):
+        return word
+    r2 = _region(word, _region(word))
+
+    stemmed = _strip_grouped(word, rv, PERFECTIVE_GERUND)
+    if stemmed is None:
+        word = _strip(word, rv, REFLEXIVE) or word
+        stemmed = _strip(word, rv, ADJECTIVE)
+        if stemmed is not None:
+            stemmed = _strip_grouped(stemmed, rv, PARTICIPLE) or stemmed
+        else:
+            stemmed = _strip_grouped(word, rv, VERB)
+            if stemmed is None:
+                stemmed = _strip(word, rv, NOUN)
+    word = stemmed if stemmed is not None else word
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    word = _strip(word, r2, DERIVATIONAL) or word
+    if word.endswith('нн') and len(word) - 2 >= rv:
+        word = word[:-1]
+    else:
+        superlative = _strip(word, rv, SUPERLATIVE)
+        if superlative is not None:
+            word = superlative
+            if word.endswith('нн'):
+                word = word[:-1]
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+
+def get_terms(keyword):
+    """Основы слов поискового запроса без повторов"""
+    terms = []
+    for word in WORD_RE.findall(keyword):
+        term = stem(word)
+        if term and term not in terms:
+            terms.append(term)
+    return terms
+
+
+def to_html(text):
+    """Экранирование текста с отметками FTS5 и замена отметок тегами <mark>"""
+    html = escape(text).replace(HIGHLIGHT_START, '<mark>').replace(HIGHLIGHT_END, '</mark>')
+    return mark_safe(html)
+
+
+class SimpleSearchBackend:
+    """Поиск перебором строк через LIKE. Работает на любой СУБД, но сканирует всю таблицу"""
+
+    def search(self, queryset, keyword):
+        """Фильтрация набора объявлений по ключевым словам"""
+        for term in get_terms(keyword):
+            queryset = queryset.filter(Q(title__icontains=term) | Q(content__icontains=term))
+        return queryset
+
+    def highlight(self, bbs, keyword):
+        """Установка подсвеченных заголовков и описаний (атрибуты title_highlight и content_highlight)"""
+        terms = get_terms(keyword)
+        if not terms:
+            return list(bbs)
+        pattern = re.compile(r'(%s)' % '|'.join(r'\b%s\w*' % re.escape(term).replace('е', '[её]') for term in terms),
+                             re.IGNORECASE)
+        result = []
+        for bb in bbs:
+            bb.title_highlight = to_html(pattern.sub(HIGHLIGHT_START + r'\1' + HIGHLIGHT_END, bb.title))
+            bb.content_highlight = to_html(pattern.sub(HIGHLIGHT_START + r'\1' + HIGHLIGHT_END, bb.content))
+            result.append(bb)
+        return result
+
+    def install(self, connection):
+        """Создание служебных таблиц поискового индекса"""
+
+    def rebuild(self, batch_size=1000, progress=None):
+        """Перестроение поискового индекса с нуля. Возвращает количество проиндексированных объявлений"""
+        return 0
+
+
+class SQLiteFTSBackend(SimpleSearchBackend):
+    """Полнотекстовый поиск на виртуальной таблице SQLite FTS5.
+    Таблица хранит только индекс (content='main_bb'), а синхронизацию с main_bb выполняют триггеры,
+    поэтому индекс остается актуальным и при QuerySet.update() и bulk_create().
+    Слова запроса приводятся к основе и ищутся по префиксу, что дает поиск с учетом русской морфологии."""
+
+    def available(self, connection=connection):
+        return connection.vendor == 'sqlite'
+
+    def get_match(self, keyword):
+        """Выражение для MATCH: все основы слов запроса как префиксы"""
+        return ' '.join('"%s"*' % term.replace('"', '""') for term in get_terms(keyword))
+
+    def search(self, queryset, keyword):
+        if not self.available():
+            return super().search(queryset, keyword)
+        match = self.get_match(keyword)
+        if not match:
+            return queryset
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=['%s.rowid = main_bb.id' % FTS_TABLE, '%s MATCH %%s' % FTS_TABLE],
+            params=[match],
+            select={'search_rank': '%s.rank' % FTS_TABLE,
+                    'title_marked': 'highlight(%s, 0, %%s, %%s)' % FTS_TABLE,
+                    'content_marked': 'snippet(%s, 1, %%s, %%s, %%s, %d)' % (FTS_TABLE, SNIPPET_TOKENS)},
+            select_params=[HIGHLIGHT_START, HIGHLIGHT_END, HIGHLIGHT_START, HIGHLIGHT_END, '…'],
+        ).order_by('search_rank', '-created_at')  # rank в FTS5 - это bm25, меньшее значение лучше
+
+    def highlight(self, bbs, keyword):
+        bbs = list(bbs)
+        if not all(hasattr(bb, 'title_marked') for bb in bbs):
+            return super().highlight(bbs, keyword)
+        for bb in bbs:
+            bb.title_highlight = to_html(bb.title_marked)
+            bb.content_highlight = to_html(bb.content_marked)
+        return bbs
+
+    def install(self, connection):
+        if not self.available(connection):
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+            exists = cursor.fetchone() is not None
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+                "title, content, content='main_bb', content_rowid='id', "
+                "tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')".format(fts=FTS_TABLE))
+            # Триггеры удаляются вместе с таблицей main_bb, когда миграции SQLite пересоздают ее,
+            # поэтому они создаются с IF NOT EXISTS после каждого применения миграций.
+            # При удалении из индекса нужно передать тот же текст, что был проиндексирован
+            insert = "INSERT INTO {fts}(rowid, title, content) VALUES (new.id, %s, %s); " % (
+                INDEXED_TITLE.format(row='new'), INDEXED_CONTENT.format(row='new'))
+            delete = "INSERT INTO {fts}({fts}, rowid, title, content) VALUES ('delete', old.id, %s, %s); " % (
+                INDEXED_TITLE.format(row='old'), INDEXED_CONTENT.format(row='old'))
+            cursor.execute(("CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON main_bb BEGIN " + insert +
+                            "END").format(fts=FTS_TABLE))
+            cursor.execute(("CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON main_bb BEGIN " + delete +
+                            "END").format(fts=FTS_TABLE))
+            cursor.execute(("CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF title, content ON main_bb BEGIN " +
+                            delete + insert + "END").format(fts=FTS_TABLE))
+            if not exists:
+                self.fill(cursor)
+
+    def fill(self, cursor, first=0, last=None):
+        """Индексирование объявлений с ключами больше first и не больше last. Команда FTS5 'rebuild'
+        не подходит: она индексирует текст main_bb как есть, без замены буквы ё"""
+        sql = 'INSERT INTO {fts}(rowid, title, content) SELECT id, %s, %s FROM main_bb WHERE id > %%s' % (
+            INDEXED_TITLE.format(row='main_bb'), INDEXED_CONTENT.format(row='main_bb'))
+        params = [first]
+        if last is not None:
+            sql += ' AND id <= %s'
+            params.append(last)
+        cursor.execute(sql.format(fts=FTS_TABLE), params)
+
+    def uninstall(self, connection):
+        if not self.available(connection):
+            return
+        with connection.cursor() as cursor:
+            for suffix in ('ai', 'ad', 'au'):
+                cursor.execute('DROP TRIGGER IF EXISTS %s_%s' % (FTS_TABLE, suffix))
+            cursor.execute('DROP TABLE IF EXISTS %s' % FTS_TABLE)
+
+    def rebuild(self, batch_size=1000, progress=None):
+        if not self.available():
+            return 0
+        self.install(connection)
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO {fts}({fts}) VALUES ('delete-all')".format(fts=FTS_TABLE))
+        last_id, total = 0, 0
+        while True:
+            with transaction.atomic(), connection.cursor() as cursor:  # каждая пачка в отдельной транзакции
+                cursor.execute('SELECT COUNT(*), MAX(id) FROM (SELECT id FROM main_bb WHERE id > %s '
+                               'ORDER BY id LIMIT %s)', [last_id, batch_size])
+                count, upto = cursor.fetchone()
+                if not count:
+                    break
+                self.fill(cursor, last_id, upto)
+            last_id = upto
+            total += count
+            if progress:
+                progress(total)
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO {fts}({fts}) VALUES ('optimize')".format(fts=FTS_TABLE))
+        return total
+
+
+_backend = None
+
+
+def get_search_backend():
+    """Поисковый движок, указанный в настройке BBOARD_SEARCH_BACKEND"""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'BBOARD_SEARCH_BACKEND', 'main.search.SQLiteFTSBackend')
+        _backend = import_string(path)()
+    return _backend
+
+
+def install_search_index(sender, using='default', **kwargs):
+    """Обработчик post_migrate: создание таблиц и триггеров поискового индекса"""
+    from django.db import connections
+    get_search_backend().install(connections[using])
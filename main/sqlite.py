@@ -0,0 +1,79 @@
+import logging
+import random
+import sqlite3
+import time
+from functools import partial, wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+from django.db.backends.signals import connection_created
+
+logger = logging.getLogger(__name__)
+
+LOCKED_MESSAGES = ('database is locked', 'database table is locked')
+
+
+def get_pragmas(connection):
+    """Параметры соединения: ключ PRAGMAS в настройках базы данных или BBOARD_SQLITE_PRAGMAS
+    (без обеих настроек соединение остается со значениями SQLite по умолчанию)"""
+    pragmas = connection.settings_dict.get('PRAGMAS')
+    if pragmas is None:
+        pragmas = getattr(settings, 'BBOARD_SQLITE_PRAGMAS', {})
+    return pragmas
+
+
+def configure_connection(sender, connection, **kwargs):
+    """Настройка каждого нового соединения с SQLite. journal_mode сохраняется в самом файле базы,
+    остальные параметры действуют только в пределах соединения, поэтому соединения стоит
+    держать открытыми (CONN_MAX_AGE)"""
+    if connection.vendor != 'sqlite':
+        return
+    # напрямую через соединение DB-API: служебные запросы не должны попадать в счетчики запросов
+    # (main.querychecks, CaptureQueriesContext), а новые соединения открываются посреди обработки запроса
+    for name, value in get_pragmas(connection).items():
+        connection.connection.execute('PRAGMA %s = %s' % (name, value))
+
+
+connection_created.connect(configure_connection)
+
+
+def copy_database(connection, path):
+    """Копия базы SQLite соединения connection в файл path средствами SQLite (backup API):
+    копия согласована, даже если в базу в это время пишут"""
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    try:
+        connection.connection.backup(target)
+    finally:
+        target.close()
+
+
+def is_locked(error):
+    return any(message in str(error) for message in LOCKED_MESSAGES)
+
+
+def write_transaction(func=None, using=None):
+    """Декоратор записи в базу: функция выполняется в транзакции, которая при ошибке блокировки
+    повторяется целиком с экспоненциально растущей случайной задержкой.
+    Внутри уже открытой транзакции повтор невозможен, и функция просто выполняется.
+    Можно применять к готовой функции: write_transaction(form.save)()"""
+    if func is None:
+        return partial(write_transaction, using=using)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if connections[using or DEFAULT_DB_ALIAS].in_atomic_block:
+            return func(*args, **kwargs)
+        attempts = getattr(settings, 'BBOARD_WRITE_ATTEMPTS', 5)
+        delay = getattr(settings, 'BBOARD_WRITE_RETRY_DELAY', 0.05)
+        for attempt in range(1, attempts + 1):
+            try:
+                with transaction.atomic(using=using):
+                    return func(*args, **kwargs)
+            except OperationalError as error:
+                if attempt == attempts or not is_locked(error):
+                    raise
+                pause = delay * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                logger.info('База данных заблокирована, попытка %d из %d через %.2f с', attempt + 1, attempts, pause)
+                time.sleep(pause)
+    return wrapper
@@ -0,0 +1,51 @@
+import gzip
+from os.path import splitext
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+
+try:
+    import brotli
+except ImportError:  # brotli - необязательная зависимость, без нее создаются только копии .gz
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.json', '.xml', '.txt', '.html', '.ico')
+MIN_SAVING = 0.05  # сжатая копия, которая меньше исходного файла не хотя бы на 5%, не нужна
+
+
+def compress(data):
+    """Сжатые копии содержимого: [(суффикс, данные), ...]"""
+    variants = [('.gz', gzip.compress(data, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data, quality=11)))
+    return variants
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Хранилище статических файлов, которое при collectstatic добавляет к именам хэш содержимого
+    (style.css -> style.0123456789ab.css) и кладет рядом с текстовыми файлами сжатые копии .gz и .br.
+    Такие файлы main.delivery отдает с бессрочным кэшированием. Файлы, которых нет в манифесте
+    (collectstatic еще не выполнялся - при разработке и в тестах), адресуются по исходному имени"""
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        # промежуточные имена файлов CSS, которые ссылаются друг на друга, в манифест не попадают
+        for name in set(self.hashed_files.values()):
+            if splitext(name)[1].lower() not in COMPRESSIBLE_EXTENSIONS or not self.exists(name):
+                continue
+            with self.open(name) as file:
+                data = file.read()
+            for suffix, compressed in compress(data):
+                if len(compressed) > len(data) * (1 - MIN_SAVING):
+                    continue
+                if self.exists(name + suffix):
+                    self.delete(name + suffix)
+                self._save(name + suffix, ContentFile(compressed))
@@ -0,0 +1,113 @@
+import hashlib
+import re
+import time
+from os.path import splitext
+
+from django.core.cache import cache
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+CONTENT_NAME_RE = re.compile(r'^(?:[0-9a-f]{2}/){2}[0-9a-f]{64}\.\w+$')
+USED_TIMEOUT = 60 * 60 * 24  # сколько помнить повторную загрузку уже хранящегося файла
+
+
+def is_content_name(name):
+    """Имя уже дано по содержимому файла (после загрузки или команды migrate_media)"""
+    return bool(CONTENT_NAME_RE.match(name))
+
+
+def get_used_key(name):
+    return 'media:used:' + name
+
+
+def get_used_at(name):
+    """Время последней повторной загрузки уже хранившегося файла name или None"""
+    return cache.get(get_used_key(name))
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, где имя файла - хэш SHA-256 его содержимого, разложенный по вложенным каталогам:
+    ab/cd/abcd...ef.jpg. От переданного имени остается только расширение. Одинаковые файлы
+    хранятся один раз: если файл с таким содержимым уже есть, он не записывается повторно.
+    Время повторной загрузки запоминается в кэше, а не в самом файле: файл, ставший новее своих
+    миниатюр, easy_thumbnails счел бы изменившимся. По этой отметке фоновое удаление
+    (main.deletion.purge_files) видит, что файл только что снова понадобился"""
+
+    def get_content_name(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        digest = digest.hexdigest()
+        return '%s/%s/%s%s' % (digest[:2], digest[2:4], digest, splitext(name)[1].lower())
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, content)
+        if self.exists(name):
+            cache.set(get_used_key(name), time.time(), USED_TIMEOUT)
+            return name
+        # одновременная загрузка такого же файла получит имя с суффиксом - файл просто не сольется с первым
+        return super().save(name, content, max_length)
+
+    def save_derived(self, name, content):
+        """Сохранение файла, производного от хранящегося (например, варианта в другом формате),
+        под заданным именем рядом с исходным, без переименования по содержимому"""
+        return super().save(name, content)
+
+
+content_storage = ContentAddressedStorage()
+
+
+def migrate_media(batch_size=100, keep_old=False, progress=None):
+    """Перенос изображений с прежними именами (<время>.jpg в одном каталоге) в content_storage.
+    Сайт при этом продолжает работать: файл сначала копируется под новым именем вместе с миниатюрами,
+    затем записи переключаются на него одной транзакцией на пачку, и только после этого
+    старый файл ставится в очередь на удаление. Повторный запуск продолжает с оставшихся файлов.
+    Возвращает (перенесено, не найдено)"""
+    from django.core.files.storage import default_storage
+    from django.db import transaction
+    from django.utils import timezone
+
+    from .deletion import schedule_purge
+    from .images import enqueue_all_variants
+    from .models import Bb, AdditionalImage
+    from .thumbnails import generate_thumbnails
+    from .utilities import bump_cache_versions, get_bb_cache_name, BBS_CACHE_NAME
+
+    names = set(Bb.objects.exclude(image='').values_list('image', flat=True).distinct())
+    names.update(AdditionalImage.objects.values_list('image', flat=True).distinct())
+    names = sorted(name for name in names if not is_content_name(name))
+    moved = missing = 0
+    for start in range(0, len(names), batch_size):
+        mapping = {}
+        for name in names[start:start + batch_size]:
+            if not default_storage.exists(name):
+                missing += 1
+                continue
+            with default_storage.open(name) as file:
+                mapping[name] = content_storage.save(name, file)
+            generate_thumbnails(mapping[name])  # списки не должны показывать заглушки после переключения
+        with transaction.atomic():
+            bb_ids = set()
+            for old, new in mapping.items():
+                bbs = Bb.objects.filter(image=old)
+                bb_ids.update(bbs.values_list('pk', flat=True))
+                # updated_at меняется, чтобы клиенты синхронизации API получили новый адрес изображения
+                bbs.update(image=new, updated_at=timezone.now())
+                images = AdditionalImage.objects.filter(image=old)
+                bb_ids.update(images.values_list('bb', flat=True))
+                images.update(image=new)
+            if not keep_old:
+                schedule_purge(list(mapping))
+            cache_names = [BBS_CACHE_NAME] + [get_bb_cache_name(pk) for pk in bb_ids]
+            transaction.on_commit(lambda: bump_cache_versions(cache_names))
+            transaction.on_commit(lambda: enqueue_all_variants((new, None) for new in set(mapping.values())))
+        moved += len(mapping)
+        if progress:
+            progress(moved)
+    return moved, missing
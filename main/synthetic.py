@@ -0,0 +1,146 @@
+import io
+import random
+from array import array
+from contextlib import contextmanager
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from PIL import Image
+
+from .models import AdvUser, SuperRubric, SubRubric, Bb, AdditionalImage, Comment
+from .storage import content_storage
+from .utilities import bump_cache_versions, RUBRICS_CACHE_NAME, BBS_CACHE_NAME
+
+WORDS = ('продам', 'куплю', 'срочно', 'недорого', 'новый', 'почти', 'торг', 'отличное', 'состояние', 'гарантия',
+         'доставка', 'самовывоз', 'обмен', 'автомобиль', 'велосипед', 'диван', 'телефон', 'ноутбук', 'квартира',
+         'гараж', 'коляска', 'шкаф', 'холодильник', 'телевизор', 'куртка', 'сапоги', 'книги', 'игрушки', 'инструмент',
+         'документы', 'владелец', 'пробег', 'ремонт', 'комплект', 'оригинал', 'цвет', 'размер', 'центр', 'район')
+
+
+@contextmanager
+def explicit_dates(*models):
+    """Временно отключает auto_now и auto_now_add, чтобы даты записей задавались генератором"""
+    fields = [field for model in models for field in model._meta.concrete_fields
+              if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class DataGenerator:
+    """Генератор синтетических данных для замеров производительности.
+    Записи создаются через bulk_create порциями по batch_size. При одинаковых seed и until
+    получается один и тот же набор данных (с точностью до значений ключей)"""
+
+    def __init__(self, seed=0, until=None, days=365, batch_size=5000, progress=None):
+        self.random = random.Random(seed)
+        self.seed = seed
+        if until is None:
+            until = timezone.now().date()
+        self.until = timezone.make_aware(datetime.combine(until, time.min), timezone.utc)
+        self.span = timedelta(days=days).total_seconds()
+        self.batch_size = batch_size
+        self.progress = progress or (lambda message: None)
+
+    def text(self, min_words, max_words):
+        return ' '.join(self.random.choice(WORDS) for i in range(self.random.randint(min_words, max_words)))
+
+    def insert(self, model, objects):
+        """Вставка порциями. SQLite не возвращает ключи из bulk_create, поэтому они читаются следом"""
+        ids = array('q')
+        batch = []
+
+        def flush():
+            last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+            with transaction.atomic():
+                model.objects.bulk_create(batch)
+            ids.extend(model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True))
+            self.progress('%s: %d' % (model._meta.verbose_name_plural, len(ids)))
+            batch.clear()
+
+        for obj in objects:
+            batch.append(obj)
+            if len(batch) >= self.batch_size:
+                flush()
+        if batch:
+            flush()
+        return ids
+
+    def make_image_files(self, count):
+        """Небольшой набор настоящих изображений, общий для всех объявлений"""
+        names = []
+        for i in range(count):
+            buffer = io.BytesIO()
+            color = tuple(self.random.randrange(256) for channel in range(3))
+            Image.new('RGB', (640, 480), color).save(buffer, 'JPEG', quality=80)
+            # одинаковые изображения при повторном запуске хранилище не записывает второй раз
+            names.append(content_storage.save('%d_%d.jpg' % (self.seed, i), ContentFile(buffer.getvalue())))
+        return names
+
+    def generate_users(self, count):
+        password = make_password('password', salt='synthetic%d' % self.seed)  # хэш вычисляется один раз
+        prefix = 'user%d_' % self.seed
+        return self.insert(AdvUser, (AdvUser(username='%s%d' % (prefix, i), email='%s%d@example.com' % (prefix, i),
+                                             password=password, is_activated=True,
+                                             send_messages=self.random.random() < 0.5)
+                                     for i in range(count)))
+
+    def generate_rubrics(self, super_count, sub_count):
+        super_ids = self.insert(SuperRubric, (SuperRubric(name='Раздел %d-%d' % (self.seed, i), order=i)
+                                              for i in range(super_count)))
+        return self.insert(SubRubric, (SubRubric(name='Рубрика %d-%d.%d' % (self.seed, i, j), order=j,
+                                                 super_rubric_id=super_id)
+                                       for i, super_id in enumerate(super_ids) for j in range(sub_count)))
+
+    def bb_created_at(self, index, count):
+        """Объявления равномерно распределены по периоду и создаются в порядке ключей, как на живом сайте"""
+        return self.until - timedelta(seconds=self.span * (1 - (index + 0.5) / count))
+
+    def generate_bbs(self, count, user_ids, rubric_ids, image_names, image_share):
+        def bbs():
+            for i in range(count):
+                created_at = self.bb_created_at(i, count)
+                yield Bb(rubric_id=self.random.choice(rubric_ids), author_id=self.random.choice(user_ids),
+                         title=self.text(2, 6).capitalize(), content=self.text(10, 60).capitalize(),
+                         price=round(self.random.lognormvariate(8, 1.5), -1), contacts='+7 900 %07d' % i,
+                         image=self.random.choice(image_names) if self.random.random() < image_share else '',
+                         is_active=self.random.random() < 0.95, created_at=created_at, updated_at=created_at)
+        return self.insert(Bb, bbs())
+
+    def generate_images(self, count, bb_ids, image_names):
+        return self.insert(AdditionalImage, (AdditionalImage(bb_id=self.random.choice(bb_ids),
+                                                             image=self.random.choice(image_names))
+                                             for i in range(count)))
+
+    def generate_comments(self, count, bb_ids):
+        def comments():
+            for i in range(count):
+                # популярные объявления получают непропорционально много комментариев
+                index = int(len(bb_ids) * self.random.random() ** 3)
+                bb_created_at = self.bb_created_at(index, len(bb_ids))
+                created_at = bb_created_at + (self.until - bb_created_at) * self.random.random()
+                yield Comment(bb_id=bb_ids[index], author=self.text(1, 1).capitalize(), content=self.text(3, 30),
+                              is_active=self.random.random() < 0.97, created_at=created_at)
+        return self.insert(Comment, comments())
+
+    def generate(self, users=100, super_rubrics=5, sub_rubrics=6, bbs=10000, images=2000, comments=30000,
+                 image_files=20, image_share=0.3):
+        image_names = self.make_image_files(image_files) if image_files else ['']
+        user_ids = self.generate_users(users)
+        rubric_ids = self.generate_rubrics(super_rubrics, sub_rubrics)
+        with explicit_dates(Bb, Comment):
+            bb_ids = self.generate_bbs(bbs, user_ids, rubric_ids, image_names, image_share)
+            if images and image_files:
+                self.generate_images(images, bb_ids, image_names)
+            self.generate_comments(comments, bb_ids)
+        bump_cache_versions((RUBRICS_CACHE_NAME, BBS_CACHE_NAME))  # сигналы при bulk_create не отправляются
+        return {'users': len(user_ids), 'rubrics': len(rubric_ids), 'bbs': len(bb_ids)}
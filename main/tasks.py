@@ -0,0 +1,112 @@
+import json
+import logging
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}  # зарегистрированные обработчики задач: имя -> функция
+LEASE_TIME = timedelta(minutes=10)  # время, на которое задача резервируется за исполнителем
+
+
+def task(name):
+    """Декоратор, регистрирующий функцию как обработчик фоновой задачи name"""
+    def decorator(func):
+        TASKS[name] = func
+        return func
+    return decorator
+
+
+def enqueue(task_name, **payload):
+    """Постановка задачи в очередь после фиксации текущей транзакции"""
+    transaction.on_commit(lambda: Job.objects.create(name=task_name, payload=json.dumps(payload)))
+
+
+def enqueue_many(task_name, payloads, batch_size=500, run_after=None):
+    """Постановка в очередь множества однотипных задач одним запросом на пачку.
+    run_after - не выполнять задачи раньше этого момента"""
+    jobs = [Job(name=task_name, payload=json.dumps(payload), run_after=run_after or timezone.now())
+            for payload in payloads]
+    Job.objects.bulk_create(jobs, batch_size=batch_size)
+    return len(jobs)
+
+
+def get_backoff(attempts):
+    """Задержка перед повторной попыткой: растет экспоненциально"""
+    base = getattr(settings, 'BBOARD_JOB_RETRY_DELAY', 30)
+    return timedelta(seconds=base * 2 ** (attempts - 1))
+
+
+def execute(name, payload):
+    """Выполнение задачи. Возвращает None при успехе или текст ошибки"""
+    try:
+        TASKS[name](**json.loads(payload))
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой', name)
+        return traceback.format_exc()
+    return None
+
+
+def claim_jobs(limit):
+    """Резервирование готовых к выполнению задач. Задача считается зарезервированной,
+    если удалось сдвинуть ее время выполнения - так одну задачу не возьмут два исполнителя"""
+    now = timezone.now()
+    claimed = []
+    candidates = Job.objects.filter(is_failed=False, run_after__lte=now, name__in=TASKS)
+    for job in candidates[:limit]:
+        updated = Job.objects.filter(pk=job.pk, run_after=job.run_after).update(
+            run_after=now + LEASE_TIME, attempts=F('attempts') + 1)
+        if updated:
+            job.attempts += 1
+            claimed.append(job)
+    return claimed
+
+
+def finish_job(job, error):
+    """Удаление выполненной задачи или планирование повторной попытки"""
+    if error is None:
+        job.delete()
+        return
+    max_attempts = getattr(settings, 'BBOARD_JOB_MAX_ATTEMPTS', 5)
+    job.last_error = error
+    if job.attempts >= max_attempts:
+        job.is_failed = True  # попытки исчерпаны, задача остается в таблице для разбора
+    else:
+        job.run_after = timezone.now() + get_backoff(job.attempts)
+    job.save(update_fields=('last_error', 'is_failed', 'run_after'))
+
+
+def run_jobs(limit=100, workers=1):
+    """Выполнение одной пачки задач. При workers > 1 задачи выполняются в пуле процессов.
+    Возвращает количество обработанных задач"""
+    jobs = claim_jobs(limit)
+    if not jobs:
+        return 0
+    if workers > 1 and len(jobs) > 1:
+        connections.close_all()  # дочерние процессы должны открыть собственные соединения с БД
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            errors = list(pool.map(execute, [job.name for job in jobs], [job.payload for job in jobs]))
+    else:
+        errors = [execute(job.name, job.payload) for job in jobs]
+    for job, error in zip(jobs, errors):
+        finish_job(job, error)
+    return len(jobs)
+
+
+def run_worker(limit=100, workers=1, sleep=5, once=False):
+    """Цикл исполнителя: выполняет задачи пачками, пока они есть, затем ждет новых"""
+    while True:
+        processed = run_jobs(limit=limit, workers=workers)
+        if once and processed < limit:
+            return
+        if not processed:
+            time.sleep(sleep)
@@ -0,0 +1,90 @@
+from django import template
+from django.templatetags.static import static
+from django.utils.html import format_html, format_html_join
+
+from ..images import get_variants
+from ..thumbnails import get_existing_thumbnail
+
+register = template.Library()
+
+PLACEHOLDER = 'main/empty.png'
+
+
+@register.inclusion_tag('main/cursor_pagination.html', takes_context=True)
+def cursor_pagination(context, page, parameter_name='cursor'):
+    """Ссылки "назад"/"вперед" для страницы, полученной от CursorPaginator.
+    Остальные параметры запроса (например, keyword) сохраняются"""
+    params = context['request'].GET.copy()
+    params.pop('page', None)
+
+    def url(cursor):
+        params[parameter_name] = cursor
+        return '?' + params.urlencode()
+
+    return {
+        'page': page,
+        'previous_url': url(page.previous_cursor) if page.has_previous() else None,
+        'next_url': url(page.next_cursor) if page.has_next() else None,
+    }
+
+
+@register.simple_tag(takes_context=True)
+def filter_url(context, **kwargs):
+    """Ссылка на ту же страницу с измененными параметрами запроса (значение None убирает параметр).
+    Выбранный фильтр меняет список, поэтому курсор и номер страницы сбрасываются"""
+    params = context['request'].GET.copy()
+    for name in ('cursor', 'page'):
+        params.pop(name, None)
+    for name, value in kwargs.items():
+        if value is None:
+            params.pop(name, None)
+        else:
+            params[name] = value
+    return '?' + params.urlencode()
+
+
+@register.simple_tag
+def thumbnail_img(image, alias, css_class=''):
+    """Тег <img> с готовой миниатюрой изображения и вариантом двойной плотности для srcset (алиас <alias>_2x).
+    Пока миниатюра не создана фоновой задачей, выводится заглушка"""
+    thumbnail = get_existing_thumbnail(image, alias)
+    if not thumbnail:
+        return format_html('<img class="{}" src="{}">', css_class, static(PLACEHOLDER))
+    retina = get_existing_thumbnail(image, alias + '_2x')
+    if not retina:
+        return format_html('<img class="{}" src="{}">', css_class, thumbnail.url)
+    return format_html('<img class="{}" src="{}" srcset="{} 1x, {} 2x">', css_class, thumbnail.url,
+                       thumbnail.url, retina.url)
+
+
+@register.simple_tag
+def picture(image, css_class=''):
+    """Тег <picture> с готовыми вариантами изображения в форматах AVIF и WebP: браузер выберет
+    первый поддерживаемый, остальные получат исходное изображение из <img>"""
+    if not image:
+        return ''
+    sources = format_html_join('', '<source type="{}" srcset="{}">',
+                               ((mime_type, image.storage.url(name)) for mime_type, name in get_variants(image.name)))
+    return format_html('<picture>{}<img class="{}" src="{}"></picture>', sources, css_class, image.url)
+
+
+class HoleNode(template.Node):
+    def __init__(self, name, nodelist):
+        self.name = name
+        self.nodelist = nodelist
+
+    def render(self, context):
+        return '<!--hole:%s-->%s<!--endhole:%s-->' % (self.name, self.nodelist.render(context), self.name)
+
+
+@register.tag
+def hole(parser, token):
+    """{% hole 'имя' %}...{% endhole %} - персональная часть страницы, которая не попадает
+    в полностраничный кэш и формируется заново для каждого запроса (см. main.pagecache)"""
+    bits = token.split_contents()
+    if len(bits) != 2:
+        raise template.TemplateSyntaxError('Тег %s принимает один аргумент - имя' % bits[0])
+    name = bits[1].strip('\'"')
+    nodelist = parser.parse(('endhole',))
+    parser.delete_first_token()
+    return HoleNode(name, nodelist)
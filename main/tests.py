@@ -1,3 +1,1194 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings as django_settings
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.files.base import ContentFile
+from django.db import OperationalError, connection, connections, transaction
+from django.db.models import F
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from api.export import BbExport, CommentExport, stream_export
+from .asgi import ASGIHandler
+from .benchmark import Benchmark, build_url, collect_routes, database_copy, percentile
+from .checks import check_shared_cache
+from .deletion import delete_bbs, purge_files
+from .details import COMMENTS_PER_PAGE, get_bb_detail, get_comments_page
+from .facets import SORTS, get_facets, get_paginator, reset_facets
+from .images import VARIANT_FORMATS, generate_variants, get_variants
+from .imports import BbImporter
+from .notifications import send_comment_digests
+from .outbox import claim_emails, send_outbox
+from .pagecache import HOLES, cache_anonymous_page, hole
+from .models import AdvUser, SuperRubric, SubRubric, Bb, AdditionalImage, Comment, CommentEvent, ImportCheckpoint, Job, OutboxEmail
+from .pagination import CursorPaginator
+from .querychecks import NPlusOneDetector, NPlusOneError, QueryBudgetExceeded, query_budget, wrap_queries
+from .storage import content_storage
+from .tasks import TASKS, claim_jobs, enqueue, run_jobs, task
+from .timing import RequestTimings, current_timings, timed
+from .thumbnails import enqueue_thumbnails, generate_thumbnails, get_existing_thumbnail
+from .synthetic import DataGenerator, explicit_dates
+from .utilities import bump_cache_version, get_cache_version, get_bb_cache_name, BBS_CACHE_NAME, RUBRICS_CACHE_NAME
+from .search import SQLiteFTSBackend, stem
+from .sqlite import write_transaction
+from .routers import LAG_KEY, PrimaryReplicaRouter, RoutingState, current_routing
+
+HOT_TABLES = ('main_bb', 'main_comment')  # таблицы, которые растут вместе с сайтом
+SCAN_RE = re.compile(r'^SCAN (TABLE )?(%s)\b' % '|'.join(HOT_TABLES))
+
+
+class CursorPaginationTests(TestCase):
+    """Обход страниц по курсору вперед и назад, в том числе по записям с одинаковой датой"""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = AdvUser.objects.create_user('author', 'author@example.com')
+        rubric = SubRubric.objects.create(name='Автомобили', super_rubric=SuperRubric.objects.create(name='Транспорт'))
+        now = timezone.now()
+        with explicit_dates(Bb):
+            for i in range(7):  # у пар объявлений одинаковая дата, порядок внутри пары задает ключ
+                Bb.objects.create(rubric=rubric, author=author, title='Объявление %d' % i, content='-',
+                                  price=i % 3, created_at=now - timedelta(minutes=i // 2), updated_at=now)
+
+    def walk(self, paginator):
+        """Все страницы вперед, затем назад от последней: (записи вперед, записи назад)"""
+        forward, pages = [], []
+        page = paginator.get_page()
+        while True:
+            pages.append(page)
+            forward += [bb.pk for bb in page]
+            if not page.has_next():
+                break
+            page = paginator.get_page(page.next_cursor)
+        backward = [bb.pk for bb in page]
+        while page.has_previous():
+            page = paginator.get_page(page.previous_cursor)
+            backward = [bb.pk for bb in page] + backward
+        return forward, backward, len(pages)
+
+    def test_by_date(self):
+        expected = list(Bb.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+        forward, backward, pages = self.walk(CursorPaginator(Bb.objects.all(), 2))
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+        self.assertEqual(pages, 4)
+
+    def test_by_price(self):
+        expected = list(Bb.objects.order_by('price', 'pk').values_list('pk', flat=True))
+        forward, backward, pages = self.walk(CursorPaginator(Bb.objects.all(), 3, field='price', descending=False))
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+    def test_invalid_cursor(self):
+        paginator = CursorPaginator(Bb.objects.all(), 2)
+        first = [bb.pk for bb in paginator.get_page()]
+        for cursor in ('мусор', 'bm5hbg', paginator.encode_cursor(Bb.objects.first())[:-3]):
+            self.assertEqual([bb.pk for bb in paginator.get_page(cursor)], first)
+        self.assertIsNone(CursorPaginator(Bb.objects.all(), 2, field='price').decode_cursor('bm5hbi4x'))  # nnan.1
+
+    def test_views(self):
+        response = self.client.get('/%d/' % Bb.objects.first().rubric_id)
+        self.assertEqual(len(response.context['bbs']), 2)
+        cursor = response.context['page'].next_cursor
+        response = self.client.get('/%d/?cursor=%s' % (Bb.objects.first().rubric_id, cursor))
+        self.assertTrue(response.context['page'].has_previous())
+
+
+class JobQueueTests(TransactionTestCase):
+    """Задачи ставятся в очередь после фиксации транзакции и выполняются с повторами"""
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, BBOARD_JOB_MAX_ATTEMPTS=2, BBOARD_JOB_RETRY_DELAY=30)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.calls = []
+
+        @task('test')
+        def test_task(fail=False):
+            self.calls.append(fail)
+            if fail:
+                raise ValueError('ошибка задачи')
+
+        self.addCleanup(TASKS.pop, 'test')
+
+    def test_enqueue_on_commit(self):
+        with transaction.atomic():
+            enqueue('test')
+            self.assertFalse(Job.objects.exists())
+        self.assertEqual(Job.objects.count(), 1)
+        with self.assertRaises(ValueError), transaction.atomic():
+            enqueue('test')
+            raise ValueError
+        self.assertEqual(Job.objects.count(), 1)  # задача отмененной транзакции не ставится
+        self.assertEqual(run_jobs(), 1)
+        self.assertEqual((self.calls, Job.objects.count()), ([False], 0))
+
+    def test_retry_and_failure(self):
+        enqueue('test', fail=True)
+        started = timezone.now()
+        with self.assertLogs('main.tasks', 'ERROR'):
+            self.assertEqual(run_jobs(), 1)
+        job = Job.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertIn('ошибка задачи', job.last_error)
+        self.assertGreaterEqual(job.run_after, started + timedelta(seconds=30))
+        self.assertEqual(run_jobs(), 0)  # повтор еще не наступил
+        Job.objects.update(run_after=timezone.now())
+        with self.assertLogs('main.tasks', 'ERROR'):
+            self.assertEqual(run_jobs(), 1)
+        self.assertTrue(Job.objects.get().is_failed)
+        Job.objects.update(run_after=timezone.now())
+        self.assertEqual(run_jobs(), 0)  # исчерпавшая попытки задача больше не выполняется
+        self.assertEqual(self.calls, [True, True])
+
+    def test_claim_once(self):
+        enqueue('test')
+        self.assertEqual(len(claim_jobs(10)), 1)
+        self.assertEqual(claim_jobs(10), [])  # задача зарезервирована первым исполнителем
+
+    def test_thumbnails(self):
+        user = AdvUser.objects.create_user('author', 'author@example.com')
+        rubric = SubRubric.objects.create(name='Рубрика')
+        image = io.BytesIO()
+        Image.new('RGB', (400, 300), (0, 0, 200)).save(image, 'JPEG')
+        name = content_storage.save('photo.jpg', ContentFile(image.getvalue()))
+        bb = Bb.objects.create(rubric=rubric, author=user, title='Объявление', content='-', contacts='-', image=name)
+        enqueue_thumbnails(name)  # повторная постановка того же изображения пропускается
+        self.assertEqual(Job.objects.filter(name='thumbnails').count(), 1)
+        self.assertIsNone(get_existing_thumbnail(bb.image, 'default'))  # при показе миниатюра не создается
+        run_jobs()
+        thumbnail = get_existing_thumbnail(Bb.objects.get().image, 'default')
+        self.assertEqual(thumbnail.height, 96)  # crop='scale': меньшая сторона по размеру миниатюры
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError('почтовый сервер недоступен')
+
+
+@override_settings(EMAIL_BACKEND='main.outbox.OutboxEmailBackend',
+                   BBOARD_OUTBOX_EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+                   BBOARD_OUTBOX_MAX_ATTEMPTS=2, BBOARD_JOB_RETRY_DELAY=30)
+class OutboxTests(TestCase):
+    """Письма попадают в таблицу исходящих в транзакции отправителя и отправляются send_outbox"""
+
+    def test_saved_with_transaction(self):
+        with transaction.atomic():
+            mail.send_mail('Тема', 'Текст', 'site@example.com', ['user@example.com'])
+        with self.assertRaises(ValueError), transaction.atomic():
+            mail.send_mail('Отмена', 'Текст', 'site@example.com', ['user@example.com'])
+            raise ValueError
+        self.assertEqual(list(OutboxEmail.objects.values_list('subject', flat=True)), ['Тема'])
+        self.assertEqual(mail.outbox, [])  # при сохранении письмо не отправляется
+
+    def test_delivery(self):
+        message = mail.EmailMultiAlternatives('Тема', 'Текст', 'site@example.com', ['user@example.com'])
+        message.attach_alternative('<p>Текст</p>', 'text/html')
+        message.send()
+        self.assertEqual(send_outbox(), 1)
+        self.assertEqual(send_outbox(), 0)  # отправленное письмо удалено и второй раз не уходит
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['user@example.com'])
+        self.assertEqual(mail.outbox[0].alternatives, [('<p>Текст</p>', 'text/html')])
+        self.assertFalse(OutboxEmail.objects.exists())
+
+    def test_claimed_once(self):
+        mail.send_mail('Тема', 'Текст', 'site@example.com', ['user@example.com'])
+        self.assertEqual(len(claim_emails(10)), 1)
+        self.assertEqual(claim_emails(10), [])  # второй исполнитель письмо не получит
+        self.assertEqual(send_outbox(), 0)
+
+    def test_retry_and_failure(self):
+        mail.send_mail('Тема', 'Текст', 'site@example.com', ['user@example.com'])
+        started = timezone.now()
+        self.assertEqual(send_outbox(backend='main.tests.FailingEmailBackend'), 1)
+        email = OutboxEmail.objects.get()
+        self.assertEqual(email.attempts, 1)
+        self.assertIn('почтовый сервер недоступен', email.last_error)
+        self.assertGreaterEqual(email.send_after, started + timedelta(seconds=30))
+        self.assertEqual(send_outbox(), 0)  # повтор еще не наступил
+        OutboxEmail.objects.update(send_after=timezone.now())
+        with self.assertLogs('main.outbox', 'ERROR'):
+            send_outbox(backend='main.tests.FailingEmailBackend')
+        self.assertTrue(OutboxEmail.objects.get().is_failed)
+        OutboxEmail.objects.update(send_after=timezone.now())
+        self.assertEqual(send_outbox(), 0)
+        self.assertEqual(mail.outbox, [])
+
+
+class CommentDigestTests(TestCase):
+    """Сводки новых комментариев: одно письмо на автора, не чаще BBOARD_COMMENT_DIGEST_INTERVAL"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = AdvUser.objects.create_user('author', 'author@example.com')
+        cls.silent = AdvUser.objects.create_user('silent', 'silent@example.com', send_messages=False)
+        rubric = SubRubric.objects.create(name='Рубрика')
+        cls.bbs = [Bb.objects.create(rubric=rubric, author=user, title=title, content='-', contacts='-')
+                   for user, title in ((cls.author, 'Машина'), (cls.author, 'Велосипед'), (cls.silent, 'Лодка'))]
+
+    def comment(self, bb, author='Гость', is_active=True):
+        return Comment.objects.create(bb=bb, author=author, content='Комментарий от %s' % author, is_active=is_active)
+
+    def test_digest(self):
+        car, bicycle, boat = self.bbs
+        self.comment(car)
+        self.comment(car, 'Скрытый', is_active=False)
+        self.comment(car, 'author')  # свои комментарии автору не пересылаются
+        self.comment(bicycle, 'Покупатель')
+        self.comment(boat)
+        self.assertEqual(send_comment_digests(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        message = mail.outbox[0]
+        self.assertEqual(message.to, ['author@example.com'])
+        self.assertIn('(2)', message.subject)
+        self.assertIn('Машина', message.body)
+        self.assertIn('Покупатель', message.body)
+        self.assertNotIn('Скрытый', message.body)
+        self.assertFalse(CommentEvent.objects.exists())  # события отключившего письма автора тоже удалены
+        self.assertIsNotNone(AdvUser.objects.get(pk=self.author.pk).comments_digest_at)
+
+    def test_throttling(self):
+        self.comment(self.bbs[0])
+        self.assertEqual(send_comment_digests(), 1)
+        self.comment(self.bbs[0], 'Второй гость')
+        self.assertEqual(send_comment_digests(), 0)  # сводка недавно отправлялась
+        self.assertEqual(CommentEvent.objects.count(), 1)
+        AdvUser.objects.filter(pk=self.author.pk).update(comments_digest_at=timezone.now() - timedelta(days=1))
+        self.assertEqual(send_comment_digests(), 1)
+        self.assertIn('Второй гость', mail.outbox[-1].body)
+
+    def test_queries_do_not_grow(self):
+        for bb in self.bbs:
+            for i in range(5):
+                self.comment(bb, 'Гость %d' % i)
+        with self.assertNumQueries(6):  # авторы, события, UPDATE и DELETE в транзакции - независимо от числа писем
+            send_comment_digests()
+
+
+class BbDetailTests(TransactionTestCase):
+    """Объявление для страницы просмотра: три запроса, кэш со сбросом по версии объявления, подгрузка комментариев"""
+
+    def setUp(self):
+        cache.clear()
+        user = AdvUser.objects.create_user('author', 'author@example.com')
+        self.bb = Bb.objects.create(rubric=SubRubric.objects.create(name='Рубрика'), author=user,
+                                    title='Объявление', content='-', contacts='-')
+        AdditionalImage.objects.bulk_create([AdditionalImage(bb=self.bb, image='photo%d.jpg' % i) for i in range(2)])
+        Comment.objects.bulk_create([Comment(bb=self.bb, author='Гость %d' % i, content='-')
+                                     for i in range(COMMENTS_PER_PAGE + 5)])
+        Comment.objects.create(bb=self.bb, author='Скрытый', content='-', is_active=False)
+
+    def test_load(self):
+        with self.assertNumQueries(3):
+            bb = get_bb_detail(self.bb.pk)
+            self.assertEqual((bb.rubric.super_rubric, bb.author.username), (None, 'author'))
+            self.assertEqual(len(bb.additionalimage_set.all()), 2)
+        self.assertEqual(len(bb.comments), COMMENTS_PER_PAGE)
+        self.assertEqual(bb.comments[0].author, 'Гость %d' % (COMMENTS_PER_PAGE + 4))  # от новых к старым
+        with self.assertNumQueries(0):
+            get_bb_detail(self.bb.pk)
+        rest = get_comments_page(self.bb.pk, bb.comments_cursor)
+        self.assertEqual([comment.author for comment in rest.object_list], ['Гость %d' % i for i in range(4, -1, -1)])
+        self.assertIsNone(rest.next_cursor)
+
+    def test_invalidation(self):
+        get_bb_detail(self.bb.pk)
+        Comment.objects.create(bb=self.bb, author='Новый', content='-')
+        self.assertEqual(get_bb_detail(self.bb.pk).comments[0].author, 'Новый')
+        self.bb.is_active = False
+        self.bb.save()
+        with self.assertRaises(Http404):
+            get_bb_detail(self.bb.pk)
+        self.assertEqual(get_bb_detail(self.bb.pk, active_only=False).pk, self.bb.pk)
+
+    def test_views(self):
+        response = self.client.get(reverse('main:detail', args=(self.bb.rubric_id, self.bb.pk)))
+        self.assertEqual(len(response.context['comments']), COMMENTS_PER_PAGE)
+        response = self.client.get(reverse('main:comments', args=(self.bb.pk,)),
+                                   {'cursor': response.context['comments_cursor']})
+        self.assertEqual(len(response.context['comments']), 5)
+        self.assertEqual(self.client.get(reverse('main:comments', args=(self.bb.pk + 1,))).status_code, 404)
+
+
+class PageCacheTests(TestCase):
+    """Полностраничный кэш: дырки заполняются для каждого запроса, персональные страницы не кэшируются"""
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+        self.factory = RequestFactory()
+        self.visitor = iter(range(100))
+
+        @hole('visitor')
+        def render_visitor(request, **kwargs):
+            return 'посетитель %d' % next(self.visitor)
+
+        self.addCleanup(HOLES.pop, 'visitor')
+
+    def get_view(self, content):
+        @cache_anonymous_page(BBS_CACHE_NAME)
+        def view(request):
+            self.calls += 1
+            return HttpResponse(content)
+        return view
+
+    def request(self, view, method='get', user=None, **extra):
+        request = getattr(self.factory, method)('/page/', **extra)
+        request.user = user or AnonymousUser()
+        return view(request)
+
+    def test_holes(self):
+        view = self.get_view('<p>Список</p><!--hole:visitor-->посетитель 0<!--endhole:visitor-->')
+        self.request(view)
+        self.assertEqual(self.calls, 1)
+        response = self.request(view)
+        self.assertEqual(self.calls, 1)
+        # в кэше страница без содержимого дырки, при выдаче дырка заполняется для нового запроса
+        self.assertContains(response, '<p>Список</p><!--hole:visitor-->посетитель 0<!--endhole:visitor-->')
+        self.assertContains(self.request(view), '<!--hole:visitor-->посетитель 1<!--endhole:visitor-->')
+
+    def test_csrf_token_outside_hole(self):
+        view = self.get_view('<input type="hidden" name="csrfmiddlewaretoken" value="секрет">')
+        self.request(view)
+        response = self.request(view)
+        self.assertEqual(self.calls, 2)  # страница с токеном вне дырки в кэш не попадает
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_bypass(self):
+        view = self.get_view('<p>Список</p>')
+        user = AdvUser.objects.create_user('author', 'author@example.com')
+        self.request(view, user=user)
+        self.request(view, user=user)
+        self.request(view, method='post')
+        self.assertEqual(self.calls, 3)
+        self.request(view)
+        self.request(view, method='head')
+        self.assertEqual(self.calls, 4)
+
+    def test_validators_and_versions(self):
+        view = self.get_view('<p>Список</p>')
+        response = self.request(view)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.request(view, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.request(view, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+        self.assertEqual(self.calls, 1)
+        bump_cache_version(BBS_CACHE_NAME)
+        self.assertEqual(self.request(view, HTTP_IF_NONE_MATCH=etag).status_code, 304)  # содержимое то же
+        self.assertEqual(self.calls, 2)
+
+    def test_thumbnails_reset_listings(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            image = io.BytesIO()
+            Image.new('RGB', (200, 100)).save(image, 'JPEG')
+            name = content_storage.save('photo.jpg', ContentFile(image.getvalue()))
+            version = get_cache_version(BBS_CACHE_NAME)
+            generate_thumbnails(name)
+            self.assertEqual(get_cache_version(BBS_CACHE_NAME), version + 1)
+            generate_thumbnails(name)  # миниатюры уже есть - списки не сбрасываются
+            self.assertEqual(get_cache_version(BBS_CACHE_NAME), version + 1)
+
+
+class SearchTests(TestCase):
+    """Основы слов, синхронизация индекса FTS5 триггерами и порядок результатов по релевантности"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = AdvUser.objects.create_user('author', 'author@example.com')
+        cls.rubric = SubRubric.objects.create(name='Автомобили', super_rubric=SuperRubric.objects.create(name='Транспорт'))
+
+    def create(self, title, content='-'):
+        return Bb.objects.create(rubric=self.rubric, author=self.author, title=title, content=content, price=0)
+
+    def search(self, keyword):
+        return list(SQLiteFTSBackend().search(Bb.objects.all(), keyword).values_list('title', flat=True))
+
+    def test_stem(self):
+        self.assertEqual(stem('машины'), stem('машину'))
+        self.assertEqual(stem('продаётся'), stem('продается'))
+        self.assertEqual(stem('Зелёный'), stem('зеленый'))
+        self.assertEqual(stem('Toyota'), 'toyota')
+
+    def test_triggers(self):
+        bb = self.create('Продаётся зелёная машина')
+        self.assertEqual(self.search('продается машины'), [bb.title])
+        self.assertEqual(self.search('ЗЕЛЕНЫЙ'), [bb.title])
+        Bb.objects.filter(pk=bb.pk).update(title='Велосипед')  # без сигналов - только триггер
+        self.assertEqual(self.search('машина'), [])
+        self.assertEqual(self.search('велосипеды'), ['Велосипед'])
+        Bb.objects.filter(pk=bb.pk).delete()
+        self.assertEqual(self.search('велосипед'), [])
+
+    def test_ranking_and_highlight(self):
+        self.create('Шины', 'Летние шины для машины')
+        self.create('Машина', 'Машина на ходу, машина в хорошем состоянии')
+        self.assertEqual(self.search('машина'), ['Машина', 'Шины'])
+        backend = SQLiteFTSBackend()
+        bb = backend.highlight(backend.search(Bb.objects.filter(title='Шины'), 'машина'), 'машина')[0]
+        self.assertIn('<mark>машины</mark>', bb.content_highlight)
+
+
+class SharedCacheCheckTests(TestCase):
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+                       BBOARD_PROCESS_LOCAL_CACHE=False)
+    def test_process_local_cache(self):
+        self.assertEqual([warning.id for warning in check_shared_cache(None)], ['main.W001'])
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                           'LOCATION': '/tmp'}})
+    def test_shared_cache(self):
+        self.assertEqual(check_shared_cache(None), [])
+
+
+class SyntheticDataTests(TransactionTestCase):
+    """Генератор синтетических данных и нагрузочный замер на них"""
+
+    def setUp(self):
+        cache.clear()
+
+    def generate(self, seed=1, **kwargs):
+        generator = DataGenerator(seed=seed, until=timezone.now().date(), days=30, batch_size=7)
+        return generator.generate(users=5, super_rubrics=2, sub_rubrics=3, bbs=20, images=0, comments=60,
+                                  image_files=0, **kwargs)
+
+    def test_generate(self):
+        versions = get_cache_version(BBS_CACHE_NAME)
+        self.assertEqual(self.generate(), {'users': 5, 'rubrics': 6, 'bbs': 20})  # несколько порций по 7 записей
+        self.assertEqual((Bb.objects.count(), Comment.objects.count()), (20, 60))
+        self.assertEqual(get_cache_version(BBS_CACHE_NAME), versions + 1)  # bulk_create не отправляет сигналов
+        dates = list(Bb.objects.order_by('pk').values_list('created_at', flat=True))
+        self.assertEqual(dates, sorted(dates))  # объявления создаются в порядке ключей
+        self.assertGreater(dates[0], timezone.now() - timedelta(days=32))
+        self.assertFalse(Comment.objects.filter(created_at__lt=F('bb__created_at')).exists())
+
+    def test_same_seed(self):
+        self.generate()
+        first = list(Bb.objects.order_by('pk').values_list('title', 'price', 'created_at'))
+        Bb.objects.all().delete()
+        AdvUser.objects.all().delete()
+        SubRubric.objects.all().delete()
+        SuperRubric.objects.all().delete()
+        self.generate()
+        self.assertEqual(list(Bb.objects.order_by('pk').values_list('title', 'price', 'created_at')), first)
+
+    def test_routes(self):
+        routes = collect_routes('main.urls') + collect_routes('api.urls', '/api/')
+        self.assertIn('/<int:rubric_pk>/<int:pk>/', routes)
+        self.assertIn('/api/bbs/<int:pk>/comments/', routes)
+        self.assertNotIn('/accounts/logout/', routes)  # выход меняет состояние клиента
+        samples = {'bb': 5, 'rubric': 2}
+        self.assertEqual(build_url('/<int:rubric_pk>/<int:pk>/', samples), '/2/5/')
+        self.assertEqual(build_url('/<int:pk>/', samples), '/2/')  # единственный маршрут с ключом рубрики
+        self.assertIsNone(build_url('/accounts/password/reset/<uidb64>/<token>/', samples))
+        self.assertEqual(percentile([1, 2, 3, 4], 0.5), 2)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_benchmark(self):
+        with self.assertRaises(ValueError):  # замерять нечего
+            Benchmark().run([])
+        self.generate()
+        results = Benchmark(workers=1, requests=3).run(collect_routes('api.urls', '/api/'), only=['/api/bbs/'])
+        results = {result['route']: result for result in results}
+        self.assertEqual(set(results), {'/api/bbs/', '/api/bbs/search/', '/api/bbs/<int:pk>/',
+                                        '/api/bbs/<int:pk>/comments/'})
+        for result in results.values():
+            self.assertEqual((result['status'], result['requests']), ([200], 3))
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertGreater(results['/api/bbs/<int:pk>/comments/']['queries'], 0)
+        # другой Host разрешается только на время замера
+        [result] = Benchmark(workers=1, requests=1, host='bench.example').run(['/api/bbs/'])
+        self.assertEqual(result['status'], [200])
+        self.assertNotIn('bench.example', django_settings.ALLOWED_HOSTS)
+
+
+class ServerTimingTests(TestCase):
+    """Замеры запроса: заголовок Server-Timing и журнал медленных запросов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = AdvUser.objects.create_user('author', 'author@example.com')
+        rubric = SubRubric.objects.create(name='Рубрика', super_rubric=SuperRubric.objects.create(name='Раздел'))
+        Bb.objects.create(rubric=rubric, author=user, title='Объявление', content='-', contacts='-')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_header(self):
+        header = self.client.get('/')['Server-Timing']
+        for name in ('db', 'tpl', 'ctx'):
+            self.assertRegex(header, r'(^|, )%s;dur=[\d.]+;desc="\w[\w ]* \d+"' % name)
+        self.assertRegex(header, r', total;dur=[\d.]+$')
+        with override_settings(BBOARD_SERVER_TIMING=False):
+            self.client = self.client_class()  # посредники читают настройки при создании
+            self.assertFalse(self.client.get('/').has_header('Server-Timing'))
+
+    def test_timed(self):
+        with timed('tpl'):  # вне запроса ничего не замеряется
+            pass
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        try:
+            with timed('tpl'), timed('tpl'):  # вложенный замер с тем же именем не учитывается повторно
+                pass
+        finally:
+            current_timings.reset(token)
+        self.assertEqual(timings.counts['tpl'], 1)
+
+    @override_settings(BBOARD_SLOW_REQUEST_QUERIES=1)
+    def test_slow_request_log(self):
+        with self.assertLogs('main.middlewares', 'WARNING') as logs:
+            self.client.get('/?keyword=x')
+        data = json.loads(logs.records[0].getMessage().split(': ', 1)[1])
+        self.assertEqual((data['method'], data['path'], data['status']), ('GET', '/?keyword=x', 200))
+        self.assertGreaterEqual(data['queries'], 1)
+        self.assertEqual(data['timings']['db']['count'], data['queries'])
+
+    def test_repeated_sql(self):
+        timings = RequestTimings()
+        with connection.execute_wrapper(timings.execute):
+            for pk in (1, 2, 3):
+                list(Bb.objects.filter(pk=pk))
+            list(Comment.objects.all())
+        timings.finish()
+        [repeated] = timings.get_repeated()  # запросы с разными параметрами считаются вместе
+        self.assertEqual(repeated['count'], 3)
+        self.assertIn('"main_bb"', repeated['sql'])
+
+
+@override_settings(BBOARD_WRITE_ATTEMPTS=3, BBOARD_WRITE_RETRY_DELAY=0)
+class SQLiteTests(TransactionTestCase):
+    """Параметры соединений SQLite и повтор транзакций записи при блокировке базы"""
+
+    def get_pragmas(self, alias):
+        with connections[alias].cursor() as cursor:
+            return {name: cursor.execute('PRAGMA %s' % name).fetchone()[0]
+                    for name in ('journal_mode', 'synchronous', 'busy_timeout', 'temp_store')}
+
+    def test_pragmas(self):
+        with database_copy(None) as alias:  # параметры из BBOARD_SQLITE_PRAGMAS
+            self.assertEqual(self.get_pragmas(alias),
+                             {'journal_mode': 'wal', 'synchronous': 1, 'busy_timeout': 5000, 'temp_store': 2})
+        with database_copy({'journal_mode': 'DELETE', 'synchronous': 'FULL', 'busy_timeout': 100}) as alias:
+            self.assertEqual(self.get_pragmas(alias),  # ключ PRAGMAS базы заменяет параметры из настроек целиком
+                             {'journal_mode': 'delete', 'synchronous': 2, 'busy_timeout': 100, 'temp_store': 0})
+
+    def get_writer(self, *errors):
+        errors = list(errors)
+        self.calls = 0
+
+        def write():
+            self.calls += 1
+            SuperRubric.objects.create(name='Раздел %d' % self.calls)
+            if errors:
+                raise errors.pop(0)
+        return write
+
+    def test_retry(self):
+        write = self.get_writer(OperationalError('database is locked'), OperationalError('database table is locked'))
+        with self.assertLogs('main.sqlite', 'INFO') as logs:
+            write_transaction(write)()
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(list(SuperRubric.objects.values_list('name', flat=True)), ['Раздел 3'])  # прерванные откачены
+
+    def test_no_retry(self):
+        write = self.get_writer(*[OperationalError('database is locked')] * 3)
+        with self.assertLogs('main.sqlite', 'INFO'), self.assertRaises(OperationalError):
+            write_transaction(write)()
+        self.assertEqual(self.calls, 3)  # попытки исчерпаны
+        write = self.get_writer(OperationalError('no such table'))
+        with self.assertRaises(OperationalError):
+            write_transaction(write)()
+        self.assertEqual(self.calls, 1)  # другие ошибки не повторяются
+        write = self.get_writer(OperationalError('database is locked'))
+        with self.assertRaises(OperationalError), transaction.atomic():
+            write_transaction(write)()
+        self.assertEqual(self.calls, 1)  # внутри чужой транзакции повтор невозможен
+        self.assertFalse(SuperRubric.objects.exists())
+
+
+class QueryPlanTests(TestCase):
+    """Планы запросов к объявлениям и комментариям. Каждый такой запрос, выполняемый контроллером,
+    должен читать диапазон индекса: полный просмотр таблицы или сортировка во временном B-дереве
+    означают, что индекс перестал подходить к запросу"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = AdvUser.objects.create_user('author', 'author@example.com', 'password')
+        other = AdvUser.objects.create_user('other', 'other@example.com', 'password')
+        super_rubric = SuperRubric.objects.create(name='Транспорт')
+        cls.rubric = SubRubric.objects.create(name='Автомобили', super_rubric=super_rubric)
+        another_rubric = SubRubric.objects.create(name='Мотоциклы', super_rubric=super_rubric)
+        cls.bb = None
+        for i in range(30):
+            bb = Bb.objects.create(rubric=cls.rubric if i % 2 else another_rubric, author=cls.user if i % 3 else other,
+                                   title='Объявление %d' % i, content='Описание %d' % i, price=i * 100,
+                                   contacts='-', is_active=bool(i % 5))
+            if bb.is_active and cls.bb is None:
+                cls.bb = bb
+        Comment.objects.bulk_create([Comment(bb=cls.bb, author='Гость %d' % i, content='Комментарий %d' % i,
+                                             is_active=bool(i % 4)) for i in range(50)])
+
+    def get_plan(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexedQueries(self, url, **extra):
+        cache.clear()  # иначе страницы и выборки придут из кэша, и запросов не будет
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **extra)
+        self.assertEqual(response.status_code, 200)
+        checked = 0
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or not any('"%s"' % table in sql for table in HOT_TABLES):
+                continue
+            checked += 1
+            for step in self.get_plan(sql):
+                self.assertIsNone(SCAN_RE.match(step), 'Полный просмотр таблицы (%s):\n%s' % (step, sql))
+                self.assertNotIn('TEMP B-TREE', step, 'Сортировка без индекса (%s):\n%s' % (step, sql))
+        self.assertTrue(checked, 'Контроллер не выполнил ни одного запроса к объявлениям или комментариям')
+        return response
+
+    def get_cursor(self, queryset):
+        return CursorPaginator(queryset, 2).get_page().next_cursor
+
+    def test_index(self):
+        self.assertIndexedQueries('/')
+
+    def test_by_rubric(self):
+        self.assertIndexedQueries('/%d/' % self.rubric.pk)
+        cursor = self.get_cursor(Bb.objects.filter(is_active=True, rubric=self.rubric))
+        self.assertIndexedQueries('/%d/?cursor=%s' % (self.rubric.pk, cursor))
+
+    def test_by_rubric_filters(self):
+        url = '/%d/' % self.rubric.pk
+        bbs = Bb.objects.filter(is_active=True, rubric=self.rubric)
+        for sort in SORTS:
+            self.assertIndexedQueries(url + '?sort=' + sort)
+            cursor = get_paginator(bbs, sort, 2).get_page().next_cursor
+            self.assertIndexedQueries(url + '?sort=%s&cursor=%s' % (sort, cursor))
+            for filters in ('price=1', 'photo=1', 'days=7', 'price=0&photo=0&days=30'):
+                self.assertIndexedQueries(url + '?sort=%s&%s' % (sort, filters))
+
+    def test_profile(self):
+        self.client.force_login(self.user)
+        self.assertIndexedQueries('/accounts/profile/')
+        cursor = self.get_cursor(Bb.objects.filter(author=self.user))
+        self.assertIndexedQueries('/accounts/profile/?cursor=%s' % cursor)
+
+    def test_detail(self):
+        self.assertIndexedQueries('/detail/%d/' % self.bb.pk)
+        self.assertIndexedQueries('/%d/%d/' % (self.bb.rubric_id, self.bb.pk))
+
+    def test_comments(self):
+        response = self.assertIndexedQueries('/detail/%d/comments/' % self.bb.pk)
+        cursor = re.search(r'cursor=([\w-]+)', response.content.decode()).group(1)
+        self.assertIndexedQueries('/detail/%d/comments/?cursor=%s' % (self.bb.pk, cursor))
+
+    def test_api_bbs(self):
+        self.assertIndexedQueries('/api/bbs/')
+        self.assertIndexedQueries('/api/bbs/?rubric=%d' % self.rubric.pk)
+        self.assertIndexedQueries('/api/bbs/?cursor=%s' % self.get_cursor(Bb.objects.filter(is_active=True)))
+        self.assertIndexedQueries('/api/bbs/?since=2000-01-01T00:00:00Z')
+
+    def test_api_comments(self):
+        self.assertIndexedQueries('/api/bbs/%d/comments/' % self.bb.pk)
+        self.assertIndexedQueries('/api/bbs/%d/comments/?after=2000-01-01T00:00:00Z' % self.bb.pk)
+
+
+@override_settings(BBOARD_QUERY_CHECKS='raise')
+class QueryChecksTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = AdvUser.objects.create_user('author', 'author@example.com', 'password')
+        super_rubric = SuperRubric.objects.create(name='Транспорт')
+        rubrics = [SubRubric.objects.create(name='Рубрика %d' % i, super_rubric=super_rubric) for i in range(6)]
+        Bb.objects.bulk_create([Bb(rubric=rubric, author=user, title='Объявление', content='-', contacts='-')
+                                for rubric in rubrics])
+
+    def test_n_plus_one_raises(self):
+        with self.assertRaises(NPlusOneError) as context:
+            with wrap_queries(NPlusOneDetector('raise', 5)):
+                [bb.rubric.name for bb in Bb.objects.all()]
+        self.assertIn('test_n_plus_one_raises', str(context.exception))  # стек вызовов ведет сюда
+
+    def test_select_related_passes(self):
+        with wrap_queries(NPlusOneDetector('raise', 5)):
+            [str(bb.rubric) for bb in Bb.objects.select_related('rubric__super_rubric')]
+            [str(rubric) for rubric in SubRubric.objects.all()]  # надрубрики загружает менеджер
+
+    def test_query_budget(self):
+        @query_budget(1)
+        def view(request):
+            return HttpResponse(str(list(Bb.objects.all())) + str(list(Comment.objects.all())))
+
+        with self.assertRaises(QueryBudgetExceeded):
+            view(RequestFactory().get('/'))
+
+    def test_log_mode_sampling(self):
+        @query_budget(0)
+        def view(request):
+            return HttpResponse(str(list(Bb.objects.all())))
+
+        for rate, logged in ((0, False), (1, True)):
+            with override_settings(BBOARD_QUERY_CHECKS='log', BBOARD_QUERY_CHECKS_SAMPLE_RATE=rate), \
+                    self.assertLogs('main.querychecks', 'WARNING') as logs:
+                logging.getLogger('main.querychecks').warning('-')  # assertLogs требует хотя бы одну запись
+                view(RequestFactory().get('/'))
+            self.assertEqual(len(logs.records) > 1, logged)
+
+
+@override_settings(BBOARD_DATABASE_REPLICAS=('replica',), BBOARD_REPLICA_MAX_LAG=2)
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        cache.set(LAG_KEY % 'replica', {'at': time.time(), 'lag': 0})  # реплика догнала основную базу
+        self.router = PrimaryReplicaRouter()
+        self.state = RoutingState()
+        token = current_routing.set(self.state)
+        self.addCleanup(current_routing.reset, token)
+
+    def test_replica_only_when_allowed(self):
+        self.assertIsNone(self.router.db_for_read(Bb))
+        self.state.replica = True
+        self.assertEqual(self.router.db_for_read(Bb), 'replica')
+
+    def test_lagging_replica(self):
+        self.state.replica = True
+        cache.set(LAG_KEY % 'replica', {'at': time.time(), 'lag': 30})
+        self.assertEqual(self.router.db_for_read(Bb), 'default')
+
+    def test_write_pins_to_primary(self):
+        self.state.replica = True
+        self.assertEqual(self.router.db_for_write(Bb), 'default')
+        self.assertIsNone(self.router.db_for_read(Bb))
+        other = RoutingState()  # другие посетители читают реплику, пока она не отстает больше допустимого
+        other.replica = True
+        current_routing.set(other)
+        self.assertEqual(self.router.db_for_read(Bb), 'replica')
+
+    def test_pin_cookie(self):
+        current_routing.set(None)
+        cache.set(LAG_KEY % 'replica', {'at': time.time(), 'lag': 30})  # в тестах реплики нет, читается основная база
+        user = AdvUser.objects.create_user('author', 'author@example.com', 'password')
+        bb = Bb.objects.create(rubric=SubRubric.objects.create(name='Рубрика'), author=user, title='Объявление',
+                               content='-', contacts='-')
+        self.client.force_login(user)
+        response = self.client.get('/api/bbs/')
+        self.assertNotIn('bboard_primary', response.cookies)
+        response = self.client.post('/api/bbs/%d/comments/' % bb.pk, {'bb': bb.pk, 'author': 'author', 'content': '-'})
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('bboard_primary', response.cookies)
+
+
+class ContentStorageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, BBOARD_MEDIA_PURGE_GRACE=60)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def test_deduplication(self):
+        name = content_storage.save('photo.JPG', ContentFile(b'photo'))
+        self.assertRegex(name, r'^([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.jpg$')
+        self.assertEqual(content_storage.save('other.jpg', ContentFile(b'photo')), name)
+        self.assertNotEqual(content_storage.save('photo.jpg', ContentFile(b'another photo')), name)
+
+    def test_purge_keeps_referenced_files(self):
+        user = AdvUser.objects.create_user('author', 'author@example.com', 'password')
+        rubric = SubRubric.objects.create(name='Рубрика')
+        name = content_storage.save('photo.jpg', ContentFile(b'photo'))
+        bbs = [Bb.objects.create(rubric=rubric, author=user, title='Объявление', content='-', contacts='-', image=name)
+               for i in range(2)]
+        old = time.time() - 3600
+        os.utime(content_storage.path(name), (old, old))
+        Bb.objects.filter(pk=bbs[0].pk).delete()
+        purge_files([name], scheduled_at=time.time())
+        self.assertTrue(content_storage.exists(name))  # на файл ссылается второе объявление
+        Bb.objects.filter(pk=bbs[1].pk).delete()
+        content_storage.save('again.jpg', ContentFile(b'photo'))  # такой же файл загружают снова
+        purge_files([name], scheduled_at=time.time())
+        self.assertTrue(content_storage.exists(name))
+        purge_files([name], scheduled_at=time.time() + 120)
+        self.assertFalse(content_storage.exists(name))
+
+    def test_deduplication_keeps_thumbnails(self):
+        user = AdvUser.objects.create_user('author', 'author@example.com', 'password')
+        image = io.BytesIO()
+        Image.new('RGB', (400, 300), (0, 0, 200)).save(image, 'JPEG')
+        name = content_storage.save('photo.jpg', ContentFile(image.getvalue()))
+        generate_thumbnails(name)
+        bb = Bb.objects.create(rubric=SubRubric.objects.create(name='Рубрика'), author=user, title='Объявление',
+                               content='-', contacts='-', image=name)
+        self.assertIsNotNone(get_existing_thumbnail(bb.image, 'default'))
+        time.sleep(0.01)
+        # такой же файл загружают снова: файл не становится новее миниатюр, и они остаются действительными
+        self.assertEqual(content_storage.save('again.jpg', ContentFile(image.getvalue())), name)
+        thumbnail = get_existing_thumbnail(Bb.objects.get(pk=bb.pk).image, 'default')
+        self.assertIsNotNone(thumbnail)
+        Bb.objects.filter(pk=bb.pk).delete()
+        purge_files([name], scheduled_at=time.time() + 120)  # миниатюры учтены в том же хранилище и удаляются
+        self.assertFalse(content_storage.exists(thumbnail.name))
+
+
+class DeletionTests(TransactionTestCase):
+    """Удаление объявлений набором запросов DELETE: зависимые записи удаляются сразу,
+    файлы - фоновой задачей, кэши сбрасываются после фиксации транзакции"""
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root, BBOARD_MEDIA_PURGE_GRACE=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = AdvUser.objects.create_user('author', 'author@example.com')
+        rubric = SubRubric.objects.create(name='Рубрика')
+        self.names = [content_storage.save('photo.jpg', ContentFile(b'photo %d' % i)) for i in range(2)]
+        self.bb = Bb.objects.create(rubric=rubric, author=self.user, title='Объявление', content='-', contacts='-',
+                                    image=self.names[0])
+        AdditionalImage.objects.create(bb=self.bb, image=self.names[1])
+        for i in range(3):
+            Comment.objects.create(bb=self.bb, author='Гость', content='Комментарий %d' % i)
+        Job.objects.all().delete()  # миниатюры для этих тестов не нужны
+
+    def test_delete(self):
+        pk = self.bb.pk
+        versions = [get_cache_version(name) for name in (BBS_CACHE_NAME, get_bb_cache_name(pk))]
+        with self.assertNumQueries(10):  # не зависит от количества комментариев и иллюстраций
+            self.bb.delete()
+        for model in (Bb, AdditionalImage, Comment, CommentEvent):
+            self.assertFalse(model.objects.exists(), model.__name__)
+        self.assertEqual([get_cache_version(name) for name in (BBS_CACHE_NAME, get_bb_cache_name(pk))],
+                         [version + 1 for version in versions])
+        self.assertTrue(all(content_storage.exists(name) for name in self.names))  # файлы удаляет задача
+        self.assertEqual(list(Job.objects.values_list('name', flat=True)), ['purge_files'])
+        run_jobs()
+        self.assertFalse(any(content_storage.exists(name) for name in self.names))
+
+    def test_rollback(self):
+        version = get_cache_version(BBS_CACHE_NAME)
+        with self.assertRaises(ValueError), transaction.atomic():
+            delete_bbs(Bb.objects.all())
+            raise ValueError
+        self.assertEqual(Comment.objects.count(), 3)
+        self.assertFalse(Job.objects.exists())  # файлы отмененного удаления в очередь не попадают
+        self.assertEqual(get_cache_version(BBS_CACHE_NAME), version)
+
+    def test_delete_user(self):
+        self.user.delete()
+        self.assertFalse(Bb.objects.exists())
+        self.assertEqual(list(Job.objects.values_list('name', flat=True)), ['purge_files'])
+
+
+class ImageVariantsTests(TestCase):
+    """Варианты изображения в AVIF и WebP: режим исходного изображения приводится к RGB,
+    неподдерживаемый или сломанный формат пропускается, остальные создаются"""
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def save_image(self, mode, image_format):
+        image = Image.linear_gradient('L').resize((400, 300))
+        image = Image.merge('RGB', (image, image.rotate(90), image.point(lambda value: 255 - value)))
+        buffer = io.BytesIO()
+        image.convert(mode).save(buffer, image_format)
+        return content_storage.save('photo.' + image_format.lower(), ContentFile(buffer.getvalue()))
+
+    def get_types(self, name):
+        return [mime_type for mime_type, variant in get_variants(name)]
+
+    def test_modes(self):
+        for mode, image_format in (('CMYK', 'JPEG'), ('P', 'PNG')):
+            with self.subTest(mode=mode):
+                name = self.save_image(mode, image_format)
+                generate_variants(name)
+                self.assertEqual(self.get_types(name), ['image/avif', 'image/webp'])
+                with content_storage.open(name + '.webp') as file, Image.open(file) as variant:
+                    self.assertEqual((variant.format, variant.size), ('WEBP', (400, 300)))
+
+    def test_unsupported_format(self):
+        name = self.save_image('RGB', 'JPEG')
+        with mock.patch('main.images.features.check', lambda feature: feature != 'avif'):
+            generate_variants(name)
+        self.assertEqual(self.get_types(name), ['image/webp'])
+
+    def test_failed_format(self):
+        name = self.save_image('RGB', 'JPEG')
+        with mock.patch.dict(VARIANT_FORMATS, avif=('UNKNOWN', 'image/avif', {})), \
+                self.assertLogs('main.images', 'WARNING'):
+            generate_variants(name)
+        self.assertEqual(self.get_types(name), ['image/webp'])
+
+
+class MediaDeliveryTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings = override_settings(MEDIA_ROOT=media_root)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.name = content_storage.save('photo.jpg', ContentFile(bytes(range(256)) * 4))
+        self.url = '/media/' + self.name
+
+    def test_caching(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(256)) * 4)
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_range(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=256-259')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 256-259/1024')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(4)))
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=2000-').status_code, 416)
+
+    @override_settings(BBOARD_MEDIA_ACCEL='nginx')
+    def test_accel_redirect(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.name)
+        self.assertEqual(response.content, b'')
+
+
+class FacetTests(TransactionTestCase):
+    """Счетчики объявлений рубрики изменяются после фиксации транзакции, поэтому данные теста
+    сохраняются в базе, а не остаются в транзакции TestCase"""
+
+    def setUp(self):
+        cache.clear()
+        author = AdvUser.objects.create_user('author', 'author@example.com')
+        self.rubric = SubRubric.objects.create(name='Автомобили', super_rubric=SuperRubric.objects.create(name='Транспорт'))
+        self.bbs = [Bb.objects.create(rubric=self.rubric, author=author, title='Объявление', content='-', price=price,
+                                      image=image) for price, image in ((500, 'a.jpg'), (5000, ''), (5000, 'b.jpg'))]
+
+    def test_facets(self):
+        expected = {'total': 3, 'image': 2, 'price_0': 1, 'price_1': 2, 'price_2': 0, 'price_3': 0, 'price_4': 0}
+        with self.assertNumQueries(1):
+            self.assertEqual(get_facets(self.rubric.pk), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_facets(self.rubric.pk), expected)
+
+    def test_reset_on_change(self):
+        get_facets(self.rubric.pk)
+        cheap, plain, expensive = self.bbs
+        plain.title = 'Новое название'
+        with CaptureQueriesContext(connection) as queries:
+            plain.save()
+        # прежние значения читаются одним запросом на все обработчики pre_save
+        self.assertEqual(sum(query['sql'].startswith('SELECT') for query in queries), 1)
+        with self.assertNumQueries(0):  # название на счетчики не влияет
+            get_facets(self.rubric.pk)
+        expensive.price = 200000
+        expensive.save()
+        plain.is_active = False
+        plain.save()
+        expected = {'total': 2, 'image': 2, 'price_0': 1, 'price_1': 0, 'price_2': 0, 'price_3': 1, 'price_4': 0}
+        with self.assertNumQueries(1):
+            self.assertEqual(get_facets(self.rubric.pk), expected)
+        cheap.delete()  # удаление идет без сигналов, и счетчики рубрики пересчитываются
+        with self.assertNumQueries(1):
+            self.assertEqual(get_facets(self.rubric.pk)['price_0'], 0)
+        Bb.objects.filter(pk=expensive.pk).update(price=10)
+        reset_facets([self.rubric.pk])
+        self.assertEqual(get_facets(self.rubric.pk)['price_0'], 1)
+
+    def test_filters(self):
+        url = '/%d/' % self.rubric.pk
+        self.assertEqual(len(self.client.get(url + '?price=1').context['bbs']), 2)
+        self.assertEqual([bb.price for bb in self.client.get(url + '?price=1&photo=0').context['bbs']], [5000])
+        self.assertEqual([bb.price for bb in self.client.get(url + '?sort=price').context['bbs']], [500, 5000])
+        response = self.client.get(url + '?sort=-price&price=99&days=x')  # неверные фильтры не применяются
+        self.assertEqual([bb.pk for bb in response.context['bbs']], [self.bbs[2].pk, self.bbs[1].pk])
+        self.assertContains(response, '1\xa0000 – 10\xa0000</a> (2)')
+
+
+class ASGIHandlerTests(TransactionTestCase):
+    """Представления выполняются в потоках пула со своими соединениями, поэтому данные теста
+    должны быть сохранены в базе, а не оставаться в транзакции TestCase"""
+
+    def setUp(self):
+        self.handler = ASGIHandler(threads=4)
+        self.addCleanup(self.handler.executor.shutdown)
+
+    async def request(self, path, headers=()):
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'root_path': '',
+                 'headers': [(b'host', b'testserver')] + list(headers)}
+        await self.handler(scope, receive, send)
+        return messages[0]['status'], b''.join(message.get('body', b'') for message in messages[1:])
+
+    async def request_all(self, *requests):
+        return await asyncio.gather(*(self.request(*request) for request in requests))
+
+    def test_concurrent_requests(self):
+        super_rubric = SuperRubric.objects.create(name='Недвижимость')
+        Bb.objects.create(rubric=SubRubric.objects.create(name='Дома', super_rubric=super_rubric),
+                          author=AdvUser.objects.create_user('author'), title='Дом', content='Описание', contacts='-')
+        for status, body in asyncio.run(self.request_all(*[('/api/bbs/',)] * 4)):
+            self.assertEqual(status, 200)
+            self.assertIn('Дом', body.decode())
+
+    def test_streaming_response(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        with override_settings(MEDIA_ROOT=media_root):
+            name = content_storage.save('photo.jpg', ContentFile(bytes(range(256))))
+            [(status, body)] = asyncio.run(self.request_all(('/media/' + name, [(b'range', b'bytes=16-31')])))
+        self.assertEqual(status, 206)
+        self.assertEqual(body, bytes(range(16, 32)))
+
+
+@override_settings(BBOARD_EXPORT_TOKENS=('partner-key',))
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super_rubric = SuperRubric.objects.create(name='Транспорт')
+        rubric = SubRubric.objects.create(name='Автомобили', super_rubric=super_rubric)
+        author = AdvUser.objects.create_user('author')
+        cls.bb = Bb.objects.create(rubric=rubric, author=author, title='Машина', content='Описание, "новая"',
+                                   price=100, contacts='-', image='ab/cd/photo.jpg')
+        cls.bb.additionalimage_set.create(image='ef/01/other.jpg')
+        cls.hidden = Bb.objects.create(rubric=rubric, author=author, title='Снято', content='-', contacts='-',
+                                       is_active=False)
+        Comment.objects.create(bb=cls.bb, author='Гость', content='Комментарий')
+
+    def read_ndjson(self, data):
+        return [json.loads(line) for line in data.decode().splitlines()]
+
+    def test_ndjson(self):
+        [row] = self.read_ndjson(b''.join(stream_export(BbExport(base_url='https://example.com'))))
+        self.assertEqual(row['id'], self.bb.pk)
+        self.assertEqual((row['rubric_name'], row['super_rubric_name']), ('Автомобили', 'Транспорт'))
+        self.assertEqual(row['image'], 'https://example.com/media/ab/cd/photo.jpg')
+        self.assertEqual(row['images'], ['https://example.com/media/ef/01/other.jpg'])
+        self.bb.refresh_from_db()
+        self.assertEqual(row['updated_at'], self.bb.updated_at.isoformat().replace('+00:00', 'Z'))
+
+    def test_datetimes_match_serializer(self):
+        fast = CommentExport()
+        slow = CommentExport()
+        slow.raw_datetimes = False
+        self.assertTrue(fast.raw_datetimes)
+        self.assertEqual(b''.join(stream_export(fast)), b''.join(stream_export(slow)))
+
+    def test_since_includes_inactive(self):
+        rows = self.read_ndjson(b''.join(stream_export(BbExport(since=self.bb.updated_at))))
+        self.assertEqual([(row['id'], row['is_active']) for row in rows], [(self.hidden.pk, False)])
+
+    def test_endpoint(self):
+        self.assertEqual(self.client.get('/api/export/comments/').status_code, 403)
+        response = self.client.get('/api/export/comments/?format=csv', HTTP_AUTHORIZATION='Bearer partner-key',
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('X-Next-Since', response)
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        self.assertEqual(lines[0], 'id,bb,author,content,is_active,created_at')
+        self.assertEqual(len(lines), 2)
+
+
+class BbImportTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(MEDIA_ROOT=os.path.join(directory, 'media'))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.images = os.path.join(directory, 'images')
+        os.mkdir(self.images)
+        Image.new('RGB', (32, 32), (200, 0, 0)).save(os.path.join(self.images, 'red.jpg'))
+        super_rubric = SuperRubric.objects.create(name='Транспорт')
+        SubRubric.objects.create(name='Автомобили', super_rubric=super_rubric)
+        AdvUser.objects.create_user('author', 'author@example.com')
+        records = [
+            {'title': 'Машина', 'content': 'Описание', 'price': '100', 'rubric_name': 'Автомобили',
+             'author': 'author', 'image': 'red.jpg', 'images': ['red.jpg']},
+            {'title': 'Без рубрики', 'content': '-', 'rubric_name': 'Нет такой', 'author': 'author'},
+            {'title': 'Мотоцикл', 'content': '-', 'rubric': 'автомобили', 'author_email': 'AUTHOR@example.com',
+             'is_active': 'false', 'created_at': '2020-01-01T10:00:00Z'},
+        ]
+        self.path = os.path.join(directory, 'bbs.ndjson')
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.writelines(json.dumps(record, ensure_ascii=False) + '\n' for record in records)
+        self.rejected = []
+
+    def run_import(self, **kwargs):
+        importer = BbImporter('test', batch_size=2, image_root=self.images,
+                              reject=lambda number, error: self.rejected.append(number), **kwargs)
+        return importer.run(self.path)
+
+    def test_import(self):
+        self.assertEqual(self.run_import(), {'skipped': 0, 'imported': 2, 'rejected': 1})
+        self.assertEqual(self.rejected, [2])
+        car, motorcycle = Bb.objects.order_by('pk')
+        self.assertTrue(content_storage.exists(car.image.name))
+        self.assertEqual(list(car.additionalimage_set.values_list('image', flat=True)), [car.image.name])
+        self.assertFalse(motorcycle.is_active)
+        self.assertEqual(motorcycle.created_at.year, 2020)
+        self.assertEqual(Job.objects.filter(name='thumbnails').count(), 1)
+        checkpoint = ImportCheckpoint.objects.get(name='test')
+        self.assertEqual((checkpoint.position, checkpoint.imported, checkpoint.rejected), (3, 2, 1))
+        # повторный запуск продолжает с контрольной точки и ничего не дублирует
+        self.assertEqual(self.run_import(), {'skipped': 3, 'imported': 0, 'rejected': 0})
+        self.assertEqual(Bb.objects.count(), 2)
+
+    def test_dry_run(self):
+        self.assertEqual(self.run_import(dry_run=True), {'skipped': 0, 'imported': 2, 'rejected': 1})
+        self.assertFalse(Bb.objects.exists())
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+
+class BbImportCacheTests(TransactionTestCase):
+    """Кэши сбрасываются после фиксации транзакции каждой порции, поэтому данные сохраняются в базе"""
+    setUp = BbImportTests.setUp
+    run_import = BbImportTests.run_import
+
+    def test_cache_versions(self):
+        cache.clear()
+        rubric = SubRubric.objects.get()
+        get_facets(rubric.pk)
+        rubrics, bbs = get_cache_version(RUBRICS_CACHE_NAME), get_cache_version(BBS_CACHE_NAME)
+        self.run_import()
+        self.assertEqual(get_cache_version(RUBRICS_CACHE_NAME), rubrics)  # дерево рубрик импорт не меняет
+        self.assertGreater(get_cache_version(BBS_CACHE_NAME), bbs)
+        self.assertEqual(get_facets(rubric.pk)['total'], 1)  # счетчики рубрики пересчитаны
@@ -0,0 +1,73 @@
+from django.core.cache import cache
+from django.db.models.signals import post_save
+from easy_thumbnails.alias import aliases
+from easy_thumbnails.files import get_thumbnailer
+from easy_thumbnails.signals import thumbnail_missed
+
+from .models import Bb, AdditionalImage
+from .tasks import task, enqueue, enqueue_many
+from .timing import timed
+from .utilities import bump_cache_version, BBS_CACHE_NAME
+
+QUEUED_TIMEOUT = 60 * 10  # повторно ставить в очередь отсутствующую миниатюру не чаще, чем раз в 10 минут
+
+
+def get_image_storage():
+    """Хранилище полей image: миниатюры создаются и удаляются через то же хранилище, что и в шаблонах,
+    иначе easy_thumbnails вел бы для одного файла два разных учета миниатюр"""
+    return Bb._meta.get_field('image').storage
+
+
+@task('thumbnails')
+def generate_thumbnails(image):
+    """Создание всех миниатюр из THUMBNAIL_ALIASES для изображения image (имя файла в хранилище).
+    Списки объявлений, закэшированные с заглушкой вместо миниатюры, после этого сбрасываются"""
+    storage = get_image_storage()
+    if not storage.exists(image):  # изображение успели удалить
+        return
+    thumbnailer = get_thumbnailer(storage, image)
+    generated = False
+    for alias, options in aliases.all(include_global=True).items():
+        options = dict(options, ALIAS=alias)
+        if thumbnailer.get_existing_thumbnail(options) is None:
+            thumbnailer.get_thumbnail(options, generate=True)
+            generated = True
+    if generated:
+        bump_cache_version(BBS_CACHE_NAME)
+
+
+def enqueue_thumbnails(name):
+    """Постановка в очередь создания миниатюр изображения, если оно еще не стоит в очереди"""
+    if name and cache.add('thumbnails:queued:' + name, True, QUEUED_TIMEOUT):
+        enqueue('thumbnails', image=name)
+
+
+def enqueue_all_thumbnails(names):
+    """Постановка в очередь создания миниатюр для множества изображений"""
+    return enqueue_many('thumbnails', ({'image': name} for name in names if name))
+
+
+@timed('thumb')  # поиск готовой миниатюры - все, что осталось от работы с миниатюрами во время запроса
+def get_existing_thumbnail(image, alias):
+    """Готовая миниатюра изображения или None. Миниатюра никогда не создается во время запроса:
+    если ее нет, она ставится в очередь (через сигнал thumbnail_missed)"""
+    if not image:
+        return None
+    options = aliases.get(alias)
+    if not options:
+        return None
+    return get_thumbnailer(image).get_thumbnail(dict(options, ALIAS=alias), generate=False)
+
+
+def image_saved_dispatcher(sender, instance, **kwargs):
+    if instance.image:
+        enqueue_thumbnails(instance.image.name)  # миниатюры создаются заранее, а не при первом показе
+
+post_save.connect(image_saved_dispatcher, sender=Bb)
+post_save.connect(image_saved_dispatcher, sender=AdditionalImage)
+
+
+def thumbnail_missed_dispatcher(sender, **kwargs):
+    enqueue_thumbnails(sender.name)  # sender - Thumbnailer исходного изображения
+
+thumbnail_missed.connect(thumbnail_missed_dispatcher)
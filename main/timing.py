@@ -0,0 +1,113 @@
+import time
+from collections import Counter
+from contextlib import ContextDecorator
+from contextvars import ContextVar
+
+from django.template.backends import django as django_backend
+
+current_timings = ContextVar('current_timings', default=None)  # замеры запроса, обрабатываемого в этом потоке
+
+# имена замеров в заголовке Server-Timing и их описания (значение заголовка должно быть в ASCII)
+METRICS = (('db', 'SQL'), ('tpl', 'Templates'), ('ctx', 'Context processor'), ('thumb', 'Thumbnails'))
+
+
+class RequestTimings:
+    """Замеры одного запроса: время по категориям, количество SQL-запросов и число повторов каждого из них"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.durations = Counter()
+        self.counts = Counter()
+        self.statements = Counter()
+        self.active = set()
+        self.total = None
+
+    def add(self, name, duration):
+        self.durations[name] += duration
+        self.counts[name] += 1
+
+    def execute(self, execute, sql, params, many, context):
+        """Обертка выполнения SQL (connection.execute_wrapper). Запросы группируются по тексту
+        с заполнителями вместо параметров, поэтому одинаковые запросы с разными значениями считаются вместе"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', time.perf_counter() - started)
+            self.statements[sql] += 1
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    @property
+    def queries(self):
+        return self.counts['db']
+
+    def get_repeated(self, limit=5):
+        return [{'sql': sql, 'count': count} for sql, count in self.statements.most_common(limit) if count > 1]
+
+    def header(self):
+        """Значение заголовка Server-Timing, длительности в миллисекундах"""
+        parts = []
+        for name, description in METRICS:
+            if self.counts[name]:
+                parts.append('%s;dur=%.1f;desc="%s %d"' % (name, self.durations[name] * 1000, description,
+                                                           self.counts[name]))
+        parts.append('total;dur=%.1f' % (self.total * 1000))
+        return ', '.join(parts)
+
+    def as_dict(self):
+        return {'total_ms': round(self.total * 1000, 1), 'queries': self.queries,
+                'timings': {name: {'ms': round(self.durations[name] * 1000, 1), 'count': self.counts[name]}
+                            for name, description in METRICS if self.counts[name]},
+                'repeated_sql': self.get_repeated()}
+
+
+class timed(ContextDecorator):
+    """Замер участка кода в пределах текущего запроса: with timed('tpl'): ... или @timed('ctx').
+    Вне запроса ничего не делает. Вложенные замеры с тем же именем не суммируются повторно"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def _recreate_cm(self):
+        return type(self)(self.name)  # у декоратора свой объект на каждый вызов: вызовы бывают одновременными
+
+    def __enter__(self):
+        self.timings = current_timings.get()
+        if self.timings is None or self.name in self.timings.active:
+            self.timings = None
+        else:
+            self.timings.active.add(self.name)
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings.add(self.name, time.perf_counter() - self.started)
+            self.timings.active.discard(self.name)
+        return False
+
+
+class TimedTemplate:
+    """Шаблон, время формирования которого учитывается в замерах запроса"""
+
+    def __init__(self, template):
+        self.template = template
+
+    def __getattr__(self, name):
+        return getattr(self.template, name)
+
+    def render(self, context=None, request=None):
+        with timed('tpl'):
+            return self.template.render(context, request)
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """Обычный шаблонизатор Django с замером времени формирования шаблонов"""
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name))
@@ -1,12 +1,9 @@
 from django.urls import path
 
-from django.views.decorators.cache import never_cache
-from django.conf.urls.static import static, serve
 from django.urls import reverse_lazy
 from django.contrib.auth.views import PasswordResetConfirmView
-from bboard import settings
 
-from .views import detail, detail1, profile_bb_detail
+from .views import detail, comments, profile_bb_detail, search
 from .views import index, other_page, BBLoginView, profile, BBLogoutView, ChangeUserInfoView, BBPasswordChangeView, RegisterUserView, RegisterDoneView, by_rubric
 from .views import user_activate, DeleteUserView, BBPasswordResetView, BBPasswordResetDoneView, BBPasswordResetCompleteView, profile_bb_add, profile_bb_change, profile_bb_delete
 
@@ -14,9 +11,11 @@ from .views import user_activate, DeleteUserView, BBPasswordResetView, BBPasswor
 app_name = 'main'
 urlpatterns = [
 
-    path('detail/<int:pk>/', detail1, name='detail1'),
+    path('detail/<int:pk>/comments/', comments, name='comments'),
+    path('detail/<int:pk>/', detail, name='detail1'),
     path('<int:rubric_pk>/<int:pk>/', detail, name='detail'),
     path('<int:pk>/', by_rubric, name='by_rubric'),
+    path('search/', search, name='search'),
     path('<str:page>/', other_page, name='other'),
 
     path('', index, name='index'),
@@ -51,7 +50,3 @@ urlpatterns = [
 
 
 ]
-
-if settings.DEBUG:
-    urlpatterns.append(path('static/<path:path>', never_cache(serve)))
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
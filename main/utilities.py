@@ -1,22 +1,76 @@
+from django.core.cache import cache
 from django.template.loader import render_to_string
 from django.core.signing import Signer
 from bboard.settings import ALLOWED_HOSTS
 from datetime import datetime
+import time
 from os.path import splitext
 
 
 signer = Signer()
 
-def send_activation_notification(user):
-    """Функция отправки писем для активации пользователя"""
+def get_host():
+    """Адрес сайта для ссылок в письмах"""
     if ALLOWED_HOSTS:
-        host = 'http://' + ALLOWED_HOSTS[0]
+        return 'http://' + ALLOWED_HOSTS[0]
     else:
-        host = 'http//localhost:8000'
-    context = {'user': user, 'host': host, 'sign': signer.sign(user.username)}
+        return 'http://localhost:8000'
+
+def send_activation_notification(user):
+    """Функция отправки писем для активации пользователя"""
+    context = {'user': user, 'host': get_host(), 'sign': signer.sign(user.username)}
     subject = render_to_string('email/activation_letter_subject.txt', context)
     body_text = render_to_string('email/activation_letter_body.txt', context)
     user.email_user(subject, body_text)
 
 def get_timestamp_path(instance, filename):
     return '%s%s' % (datetime.now().timestamp(), splitext(filename)[1])
+
+RUBRICS_CACHE_NAME = 'rubrics'  # группа кэша с деревом рубрик
+BBS_CACHE_NAME = 'bbs'  # группа кэша со списками объявлений
+
+
+def get_bb_cache_name(pk):
+    """Группа кэша с данными одного объявления (страница, комментарии, иллюстрации)"""
+    return 'bb:%s' % pk
+
+
+def get_initial_version():
+    # версия начинается с текущего времени, а не с 1: если ключ версии вытеснят из кэша,
+    # новая версия не совпадет со старыми и устаревшие записи не оживут
+    return int(time.time() * 1000)
+
+
+def get_cache_version(name):
+    """Текущая версия группы закэшированных данных. Ключи кэша включают версию,
+    поэтому при ее увеличении старые записи просто перестают использоваться.
+    Версии действуют, только если кэш общий для всех процессов сайта (CACHES, проверка main.W001):
+    версию увеличивают и фоновые задачи, и команды управления"""
+    key = 'version:' + name
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, get_initial_version(), None)  # версия хранится бессрочно
+        version = cache.get(key)
+    return version
+
+
+def get_cache_versions(names):
+    """Версии нескольких групп одним обращением к кэшу"""
+    keys = ['version:' + name for name in names]
+    versions = cache.get_many(keys)
+    return [versions[key] if key in versions else get_cache_version(name) for key, name in zip(keys, names)]
+
+
+def bump_cache_version(name):
+    """Увеличение версии группы закэшированных данных (инвалидация)"""
+    key = 'version:' + name
+    try:
+        return cache.incr(key)
+    except ValueError:  # ключа еще нет в кэше
+        cache.add(key, get_initial_version(), None)
+        return cache.get(key)
+
+
+def bump_cache_versions(names):
+    for name in names:
+        bump_cache_version(name)
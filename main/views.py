@@ -8,18 +8,29 @@ from django.core.signing import BadSignature
 from django.http import HttpResponse, Http404
 from django.shortcuts import get_object_or_404, render, redirect
 from django.template import TemplateDoesNotExist
-from django.template.loader import get_template
+from django.template.loader import get_template, render_to_string
 from django.urls import reverse_lazy
 from django.views.generic.base import TemplateView
 from django.views.generic.edit import CreateView, DeleteView, UpdateView
 from django.core.paginator import Paginator
-from django.db.models import Q
-
-from .forms import ChangeUserInfoForm, RegisterUserForm, SearchForm, BbForm, AIFormSet, UserCommentForm, GuestCommentForm
-from .models import AdvUser, SubRubric, Bb, Comment
-from .utilities import signer
-
 
+from .forms import ChangeUserInfoForm, RegisterUserForm, SearchForm, BbFilterForm, BbForm, AIFormSet, UserCommentForm, GuestCommentForm
+from .details import get_bb_detail, get_comments_page
+from .facets import filter_bbs, get_facets, get_paginator
+from .images import normalize_uploads
+from .models import AdvUser, SubRubric, Bb
+from .pagecache import cache_anonymous_page, hole
+from .querychecks import query_budget
+from .routers import read_from_replica
+from .pagination import CursorPaginator
+from .search import get_search_backend
+from .sqlite import write_transaction
+from .utilities import signer, get_bb_cache_name, BBS_CACHE_NAME
+
+
+@query_budget(8)
+@read_from_replica
+@cache_anonymous_page(BBS_CACHE_NAME)
 def index(request):
     """Код основной страницы сайта, просто загружает шаблон"""
     bbs = Bb.objects.filter(is_active=True)[:10]
@@ -27,6 +38,7 @@ def index(request):
     return render(request, 'main/index.html', context)  #функция рендер создает страницу из шаблона
 
 
+@cache_anonymous_page()
 def other_page(request, page):
     """Переход на следующую страницу объявлений"""
     try:
@@ -45,11 +57,13 @@ class BBLogoutView(LoginRequiredMixin, LogoutView):
     template_name = 'main/logout.html'
 
 
+@query_budget(9)
 @login_required  #декоратор, проверяющий выполнил ли пользователь вход
 def profile(request):
     """код страницы профиля, доступен только пользователям, вполнившим вход"""
     bbs = Bb.objects.filter(author=request.user.pk)
-    context = {'bbs':bbs}
+    page = CursorPaginator(bbs, 10).get_page(request.GET.get('cursor'))  # постраничный вывод по курсору, без COUNT и OFFSET
+    context = {'bbs': page.object_list, 'page': page}
     return render(request, 'main/profile.html', context)
 
 
@@ -152,94 +166,138 @@ class BBPasswordResetCompleteView(PasswordResetCompleteView):  #основан 
 
     template_name = 'main/password_reset_complete.html'
 
+@query_budget(10)
+@read_from_replica
+@cache_anonymous_page(BBS_CACHE_NAME)
 def by_rubric(request, pk):
     """Функция для выыведения объявлений связанных с выбранной рубрикой"""
     rubric = get_object_or_404(SubRubric, pk=pk)  #Получаем название рубрики
     bbs = Bb.objects.filter(is_active=True, rubric=pk)  #Получаем все объявления, связанные с рубрикой
-    if 'keyword' in request.GET:  #Если осуществляется поиск по ключевому слову
-        keyword = request.GET['keyword']
-        q = Q(title__icontains=keyword) | Q(content__icontains=keyword)  #использование класса Q для применения сложной фильтрации
-        bbs = bbs.filter(q)
+    form = BbFilterForm(request.GET)
+    form.is_valid()  # в cleaned_data попадают только верные значения, остальные фильтры не применяются
+    filters = form.cleaned_data
+    bbs = filter_bbs(bbs, price=filters.get('price'), photo=filters.get('photo'), days=filters.get('days'),
+                     sort=filters.get('sort'))
+    search_backend = get_search_backend()
+    keyword = filters.get('keyword')
+    if keyword:  #Если осуществляется поиск по ключевому слову
+        bbs = search_backend.search(bbs, keyword)  # поиск по индексу, результаты упорядочены по релевантности
+        paginator = Paginator(bbs, 2)  # максимум 2 объявления на страницу. Нумерация страниц нужна из-за сортировки по релевантности
+        if 'page' in request.GET:
+            page_num = request.GET['page']
+        else:
+            page_num = 1
+        page = paginator.get_page(page_num)
+        bbs = search_backend.highlight(page.object_list, keyword)  # подсветка найденных слов
+    else:  # без поиска порядок задан полем с индексом, поэтому страницы выбираются по курсору
+        page = get_paginator(bbs, filters.get('sort'), 2).get_page(request.GET.get('cursor'))
+        bbs = page.object_list
+    facets = get_facets(rubric.pk)  # счетчики всей рубрики, без учета выбранных фильтров
+    # ссылки фильтров: (значение параметра, подпись, количество объявлений, выбран ли)
+    price_facets = [(bucket, label, facets['price_%d' % bucket], filters.get('price') == bucket)
+                    for bucket, label in form.fields['price'].choices if bucket != '']
+    photo_facets = [('1', 'С фото', facets['image'], filters.get('photo') is True),
+                    ('0', 'Без фото', facets['total'] - facets['image'], filters.get('photo') is False)]
+    context = {'rubric': rubric, 'page': page, 'bbs': bbs, 'form': form, 'keyword': keyword, 'facets': facets,
+               'price_facets': price_facets, 'photo_facets': photo_facets}
+    return render(request, 'main/by_rubric.html', context)
+
+
+@query_budget(10)
+@cache_anonymous_page(BBS_CACHE_NAME)
+def search(request):
+    """Поиск объявлений по ключевым словам во всех рубриках"""
+    keyword = request.GET.get('keyword', '')
+    search_backend = get_search_backend()
+    if keyword:
+        bbs = search_backend.search(Bb.objects.filter(is_active=True), keyword)
     else:
-        keyword = ''
+        bbs = Bb.objects.none()
     form = SearchForm(initial={'keyword': keyword})
-    paginator = Paginator(bbs, 2)  # максимум 2 объявления на страницу
-    if 'page' in request.GET:
-        page_num = request.GET['page']
-    else:
-        page_num = 1
-    page = paginator.get_page(page_num)
-    context = {'rubric': rubric, 'page': page, 'bbs': page.object_list, 'form': form}
-    return render(request, 'main/by_rubric.html', context)
+    paginator = Paginator(bbs, 10)
+    page = paginator.get_page(request.GET.get('page', 1))
+    bbs = search_backend.highlight(page.object_list, keyword)
+    context = {'page': page, 'bbs': bbs, 'form': form, 'query': keyword}
+    return render(request, 'main/search.html', context)
 
 
-def detail (request, rubric_pk, pk):
-    """ССодержание объявления"""
-    bb = Bb.objects.get(pk=pk)  # объект объявления
-    ais = bb.additionalimage_set.all()  # изображения, связанные с объявлением
-    comments = Comment.objects.filter(bb=pk, is_active=True)  # комментарии, связанные с объявлением(только с флажком активных)
-    initial = {'bb': bb.pk}
+def get_comment_form_class(request):
     if request.user.is_authenticated:  # если пользователь активирован
-        initial['author'] = request.user.username  # Автоматом заполняем поле автора
-        form_class = UserCommentForm  # выводим пользовательскую форму для комментариев(не требует капчу)
+        return UserCommentForm  # выводим пользовательскую форму для комментариев(не требует капчу)
     else:
-        form_class = GuestCommentForm  # в противном случае форма гостя. ТРЕБУЕТ КАПЧУ
-    form = form_class(initial=initial)
-    if request.method == 'POST':  #Если поступил пост запрос - добавление комментария и сохранение его в БД
-        c_form = form_class(request.POST)
-        if c_form.is_valid():
-            c_form.save()
-            messages.add_message(request, messages.SUCCESS, 'Комментарий добавлен')
-        else:
-            form = c_form
-            messages.add_message(request, messages.WARNING, 'Комментарий не добавлен')
-    context = {'bb': bb, 'ais': ais, 'comments': comments, 'form': form}
-    return render(request, 'main/detail.html', context)
+        return GuestCommentForm  # в противном случае форма гостя. ТРЕБУЕТ КАПЧУ
+
+
+@hole('comment_form')
+def render_comment_form(request, pk, **kwargs):
+    """Форма комментария для закэшированной страницы объявления: у каждого гостя своя капча и свой токен CSRF"""
+    form = get_comment_form_class(request)(initial={'bb': pk})
+    return render_to_string('main/comment_form.html', {'form': form}, request=request)
 
-def detail1 (request, pk):  #Сделал для деталей на главной странице. Вроде как костыль
-    bb = Bb.objects.get(pk=pk)
-    ais = bb.additionalimage_set.all()
-    comments = Comment.objects.filter(bb=pk, is_active=True)
-    initial = {'bb': bb.pk}
+
+@query_budget(14)
+@cache_anonymous_page(lambda pk, **kwargs: get_bb_cache_name(pk))
+def detail(request, pk, rubric_pk=None):
+    """Содержание объявления. Открывается и из рубрики (с rubric_pk), и с главной страницы"""
+    initial = {'bb': pk}
+    form_class = get_comment_form_class(request)
     if request.user.is_authenticated:
-        initial['author'] = request.user.username
-        form_class = UserCommentForm
-    else:
-        form_class = GuestCommentForm
+        initial['author'] = request.user.username  # Автоматом заполняем поле автора
     form = form_class(initial=initial)
-    if request.method == 'POST':
+    if request.method == 'POST':  #Если поступил пост запрос - добавление комментария и сохранение его в БД
         c_form = form_class(request.POST)
         if c_form.is_valid():
-            c_form.save()
+            write_transaction(c_form.save)()
             messages.add_message(request, messages.SUCCESS, 'Комментарий добавлен')
         else:
             form = c_form
             messages.add_message(request, messages.WARNING, 'Комментарий не добавлен')
-    context = {'bb': bb, 'ais': ais, 'comments': comments, 'form': form}
+    bb = get_bb_detail(pk)  # после добавления комментария кэш уже сброшен, и он попадет на страницу
+    context = {'bb': bb, 'ais': bb.additionalimage_set.all(), 'comments': bb.comments,
+               'comments_cursor': bb.comments_cursor, 'form': form}
     return render(request, 'main/detail.html', context)
 
+
+@query_budget(10)
+@cache_anonymous_page(lambda pk, **kwargs: get_bb_cache_name(pk))
+def comments(request, pk):
+    """Фрагмент со следующей порцией комментариев к объявлению для кнопки «Показать ещё»"""
+    get_bb_detail(pk)  # объявление обычно уже в кэше; для неактивного или удаленного - 404
+    page = get_comments_page(pk, request.GET.get('cursor'))
+    context = {'comments': page.object_list, 'cursor': page.next_cursor, 'bb_pk': pk}
+    return render(request, 'main/comments.html', context)
+
+@query_budget(9)
 @login_required  # только для пользователей, выполнивших вход
 def profile_bb_detail(request, pk):
     """Страница профиля пользователя"""
-    bb = get_object_or_404(Bb, pk=pk)  # Все связанные с ним объявления
+    bb = get_bb_detail(pk, active_only=False)  # объявление вместе с изображениями, в том числе скрытое из списков
     ais = bb.additionalimage_set.all()  #Изображения объявлений
     context = {'bb': bb, 'ais': ais}
     return render(request, 'main/profile_bb_detail.html', context)
 
 
+@write_transaction
+def save_bb(form, formset):
+    """Объявление и дополнительные изображения сохраняются одной транзакцией"""
+    bb = form.save()
+    formset.instance = bb
+    formset.save()
+    return bb
+
+
 @login_required
 def profile_bb_add(request):
     """Функция для добавления объявления пользователем"""
     if request.method == 'POST':
         form = BbForm(request.POST, request.FILES)  #В форму необходимо передавать 2 аргументом request.FILES, чтобы не потерять изображения
-        if form.is_valid():
-            bb = form.save()
-            formset = AIFormSet(request.POST, request.FILES, instance=bb)  #Необходимо для добавления изображений в объявленгие
-            if formset.is_valid():
-                formset.save()
-                messages.add_message(request, messages.SUCCESS, 'Объявление добавлено')
-
-                return redirect('main:profile')
+        formset = AIFormSet(request.POST, request.FILES, instance=form.instance)  #Необходимо для добавления изображений в объявленгие
+        if form.is_valid() and formset.is_valid():
+            normalize_uploads([form] + formset.forms)
+            save_bb(form, formset)
+            messages.add_message(request, messages.SUCCESS, 'Объявление добавлено')
+
+            return redirect('main:profile')
     else:
         form = BbForm(initial={'author': request.user.pk})
         formset = AIFormSet()
@@ -253,14 +311,13 @@ def profile_bb_change(request, pk):
     bb = get_object_or_404(Bb, pk=pk)
     if request.method == 'POST':
         form = BbForm(request.POST, request.FILES, instance=bb)
-        if form.is_valid():
-            bb = form.save()
-            formset = AIFormSet(request.POST, request.FILES, instance=bb)
-            if formset.is_valid():
-                formset.save()
-                messages.add_message(request, messages.SUCCESS, 'Объявление исправлено')
-
-                return redirect('main:profile')
+        formset = AIFormSet(request.POST, request.FILES, instance=bb)
+        if form.is_valid() and formset.is_valid():
+            normalize_uploads([form] + formset.forms)
+            save_bb(form, formset)
+            messages.add_message(request, messages.SUCCESS, 'Объявление исправлено')
+
+            return redirect('main:profile')
     else:
         form = BbForm(instance=bb)
         formset = AIFormSet(instance=bb)
@@ -5,7 +5,8 @@ import sys
 
 
 def main():
-    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bboard.settings')
+    # тесты по умолчанию запускаются с bboard.settings_test: в них проверки SQL-запросов строгие
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'bboard.settings_test' if sys.argv[1:2] == ['test'] else 'bboard.settings')
     try:
         from django.core.management import execute_from_command_line
     except ImportError as exc: